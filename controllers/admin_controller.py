@@ -0,0 +1,120 @@
+"""
+This file creates the admin routes used by the maintainers to look into how the
+application is running, such as the slow query log, and to roll courses over into
+a new term, through REST API design using Flask Blueprint. Only the clients listed
+in ADMIN_ALLOWED_CLIENTS can use them.
+"""
+
+# Built-in imports
+from datetime import date
+
+# Installed import packages
+from flask import Blueprint, jsonify, request, current_app
+
+# Local imports
+from init import db
+from utils.query_budget import query_budget
+from utils.rollover import RolloverError, plan_rollover, rollover_term
+from utils.terms import current_term_start
+from utils.statement_timeouts import statement_timeout
+
+
+# Create the Template Web Application Interface for admin routes to be applied 
+# to the Flask application
+admin_bp = Blueprint("admin", __name__, url_prefix = "/admin")
+
+
+"""
+Admin Controller Messages
+"""
+
+def error_not_allowed():
+    return {"message": "This route is only available to administrators."}, 403
+
+def error_slow_query_log_disabled():
+    return {"message": "The slow query log is turned off. Set SLOW_QUERY_MS to turn it on."}, 404
+
+def error_invalid_rollover():
+    return {"message": "Request body must give a term_start date and valid rollover options."}, 400
+
+def error_rollover_failed(err):
+    if err.report:
+        return {"message": err.message, "conflicts": err.report["conflicts"]}, err.status_code
+    return {"message": err.message}, err.status_code
+
+
+"""
+API Routes
+"""
+
+@admin_bp.before_request
+def allow_admin_clients():
+    """
+    Only let the clients listed in ADMIN_ALLOWED_CLIENTS use the admin routes.
+    """
+    if request.remote_addr not in current_app.config["ADMIN_ALLOWED_CLIENTS"]:
+        return error_not_allowed()
+    return None
+
+
+@admin_bp.route("/slow-queries")
+@query_budget(0)
+def get_slow_queries():
+    """
+    Retrieve the latest slow queries, newest first, with the captured plans.
+    """
+    log = current_app.extensions.get("slow_query_log")
+    if log is None:
+        return error_slow_query_log_disabled()
+
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE_DEFAULT"], type = int)
+    limit = max(1, min(limit, current_app.config["PAGE_SIZE_MAX"]))
+    return jsonify(log.store.recent(limit))
+
+
+@admin_bp.route("/rollover", methods = ["POST"])
+@query_budget(7)
+@statement_timeout(120000)
+def rollover_courses():
+    """
+    Clone courses into a new term and carry their students over, in one
+    transaction, as 'flask db rollover' does. The body names the new term's
+    first day and the rollover options, e.g. {"term_start": "2027-02-01",
+    "courses": [1, 2], "replace": ["2026", "2027"], "teachers": {"4": 7}}.
+    With "dry_run": true it only reports what would be rolled over.
+    Waitlists are not carried over.
+    """
+    # Fetch the rollover options from the request body. Object keys arrive
+    # as strings, so the ids in them are read back as numbers
+    bodyData = request.get_json(silent = True) or {}
+    try:
+        since = bodyData.get("since")
+        since = date.fromisoformat(since) if since else current_term_start()
+        options = {
+            "course_ids": [int(course) for course in bodyData.get("courses") or []],
+            "names": {int(course): str(name) for course, name in (bodyData.get("names") or {}).items()},
+            "replace": tuple(map(str, bodyData["replace"])) if bodyData.get("replace") else None,
+            "suffix": bodyData.get("suffix"),
+            "teachers": {int(old): int(new) for old, new in (bodyData.get("teachers") or {}).items()},
+            "course_teachers": {
+                int(course): int(teacher) for course, teacher in (bodyData.get("course_teachers") or {}).items()
+            },
+            "excluded_students": [int(student) for student in bodyData.get("exclude_students") or []],
+            "carry_enrolments": bool(bodyData.get("carry_enrolments", True))
+        }
+        if options["replace"] is not None and len(options["replace"]) != 2:
+            return error_invalid_rollover()
+        termStart = None if bodyData.get("dry_run") else date.fromisoformat(bodyData["term_start"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return error_invalid_rollover()
+
+    # Report the plan, or carry it out and commit it
+    try:
+        if termStart is None:
+            return jsonify(plan_rollover(since, **options)), 200
+        report = rollover_term(termStart, since, **options)
+    except RolloverError as err:
+        db.session.rollback()
+        return error_rollover_failed(err)
+    db.session.commit()
+    return jsonify(report), 201
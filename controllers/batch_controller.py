@@ -0,0 +1,72 @@
+"""
+This file creates the batch route, which runs many create and update operations on
+students, teachers, courses and enrolments in one request and one transaction,
+through REST API design using Flask Blueprint.
+"""
+
+# Installed import packages
+from flask import Blueprint, jsonify, request, current_app
+
+# Local imports
+from init import db
+from utils.batch import BatchError, run_batch
+from utils.query_budget import query_budget
+
+
+# Create the Template Web Application Interface for batch routes to be applied 
+# to the Flask application
+batch_bp = Blueprint("batch", __name__, url_prefix = "/batch")
+
+
+"""
+Batch Controller Messages
+"""
+
+def error_invalid_batch():
+    return {"message": "Request body must contain a list of operations."}, 400
+
+def error_batch_too_large(limit):
+    return {"message": f"A batch cannot contain more than {limit} operations."}, 413
+
+def error_operation_failed(err):
+    return {
+        "message": err.message, 
+        "index": err.index, 
+        "errors": err.errors
+    }, err.status_code
+
+
+"""
+API Routes
+"""
+
+@batch_bp.route("/", methods = ["POST"])
+@query_budget(3, allow_repeats = True)
+def run_batch_operations():
+    """
+    Run an ordered list of operations, each shaped like a call to the REST API:
+    {"method": "POST", "path": "/students/", "body": {...}, "ref": "alice"}.
+    A later operation can use "$alice" in its path or body for the id of the
+    student created above. Every operation succeeds and is committed together,
+    or the whole batch is rolled back.
+    """
+    # Fetch the list of operations from the request body
+    bodyData = request.get_json(silent = True)
+    if not isinstance(bodyData, dict):
+        return error_invalid_batch()
+    operations = bodyData.get("operations")
+    if not isinstance(operations, list):
+        return error_invalid_batch()
+    if len(operations) > current_app.config["BATCH_MAX_OPERATIONS"]:
+        return error_batch_too_large(current_app.config["BATCH_MAX_OPERATIONS"])
+
+    # Run the operations and report which one failed, undoing the others
+    try:
+        results = run_batch(operations)
+    except BatchError as err:
+        db.session.rollback()
+        return error_operation_failed(err)
+
+    # Commit every operation in the batch to the postgresql database at once
+    db.session.commit()
+    return jsonify({"results": results}), 200
\ No newline at end of file
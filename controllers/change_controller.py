@@ -0,0 +1,62 @@
+"""
+This file creates the changes feed, which lets downstream systems follow every change
+to the students, teachers, courses and enrolments data from a cursor instead of
+re-reading the full lists, through REST API design using Flask Blueprint.
+"""
+
+# Installed import packages
+from flask import Blueprint, jsonify, request, current_app
+
+# Local imports
+from schemas.schemas import changes_schema
+from utils.outbox import read_changes, encode_cursor, decode_cursor
+from utils.query_budget import query_budget
+from utils.read_only import read_only
+
+
+# Create the Template Web Application Interface for change routes to be applied 
+# to the Flask application
+changes_bp = Blueprint("changes", __name__, url_prefix = "/changes")
+
+
+"""
+Change Controller Messages
+"""
+
+def error_invalid_cursor(cursor):
+    return {"message": f"Cursor {cursor} is not valid. Use the 'next' value of a previous response."}, 400
+
+
+"""
+API Routes
+"""
+
+@changes_bp.route("/")
+@query_budget(1)
+@read_only
+def get_changes():
+    """
+    Retrieve the next batch of changes after the 'since' cursor, oldest first.
+    Without a cursor the feed starts from the oldest change still kept. The 
+    response's 'next' cursor is passed as 'since' to fetch the following batch,
+    and stays the same when there are no new changes yet.
+    """
+    # Fetch the cursor and batch size from the query string
+    since = request.args.get("since")
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE_DEFAULT"], type = int)
+    limit = max(1, min(limit, current_app.config["PAGE_SIZE_MAX"]))
+
+    position = decode_cursor(since) if since else None
+    if since and position is None:
+        return error_invalid_cursor(since)
+
+    # Serialise the batch, adding each change's own cursor
+    changes = read_changes(position, limit)
+    queryData = changes_schema.dump(changes)
+    for change, row in zip(changes, queryData):
+        row["cursor"] = encode_cursor(change)
+
+    return jsonify({
+        "changes": queryData,
+        "next": encode_cursor(changes[-1]) if changes else since
+    })
\ No newline at end of file
@@ -4,8 +4,13 @@ line interface through REST API design using Flask Blueprint. This file creates
 the commands to automate the creation and seeding of the LMS database.
 """
 
+# Built-in imports
+import json
+import os
+
 # Installed import packages
-from flask import Blueprint
+import click
+from flask import Blueprint, current_app
 
 # Local imports
 from init import db
@@ -13,6 +18,20 @@ from models.student import Student
 from models.teacher import Teacher
 from models.course import Course
 from models.enrolment import Enrolment
+from models.waitlist import WaitlistEntry
+from models.department import Department
+from utils.seats import promote_waitlist, recount_seats
+from utils.snapshots import take_snapshot
+from utils.binary_copy import dump_database, restore_database
+from utils.outbox import prune_changes
+from utils.archive import archive_enrolments, count_archivable
+from utils.rollover import RolloverError, plan_rollover, rollover_term
+from utils.terms import current_term_start
+from utils.tenancy import tenant_option, current_tenant, create_tenant_tables, drop_tenant_tables
+from utils.query_budget import check_query_budgets
+from utils.departments import (
+    list_departments, add_department, rename_department, remove_department, migrate_department_column
+)
 
 # Create the Template Application Interface for in-line command routes to be applied 
 # to the Flask application
@@ -24,22 +43,25 @@ API Routes
 """
 
 @db_commands.cli.command("create")
+@tenant_option
 def create_tables():
     """
     Creates all the tables as defined in the models subfolder
     """
-    db.create_all()
+    create_tenant_tables()
     print("Tables created.")
 
 @db_commands.cli.command("drop")
+@tenant_option
 def drop_tables():
     """
     This function deletes all tables and leaves an empty database
     """
-    db.drop_all()
+    drop_tenant_tables()
     print("Tables dropped.")
 
 @db_commands.cli.command("seed")
+@tenant_option
 def seed_tables():
     """
     Populate the table with initial data. Student, teacher, course,
@@ -63,18 +85,34 @@ def seed_tables():
     # Add the student information to this session
     db.session.add_all(students)
 
+    # Create the departments teachers can work in. Teachers store the code 
+    # of their department
+    departments = [Department(
+        department_code = 1,
+        name = "Science"
+    ), Department(
+        department_code = 2,
+        name = "Management"
+    ), Department(
+        department_code = 3,
+        name = "Engineering"
+    )]
+
+    # Add the department information to this session
+    db.session.add_all(departments)
+
     # Create teachers to add to the teachers database
     teachers = [Teacher(
         first_name = "Teacher",
         last_name = "1",
-        department = "Science",
+        department_code = departments[0].department_code,
         address = "Sydney",
         phone = "0412345678",
         email = "teacher1@email.com"
     ), Teacher(
         first_name = "Teacher",
         last_name = "2",
-        department = "Management",
+        department_code = departments[1].department_code,
         address = "Brisbane",
         phone = "98091234",
         email = "teacher2@email.com"
@@ -143,7 +181,295 @@ def seed_tables():
     # Add the enrolment information to this session
     db.session.add_all(enrolments)
 
+    # Count the seats taken by the seeded enrolments in each course
+    db.session.flush()
+    recount_seats()
+
     # Commit to the session and permanently add the enrolments to the 
     # database.
     db.session.commit()
-    print("Tables created.")
\ No newline at end of file
+    print("Tables created.")
+
+@db_commands.cli.command("departments")
+@tenant_option
+def show_departments():
+    """
+    List the departments teachers can work in, with their codes and the
+    number of teachers in each.
+    """
+    for code, name, teachers in list_departments():
+        print(f"{code}: {name} ({teachers} teachers)")
+
+@db_commands.cli.command("add-department")
+@tenant_option
+@click.argument("name")
+@click.option("--code", type = click.IntRange(1, 32767), help = "Code to store for the department. Defaults to the next free code.")
+def create_department(name, code):
+    """
+    Add a department that teachers can be assigned to. Running workers pick
+    it up the first time a request names it.
+    """
+    code = add_department(name, code)
+    print(f"Department {name} added with code {code}.")
+
+@db_commands.cli.command("rename-department")
+@tenant_option
+@click.argument("name")
+@click.argument("new_name")
+def change_department(name, new_name):
+    """
+    Rename a department. Running workers show the new name once their cached
+    names are older than DEPARTMENT_CACHE_SECONDS.
+    """
+    if not rename_department(name, new_name):
+        raise click.ClickException(f"Department {name} does not exist.")
+    print(f"Department {name} renamed to {new_name}.")
+
+@db_commands.cli.command("remove-department")
+@tenant_option
+@click.argument("name")
+def delete_department(name):
+    """
+    Remove a department that no teacher works in.
+    """
+    teachers = remove_department(name)
+    if teachers is None:
+        raise click.ClickException(f"Department {name} does not exist.")
+    if teachers:
+        raise click.ClickException(f"Department {name} still has {teachers} teachers.")
+    print(f"Department {name} removed.")
+
+@db_commands.cli.command("migrate-departments")
+@tenant_option
+def code_departments():
+    """
+    Convert a database created before departments were coded, moving the
+    department names out of the teachers table into the departments table.
+    """
+    added = migrate_department_column()
+    if added is None:
+        print("Teachers already store department codes.")
+        return
+    print(f"Teachers now store department codes. {added} departments added.")
+
+@db_commands.cli.command("promote")
+@tenant_option
+def promote_waitlists():
+    """
+    Recount the seats taken in every course and fill the free seats from the
+    course waitlists, in the order students joined them.
+    """
+    recount_seats()
+    statement = db.select(WaitlistEntry.course_id).distinct()
+    promoted = promote_waitlist(db.session.scalars(statement).all())
+    db.session.commit()
+    print(f"{promoted} students promoted from waitlists.")
+
+@db_commands.cli.command("snapshot")
+@tenant_option
+@click.option("--output", default = "snapshots", show_default = True, help = "Folder the snapshots are written to, in a subfolder per tenant.")
+@click.option("--format", "file_format", type = click.Choice(["parquet", "arrow"]), default = "parquet", show_default = True)
+@click.option("--incremental", is_flag = True, help = "Only write the rows changed since the last snapshot, and list the rows deleted since then.")
+@click.option("--chunk-size", default = 10000, show_default = True, help = "Rows fetched from the database at a time.")
+def snapshot_tables(output, file_format, incremental, chunk_size):
+    """
+    Write the students, teachers, courses and enrolments tables as columnar
+    Parquet or Arrow files for analytics.
+    """
+    folder, counts = take_snapshot(
+        os.path.abspath(os.path.join(output, current_tenant() or "")), 
+        file_format, 
+        incremental, 
+        chunk_size
+    )
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows")
+    print(f"Snapshot written to {folder}.")
+
+@db_commands.cli.command("dump")
+@tenant_option
+@click.option("--output", default = os.path.join("dumps", "latest"), show_default = True, help = "Folder the dump is written to.")
+@click.option("--jobs", default = 4, show_default = True, help = "Number of tables copied at the same time.")
+def dump_tables(output, jobs):
+    """
+    Dump every table with Postgres binary COPY, reading all tables from one
+    consistent snapshot.
+    """
+    counts = dump_database(os.path.abspath(output), jobs)
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows")
+    print(f"Database dumped to {output}.")
+
+@db_commands.cli.command("restore")
+@tenant_option
+@click.option("--input", "source", default = os.path.join("dumps", "latest"), show_default = True, help = "Folder the dump is read from.")
+@click.option("--jobs", default = 4, show_default = True, help = "Number of tables loaded at the same time.")
+@click.option("--truncate", is_flag = True, help = "Empty the tables before loading the dump.")
+def restore_tables(source, jobs, truncate):
+    """
+    Load a dump made with 'flask db dump' into the created tables, then reset
+    the id sequences and check the row counts match the dump.
+    """
+    mismatched = restore_database(os.path.abspath(source), jobs, truncate)
+    if mismatched:
+        for table, (expected, restored) in mismatched.items():
+            print(f"{table}: expected {expected} rows but restored {restored}.")
+        raise click.ClickException("Restored row counts do not match the dump.")
+    print("Database restored.")
+
+@db_commands.cli.command("prune-changes")
+@tenant_option
+@click.option("--days", type = int, help = "Keep the changes from this many days. Defaults to CHANGES_RETENTION_DAYS.")
+def prune_change_feed(days):
+    """
+    Delete the changes in the outbox that are older than the retention period.
+    """
+    deleted = prune_changes(days or current_app.config["CHANGES_RETENTION_DAYS"])
+    print(f"{deleted} changes pruned.")
+
+@db_commands.cli.command("archive")
+@tenant_option
+@click.option("--before", type = click.DateTime(formats = ["%Y-%m-%d"]), help = "Archive the enrolments dated before this day. Defaults to the start of the current term.")
+@click.option("--dry-run", is_flag = True, help = "Only report how many enrolments would be archived.")
+def archive_terms(before, dry_run):
+    """
+    Move the enrolments of past terms into the enrolments archive, recount
+    the seats taken in every course and fill the freed seats from the
+    waitlists.
+    """
+    cutoff = before.date() if before else current_term_start()
+    if cutoff > current_term_start():
+        raise click.ClickException("Cannot archive enrolments from the current term.")
+
+    if dry_run:
+        counts = count_archivable(cutoff)
+        for year, enrolments in counts.items():
+            print(f"{year}: {enrolments} enrolments")
+        print(f"{sum(counts.values())} enrolments dated before {cutoff} would be archived.")
+        return
+
+    archived = archive_enrolments(cutoff)
+    recount_seats()
+    statement = db.select(WaitlistEntry.course_id).distinct()
+    promoted = promote_waitlist(db.session.scalars(statement).all())
+    db.session.commit()
+    print(f"{archived} enrolments dated before {cutoff} archived.")
+    print(f"{promoted} students promoted from waitlists.")
+
+@db_commands.cli.command("rollover")
+@tenant_option
+@click.option("--term-start", type = click.DateTime(formats = ["%Y-%m-%d"]), help = "Day the new term starts, which the carried enrolments are dated. Required unless --dry-run.")
+@click.option("--since", type = click.DateTime(formats = ["%Y-%m-%d"]), help = "Carry over the enrolments dated on or after this day. Defaults to the start of the current term.")
+@click.option("--course", "course_ids", multiple = True, type = int, help = "Course to clone, can be repeated. Defaults to every course.")
+@click.option("--suffix", help = "Text added to the end of each clone's name, e.g. ' 2027 S1'.")
+@click.option("--replace", nargs = 2, help = "Text to replace in each clone's name and its replacement, e.g. --replace 2026 2027.")
+@click.option("--name", "names", multiple = True, type = (int, str), help = "A course id and the name of its clone, can be repeated.")
+@click.option("--reassign", multiple = True, type = (int, int), help = "A teacher id and the id of the teacher taking over their cloned courses, can be repeated.")
+@click.option("--course-teacher", "course_teachers", multiple = True, type = (int, int), help = "A course id and the id of its clone's teacher, can be repeated.")
+@click.option("--exclude-student", "excluded_students", multiple = True, type = int, help = "Student not carried over, such as one who is graduating, can be repeated.")
+@click.option("--no-enrolments", is_flag = True, help = "Only clone the courses.")
+@click.option("--dry-run", is_flag = True, help = "Only report what would be cloned and carried over.")
+def rollover_courses(term_start, since, course_ids, suffix, replace, names, reassign, course_teachers,
+                     excluded_students, no_enrolments, dry_run):
+    """
+    Clone courses into a new term and carry their students over, in one
+    transaction on the database server. Waitlists are not carried over.
+    """
+    options = {
+        "course_ids": list(course_ids),
+        "names": dict(names),
+        "replace": replace,
+        "suffix": suffix,
+        "teachers": dict(reassign),
+        "course_teachers": dict(course_teachers),
+        "excluded_students": list(excluded_students),
+        "carry_enrolments": not no_enrolments
+    }
+    since = since.date() if since else current_term_start()
+
+    try:
+        if dry_run:
+            report = plan_rollover(since, **options)
+        elif term_start is None:
+            raise click.ClickException("Give the day the new term starts with --term-start.")
+        else:
+            report = rollover_term(term_start.date(), since, **options)
+    except RolloverError as err:
+        db.session.rollback()
+        for conflict in (err.report or {}).get("conflicts", []):
+            print(conflict)
+        raise click.ClickException(err.message)
+
+    for course in report["courses"]:
+        teacher = course["new_teacher_id"]
+        if teacher != course["teacher_id"]:
+            teacher = f"{course['teacher_id']} -> {teacher}"
+        print(
+            f"{course['course_id']}: {course['name']} -> {course['new_name']} "
+            f"(teacher {teacher}), {course['carried']} of {course['enrolments']} enrolments"
+        )
+    for conflict in report["conflicts"]:
+        print(conflict)
+
+    if dry_run:
+        print(
+            f"{report['courses_cloned']} courses and {report['enrolments_carried']} enrolments "
+            f"dated from {since} would be rolled over."
+        )
+        return
+    db.session.commit()
+    print(f"{report['courses_cloned']} courses and {report['enrolments_carried']} enrolments rolled over.")
+
+@db_commands.cli.command("query-budget")
+@tenant_option
+def check_route_queries():
+    """
+    Request every route and check the SQL statements it runs against the
+    budget declared with @query_budget. Run it on a seeded database, as a
+    route is requested with the first record of each id in its URL. The
+    write routes' changes are rolled back. Exits with an error if any route
+    is over its budget.
+    """
+    headers = {current_app.config["TENANT_HEADER"]: current_tenant()} if current_tenant() else {}
+    failed = 0
+    for endpoint, url, problems in check_query_budgets(headers):
+        if url is None:
+            print(f"SKIP {endpoint}: no records to request it with")
+            continue
+        if not problems:
+            print(f"PASS {endpoint} {url}")
+            continue
+        failed += 1
+        print(f"FAIL {endpoint} {url}")
+        for problem, statements in problems:
+            print(f"  {problem}")
+            for statement in statements:
+                print(f"    {statement}")
+
+    if failed:
+        raise click.ClickException(f"{failed} routes are over their query budget.")
+    print("Every route is within its query budget.")
+
+@db_commands.cli.command("slow-queries")
+@click.option("--limit", default = 20, show_default = True, help = "Number of slow queries shown, newest first.")
+@click.option("--plans/--no-plans", default = True, show_default = True, help = "Show the captured query plans.")
+def show_slow_queries(limit, plans):
+    """
+    Show the latest statements that ran longer than SLOW_QUERY_MS. Set
+    SLOW_QUERY_STORE to a file shared with the server to see its queries.
+    """
+    log = current_app.extensions.get("slow_query_log")
+    if log is None:
+        raise click.ClickException("The slow query log is turned off. Set SLOW_QUERY_MS to turn it on.")
+
+    entries = log.store.recent(limit)
+    for entry in entries:
+        print(
+            f"{entry['recorded_at']} {entry['duration_ms']} ms {entry['origin']} "
+            f"({entry['rows']} rows, parameters {json.dumps(entry['parameters'])})"
+        )
+        print(f"  {entry['statement']}")
+        if plans and entry["plan"]:
+            for line in entry["plan"].splitlines():
+                print(f"    {line}")
+    print(f"{len(entries)} slow queries shown.")
\ No newline at end of file
@@ -5,17 +5,33 @@ through REST API design using Flask Blueprint.
 
 # Installed import packages
 from flask import Blueprint, jsonify, request
+from sqlalchemy.orm import joinedload, selectinload
 
 # Local imports
 from init import db
 from models.course import Course
-from schemas.schemas import course_schema, courses_schema
+from models.student import Student
+from models.enrolment import Enrolment
+from schemas.schemas import course_schema, courses_schema, course_roster_schema
+from utils.seats import promote_waitlist
+from utils.coalescing import coalesce
+from utils.pagination import get_page_args, page_response
+from utils.query_budget import query_budget
+from utils.read_only import read_only
+from utils.counting import total_count_headers
 
 
 # Create the Template Web Application Interface for course routes to be applied 
 # to the Flask application
 courses_bp = Blueprint("courses", __name__, url_prefix = "/courses")
 
+# The relationships shown with a course, loaded for every course read at once
+# rather than one course at a time
+COURSE_LOADERS = (
+    joinedload(Course.teacher),
+    selectinload(Course.enrolments).joinedload(Enrolment.student)
+)
+
 
 """
 Course Controller Messages
@@ -36,13 +52,23 @@ API Routes
 """
 
 @courses_bp.route("/")
+@query_budget(2)
+@coalesce
+@read_only
 def get_courses():
     """
     Retrieve and read all the courses from the course database,
-    this is the equivalent of GET in postgresql.
+    this is the equivalent of GET in postgresql. A HEAD request only
+    returns the count asked for with ?count=.
     """
-    # Selects all the courses from the database
+    # Count the courses if asked to
     statement = db.select(Course)
+    countHeaders = total_count_headers(statement)
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Selects all the courses from the database
+    statement = statement.options(*COURSE_LOADERS)
     courses_lists = db.session.scalars(statement)
     
     # Serialise it as the scalar result is unserialised
@@ -52,13 +78,16 @@ def get_courses():
     # otherwise inform the user that the database is empty.
     if queryData:
         # Return the list of courses in JSON format
-        return jsonify(queryData)
+        return jsonify(queryData), 200, countHeaders
     else:
         # Return an error message: Course table is empty
         return error_empty_table()
 
 
 @courses_bp.route("/<int:course_id>")
+@query_budget(2)
+@coalesce
+@read_only
 def get_a_course(course_id):
     """
     Retrieve and read a specific course's information from 
@@ -66,7 +95,11 @@ def get_a_course(course_id):
     """
     # Selects all the courses from the database and filter the course with
     # matching ID
-    statement = db.select(Course).where(Course.course_id == course_id)
+    statement = (
+        db.select(Course)
+        .where(Course.course_id == course_id)
+        .options(*COURSE_LOADERS)
+    )
     course = db.session.scalar(statement)
     
     # Serialise it as the scalar result is unserialised
@@ -83,7 +116,59 @@ def get_a_course(course_id):
         return error_course_does_not_exist(course_id)
     
 
+@courses_bp.route("/<int:course_id>/students")
+@query_budget(2)
+@coalesce
+@read_only
+def get_course_students(course_id):
+    """
+    Retrieve a page of the students enrolled in a course, ordered by student ID.
+    The students are read in one query joining the course's enrolments, found 
+    through the course index on the enrolments table, to the students table.
+    A HEAD request only returns the count asked for with ?count=.
+    """
+    limit, after = get_page_args()
+
+    # Count the course's students if asked to, estimating from the course's
+    # seat counter
+    countHeaders = total_count_headers(
+        db.select(Enrolment.id).where(Enrolment.course_id == course_id),
+        counter = db.select(Course.enrolled_count).where(Course.course_id == course_id)
+    )
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Select the enrolled students after the last one the client has seen,
+    # fetching one extra row to tell if there is another page
+    statement = (
+        db.select(
+            Student.student_id,
+            Student.first_name,
+            Student.last_name,
+            Enrolment.id.label("enrolment_id"),
+            Enrolment.enrolment_date
+        )
+        .join(Student, Student.student_id == Enrolment.student_id)
+        .where(
+            Enrolment.course_id == course_id,
+            Enrolment.student_id > after
+        )
+        .order_by(Enrolment.student_id)
+        .limit(limit + 1)
+    )
+    queryData = course_roster_schema.dump(db.session.execute(statement).mappings())
+
+    # Only check the course exists when it has no students to show
+    if not queryData and not after and not db.session.get(Course, course_id):
+        return error_course_does_not_exist(course_id)
+
+    # Return the page of students in JSON format
+    page = page_response(queryData, limit, "student_id")
+    return jsonify({"course_id": course_id, **page}), 200, countHeaders
+    
+
 @courses_bp.route("/", methods = ["POST"])
+@query_budget(4, allow_lazy_loads = True)
 def create_course():
     """
     Retrieve the body data and add the details of the course into the course database,
@@ -110,6 +195,7 @@ def create_course():
 
 
 @courses_bp.route("/<int:course_id>", methods = ["DELETE"])
+@query_budget(4, allow_lazy_loads = True)
 def delete_course(course_id):
     """
     Find the course with the matching ID in the course database and remove it.
@@ -138,6 +224,7 @@ def delete_course(course_id):
     
 
 @courses_bp.route("/<int:course_id>", methods = ["PUT", "PATCH"])
+@query_budget(7, allow_lazy_loads = True)
 def update_a_course(course_id):
     """
     Retrieve the body data and update the details of the course with the 
@@ -145,8 +232,8 @@ def update_a_course(course_id):
     PUT/PATCH in postgresql.
     """
     # Selects all the courses from the database and filter the course with
-    # matching ID
-    course = db.session.get(Course, course_id)
+    # matching ID, with the relationships shown in the response
+    course = db.session.get(Course, course_id, options = COURSE_LOADERS)
 
     # Notify the user if the course doesn't exist in the database
     if not course:
@@ -165,8 +252,12 @@ def update_a_course(course_id):
         partial = True
     )
 
+    # Fill any seats opened up by a change in the course capacity from the
+    # course's waitlist
+    promote_waitlist([course_id])
+
     # Commit and write the course data from this session into 
     # the postgresql database
     queryData = course_schema.dump(course)
     db.session.commit()
-    return jsonify(queryData), 200
+    return jsonify(queryData), 200
\ No newline at end of file
@@ -5,11 +5,25 @@ through REST API design using Flask Blueprint.
 
 # Installed import packages
 from flask import Blueprint, jsonify, request
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
 
 # Local imports
 from init import db
 from models.enrolment import Enrolment
 from schemas.schemas import enrolment_schema, enrolments_schema
+from utils.idempotency import (
+    get_idempotency_key, 
+    claim_idempotency_key, 
+    store_idempotent_response
+)
+from utils.seats import reserve_seat, add_to_waitlist, release_seats
+from utils.coalescing import coalesce
+from utils.terms import term_cutoff
+from utils.query_budget import query_budget
+from utils.read_only import read_only
+from utils.counting import total_count_headers
+from utils.id_filter import missing_reference, error_missing_reference
 
 
 # Create the Template Web Application Interface for enrolments routes to be applied 
@@ -30,16 +44,31 @@ def error_enrolment_does_not_exist(enrolment_id):
 def enrolment_sucessfully_delete(enrolment_id):
     return {"message": f"Enrolment {enrolment_id} deleted successfully."}, 200 
 
+def error_enrolment_already_exists(student_id, course_id):
+    return {"message": f"Student {student_id} is already enrolled in course {course_id}."}, 409
+
+def enrolment_waitlisted(student_id, course_id):
+    return {"message": f"Course {course_id} is full. Student {student_id} has been added to the waitlist."}, 202
+
+def error_idempotency_key_reused(key):
+    return {"message": f"Idempotency key {key} has already been used on a different route."}, 409
+
 
 """
 API Routes
 """
 
 @enrolments_bp.route("/")
+@query_budget(1)
+@coalesce
+@read_only
 def get_enrolments():
     """
     Retrieve and read all the enrolments from the enrolments database,
-    this is the equivalent of GET in postgresql.
+    this is the equivalent of GET in postgresql. Only the current term's
+    enrolments are listed unless ?term=all is passed. Enrolments without
+    a date belong to no term, so they are always listed. A HEAD request
+    only returns the count asked for with ?count=.
     """
     # Select all the enrolments from the database and the students that
     # are enrolled in these courses
@@ -55,6 +84,29 @@ def get_enrolments():
     if student_id:
         statement = statement.where(Enrolment.student_id == student_id)
 
+    # Only display the current term's enrolments unless every term is asked for,
+    # or one enrolment is asked for by its id. Enrolments without a date are
+    # never archived, so they are shown with every term
+    cutoff = term_cutoff()
+    if cutoff and not enrolment_id:
+        statement = statement.where(
+            db.or_(
+                Enrolment.enrolment_date >= cutoff, 
+                Enrolment.enrolment_date.is_(None)
+            )
+        )
+
+    # Count the enrolments if asked to
+    countHeaders = total_count_headers(statement)
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Load the enrolled students and their courses in the same query
+    statement = statement.options(
+        joinedload(Enrolment.student),
+        joinedload(Enrolment.course)
+    )
+
     # Serialise it as the scalar result is unserialised
     enrolments_list = db.session.scalars(statement)
     queryData = enrolments_schema.dump(enrolments_list)
@@ -63,40 +115,101 @@ def get_enrolments():
     # otherwise inform the user that the database is empty.
     if queryData:
         # Return the list of enrolments in JSON format
-        return jsonify(queryData)
+        return jsonify(queryData), 200, countHeaders
     else:
         # Return an error message: Enrolments table is empty
         return error_empty_table()
 
 
 @enrolments_bp.route("/", methods = ["POST"])
+@query_budget(5, allow_lazy_loads = True)
 def create_enrolment():
     """
     Retrieve the body data and add the details of the enrolment into the enrolment database,
-    this is the equivalent of POST in postgresql.
+    this is the equivalent of POST in postgresql. A retried request carrying the same
+    'Idempotency-Key' header is answered with the original response.
     """
     # Fetch the enrolment information from the request body
     bodyData = request.get_json()
 
-    # Create a new enrolment object using the request body data and the enrolment schema
-    # will organise the data to their matching attributes with validation rules 
-    # implemented
-    newEnrolment = Enrolment(
-        enrolment_date = bodyData.get("enrolment_date"),
-        student_id = bodyData.get("student_id"),
-        course_id = bodyData.get("course_id")
+    # Turn away a student or course that definitely does not exist before a
+    # transaction is opened. Ids that may exist are left to the foreign keys
+    missing = missing_reference(
+        students = bodyData.get("student_id"), 
+        courses = bodyData.get("course_id")
     )
-    
-    # Add the enrolment data into the session
-    db.session.add(newEnrolment)
-    
+    if missing:
+        return error_missing_reference(*missing)
+
+    # Claim the idempotency key, if one was sent, before making any changes. A
+    # key that was already used replays the response stored by the first request
+    idempotencyKey = get_idempotency_key()
+    if idempotencyKey:
+        storedRequest = claim_idempotency_key(idempotencyKey, request.endpoint)
+        if storedRequest:
+            if storedRequest.endpoint != request.endpoint:
+                return error_idempotency_key_reused(idempotencyKey)
+            return jsonify(storedRequest.response_body), storedRequest.status_code
+
+    # Only pass on the enrolment date when it was given so the column default
+    # of today's date is used otherwise
+    values = {
+        "student_id": bodyData.get("student_id"),
+        "course_id": bodyData.get("course_id")
+    }
+    if bodyData.get("enrolment_date"):
+        values["enrolment_date"] = bodyData.get("enrolment_date")
+
+    # Insert the enrolment in a single statement. A duplicate student and course 
+    # combination is skipped by the database instead of raising an error that
+    # would leave the session unusable
+    statement = (
+        insert(Enrolment)
+        .values(**values)
+        .on_conflict_do_nothing(
+            index_elements = [
+                Enrolment.student_id, 
+                Enrolment.course_id
+            ]
+        )
+        .returning(Enrolment.id)
+    )
+    enrolment_id = db.session.execute(statement).scalar()
+
+    # Take a seat in the course for the new enrolment. This is done after the
+    # insert so the course row is only locked for the rest of this transaction,
+    # and a full course moves the student onto its waitlist instead
+    if enrolment_id is not None and not reserve_seat(values["course_id"]):
+        db.session.execute(db.delete(Enrolment).where(Enrolment.id == enrolment_id))
+        add_to_waitlist(values["student_id"], values["course_id"])
+        responseBody, statusCode = enrolment_waitlisted(
+            values["student_id"], 
+            values["course_id"]
+        )
+
+    # Build the response: the new enrolment, or a conflict if the student is 
+    # already enrolled in this course
+    elif enrolment_id is not None:
+        responseBody = enrolment_schema.dump(db.session.get(Enrolment, enrolment_id))
+        statusCode = 201
+    else:
+        responseBody, statusCode = error_enrolment_already_exists(
+            values["student_id"], 
+            values["course_id"]
+        )
+
+    # Store the response against the idempotency key in the same transaction
+    if idempotencyKey:
+        store_idempotent_response(idempotencyKey, responseBody, statusCode)
+
     # Commit and write the enrolment data from this session into 
     # the postgresql database
     db.session.commit()
-    return jsonify(enrolment_schema.dump(newEnrolment)), 201
+    return jsonify(responseBody), statusCode
     
 
 @enrolments_bp.route("/<int:enrolment_id>", methods = ["DELETE"])
+@query_budget(7, allow_lazy_loads = True)
 def delete_enrolment(enrolment_id):
     """
     Find the enrolment with the matching ID in the enrolment database and remove it.
@@ -112,8 +225,10 @@ def delete_enrolment(enrolment_id):
 
     # Delete the enrolment from the enrolments database if they exist
     if queryData:
-        # Remove the enrolment from the session
+        # Remove the enrolment from the session and hand its seat to the
+        # next student on the course's waitlist
         db.session.delete(enrolment)
+        release_seats([enrolment.course_id])
         
         # Commit and permanently remove the enrolment data from the 
         # postgresql database
@@ -0,0 +1,122 @@
+"""
+This file creates the routes to queue, follow, and download exports of the enrolment
+data, through REST API design using Flask Blueprint. Exports run in the background
+so these routes never wait on a large export to finish.
+"""
+
+# Installed import packages
+from flask import Blueprint, jsonify, request, current_app, url_for, send_file
+
+# Local imports
+from init import db
+from models.export_job import ExportJob
+from schemas.schemas import export_job_schema
+from utils.exports import EXPORT_FORMATS, new_claim_token, submit_export, claim_stale_export
+from utils.query_budget import query_budget
+
+
+# Create the Template Web Application Interface for export routes to be applied 
+# to the Flask application
+exports_bp = Blueprint("exports", __name__, url_prefix = "/exports")
+
+
+"""
+Export Controller Messages
+"""
+
+def error_invalid_format(file_format):
+    return {"message": f"Export format {file_format} is not supported. Valid formats are: csv and ndjson."}, 400
+
+def error_export_does_not_exist(export_id):
+    return {"message": f"Export with id {export_id} does not exist"}, 404
+
+def error_export_not_ready(export_id):
+    return {"message": f"Export {export_id} has not finished yet."}, 409
+
+
+"""
+Helpers
+"""
+
+def export_status(job):
+    """
+    Serialise the export job with its progress and, once finished, the link
+    to download the file.
+    """
+    queryData = export_job_schema.dump(job)
+    queryData["progress"] = (
+        round(job.rows_written / job.total_rows, 4) if job.total_rows else 
+        (1.0 if job.status == "completed" else 0.0)
+    )
+    queryData["download_url"] = (
+        url_for("exports.download_export", export_id = job.id) 
+        if job.status == "completed" else None
+    )
+    return queryData
+
+
+"""
+API Routes
+"""
+
+@exports_bp.route("/", methods = ["POST"])
+@query_budget(2)
+def create_export():
+    """
+    Queue an export of every enrolment, with its student and course, in the
+    requested file format. The job's id is returned straight away and the
+    export is written in the background.
+    """
+    # Fetch the export format from the request body, CSV by default
+    bodyData = request.get_json(silent = True) or {}
+    file_format = bodyData.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return error_invalid_format(file_format)
+
+    # Save the job before handing it to the background workers so it survives
+    # this worker being restarted
+    newExport = ExportJob(format = file_format, claim_token = new_claim_token())
+    db.session.add(newExport)
+    db.session.commit()
+    submit_export(current_app._get_current_object(), newExport.id, newExport.claim_token)
+
+    response = jsonify(export_status(newExport))
+    response.headers["Location"] = url_for("exports.get_export", export_id = newExport.id)
+    return response, 202
+
+
+@exports_bp.route("/<int:export_id>")
+@query_budget(2)
+def get_export(export_id):
+    """
+    Retrieve the status and progress of an export. An unfinished export that
+    has stopped making progress is picked back up from its last checkpoint.
+    """
+    job = db.session.get(ExportJob, export_id)
+    if not job:
+        return error_export_does_not_exist(export_id)
+
+    # Resume the export on this worker if the worker running it has gone away
+    if job.status in ("queued", "running"):
+        claim_stale_export(current_app._get_current_object(), export_id)
+
+    return jsonify(export_status(job))
+
+
+@exports_bp.route("/<int:export_id>/download")
+@query_budget(1)
+def download_export(export_id):
+    """
+    Download the file of a finished export.
+    """
+    job = db.session.get(ExportJob, export_id)
+    if not job:
+        return error_export_does_not_exist(export_id)
+    if job.status != "completed":
+        return error_export_not_ready(export_id)
+
+    return send_file(
+        job.file_path,
+        as_attachment = True,
+        download_name = f"enrolments_{job.id}.{job.format}"
+    )
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+This file creates the health check routes used by the load balancer and the process
+manager to tell when a worker is ready to receive traffic, through REST API design 
+using Flask Blueprint. The pool usage and metrics routes are only available to the
+clients listed in ADMIN_ALLOWED_CLIENTS, like the admin routes.
+"""
+
+# Built-in imports
+import os
+
+# Installed import packages
+from flask import Blueprint, Response, current_app, jsonify, request
+from sqlalchemy.exc import SQLAlchemyError
+
+# Local imports
+from init import db
+from utils.query_budget import query_budget
+from utils.statement_timeouts import format_metrics
+
+
+# Create the Template Web Application Interface for health routes to be applied 
+# to the Flask application
+health_bp = Blueprint("health", __name__)
+
+
+"""
+Health Controller Messages
+"""
+
+def error_not_warmed_up():
+    return {"status": "starting", "message": "Application is still warming up."}, 503
+
+def error_database_unavailable():
+    return {"status": "unavailable", "message": "Database cannot be reached."}, 503
+
+def application_ready():
+    return {"status": "ready"}, 200
+
+def error_not_allowed():
+    return {"message": "This route is only available to administrators."}, 403
+
+
+"""
+Helpers
+"""
+
+def admin_client():
+    """
+    Whether the request comes from a client listed in ADMIN_ALLOWED_CLIENTS.
+    """
+    return request.remote_addr in current_app.config["ADMIN_ALLOWED_CLIENTS"]
+
+
+"""
+API Routes
+"""
+
+@health_bp.route("/readyz")
+@query_budget(1)
+def readiness():
+    """
+    Report whether this worker has finished warming up and can reach the
+    database. Traffic should only be sent to the worker once this passes.
+    A worker forked from the gunicorn master is warmed up once its own pool
+    is, not when the master was.
+    """
+    if current_app.config.get("WARMED_UP") != os.getpid():
+        return error_not_warmed_up()
+
+    try:
+        db.session.execute(db.text("SELECT 1"))
+    except SQLAlchemyError:
+        return error_database_unavailable()
+
+    return application_ready()
+
+
+@health_bp.route("/poolz")
+@query_budget(0)
+def pool_usage():
+    """
+    Report the database pool usage of the worker that handles the request,
+    for the default pool and each tenant's pool, such as for load tests to
+    sample while they run.
+    """
+    if not admin_client():
+        return error_not_allowed()
+
+    pools = {
+        name or "default": engine.pool.usage()
+        for name, engine in db.engines.items()
+        if hasattr(engine.pool, "usage")
+    }
+    return jsonify({"pid": os.getpid(), "pools": pools})
+
+
+@health_bp.route("/metrics")
+@query_budget(0)
+def metrics():
+    """
+    Report the statement timeouts and cancellations of the worker that
+    handles the request, by route, in the Prometheus text format.
+    """
+    if not admin_client():
+        return error_not_allowed()
+
+    return Response(format_metrics(), mimetype = "text/plain; version=0.0.4")
@@ -0,0 +1,144 @@
+"""
+This file creates the command line interface for load testing a running instance of
+the LMS API through Flask Blueprint, such as a local gunicorn started with the shipped
+gunicorn.conf.py.
+"""
+
+# Built-in imports
+import json
+
+# Installed import packages
+import click
+from flask import Blueprint, current_app
+
+# Local imports
+from utils.loadtest import SCENARIOS, run_scenario, format_report, compare_reports
+from utils.compression import benchmark_compression, format_benchmark
+from utils.driver import DRIVER_SCHEMES, benchmark_driver, format_driver_benchmark
+from utils.seat_contention import contend_for_seats
+from utils.tenancy import current_engine, current_schema, tenant_option
+
+# Create the Template Application Interface for the load test commands to be 
+# applied to the Flask application
+loadtest_commands = Blueprint("loadtest", __name__)
+
+
+"""
+API Routes
+"""
+
+@loadtest_commands.cli.command("run")
+@click.option("--url", default = "http://127.0.0.1:8000", show_default = True, help = "Base URL of the running API.")
+@click.option("--scenario", "scenarios", multiple = True, type = click.Choice(sorted(SCENARIOS)), help = "Scenario to run, can be repeated. Defaults to every scenario.")
+@click.option("--concurrency", default = 20, show_default = True, help = "Number of clients sending requests at once.")
+@click.option("--duration", default = 30.0, show_default = True, help = "Seconds each scenario runs for.")
+@click.option("--tenant", help = "College to send the requests to, in the tenant header.")
+@click.option("--tenant-header", help = "Header the server reads the tenant from. Defaults to TENANT_HEADER.")
+@click.option("--output", type = click.Path(dir_okay = False), help = "Save the reports as JSON, to compare with another run.")
+def run_load_test(url, scenarios, concurrency, duration, tenant, tenant_header, output):
+    """
+    Replay the traffic mix of each scenario against the API and report the
+    latency percentiles, throughput, status codes and pool usage. Turn off
+    ADMISSION_CONTROL on the server unless the rate limits are under test,
+    as every client shares one address.
+    """
+    reports = []
+    for scenario in scenarios or sorted(SCENARIOS):
+        try:
+            report = run_scenario(
+                url, scenario, concurrency, duration, tenant, 
+                tenant_header = tenant_header or current_app.config["TENANT_HEADER"]
+            )
+        except RuntimeError as err:
+            raise click.ClickException(str(err))
+        print(format_report(report))
+        reports.append(report)
+
+    if output:
+        with open(output, "w", encoding = "utf-8") as reportFile:
+            json.dump(reports, reportFile, indent = 2)
+        print(f"Reports saved to {output}.")
+
+
+@loadtest_commands.cli.command("compare")
+@click.argument("baseline", type = click.Path(exists = True, dir_okay = False))
+@click.argument("candidate", type = click.Path(exists = True, dir_okay = False))
+def compare_load_tests(baseline, candidate):
+    """
+    Compare the reports of two load test runs saved with --output.
+    """
+    with open(baseline, encoding = "utf-8") as baselineFile, open(candidate, encoding = "utf-8") as candidateFile:
+        print(compare_reports(json.load(baselineFile), json.load(candidateFile)))
+
+
+@loadtest_commands.cli.command("compression")
+@click.option("--path", "paths", multiple = True, help = "Route to benchmark, can be repeated. Defaults to /courses/ and /students/.")
+@click.option("--iterations", default = 50, show_default = True, help = "Times each body is compressed at each level.")
+@click.option("--gzip-level", "gzip_levels", multiple = True, type = int, help = "gzip level to try, can be repeated. Defaults to 1, 5 and 9.")
+@click.option("--zstd-level", "zstd_levels", multiple = True, type = int, help = "zstd level to try, can be repeated. Defaults to 1, 3 and 10.")
+@click.option("--tenant", help = "College to read the routes of, in the TENANT_HEADER header.")
+def benchmark_response_compression(paths, iterations, gzip_levels, zstd_levels, tenant):
+    """
+    Fetch each route's response in process and report the bytes each encoding
+    and level puts on the wire and the CPU time it costs per response, next to
+    the cost of a gzip response served from the compressed body cache.
+    """
+    client = current_app.test_client()
+    headers = {current_app.config["TENANT_HEADER"]: tenant} if tenant else {}
+    for path in paths or ("/courses/", "/students/"):
+        response = client.get(path, headers = {**headers, "Accept-Encoding": "identity"})
+        if response.status_code != 200:
+            raise click.ClickException(f"{path} returned {response.status_code}.")
+        results = benchmark_compression(
+            response.get_data(),
+            iterations,
+            gzip_levels or (1, 5, 9),
+            zstd_levels or (1, 3, 10),
+            cached_level = current_app.config["COMPRESSION_GZIP_LEVEL"]
+        )
+        print(format_benchmark(path, results))
+
+
+@loadtest_commands.cli.command("drivers")
+@tenant_option
+@click.option("--rows", default = 10000, show_default = True, help = "Students inserted and then updated by each driver.")
+@click.option("--driver", "drivers", multiple = True, type = click.Choice(sorted(DRIVER_SCHEMES)), help = "Driver to benchmark, can be repeated. Defaults to both.")
+def benchmark_drivers(rows, drivers):
+    """
+    Insert and then update the same number of students on each Postgres
+    driver, in transactions that are rolled back, and report the statements
+    and wall time of each. Run it against a local Postgres, so the times
+    are not swamped by network latency.
+    """
+    uri = current_engine().url.render_as_string(hide_password = False)
+    results = []
+    for driver in drivers or ("psycopg2", "psycopg"):
+        try:
+            results += benchmark_driver(uri, driver, rows, current_schema(), current_app.config["PREPARE_THRESHOLD"])
+        except ImportError as err:
+            print(f"Skipping {driver}: {err}")
+    print(format_driver_benchmark(results))
+
+
+@loadtest_commands.cli.command("seats")
+@tenant_option
+@click.option("--attempts", default = 200, show_default = True, help = "Students trying to enrol in the course at once.")
+@click.option("--capacity", default = 5, show_default = True, help = "Seats the course has.")
+@click.option("--keep", is_flag = True, help = "Leave the course and its students in place to inspect them.")
+def check_seat_contention(attempts, capacity, keep):
+    """
+    Race many students for the last seats of a new course through the
+    enrolment route, then check the course took no more students than it
+    has seats, that its seat counter matches its enrolments and that every
+    student turned away is on its waitlist. Run it against a test database
+    with ADMISSION_CONTROL=false, so no attempt is shed or rate limited.
+    Attempts that wait too long for a pooled connection fail the check too.
+    """
+    if current_app.config["ADMISSION_CONTROL"]:
+        raise click.ClickException("Run the check with ADMISSION_CONTROL=false, so every attempt reaches the seat allocation.")
+    counts, failures = contend_for_seats(attempts, capacity, keep)
+    for name, value in counts.items():
+        print(f"{name}: {value}")
+    if failures:
+        raise click.ClickException(" ".join(failures))
+    print("The seat allocation held.")
@@ -5,17 +5,32 @@ through REST API design using Flask Blueprint.
 
 # Installed import packages
 from flask import Blueprint, jsonify, request
+from sqlalchemy.orm import joinedload, selectinload
 
 # Local imports
 from init import db
 from models.student import Student
-from schemas.schemas import student_schema, students_schema
+from models.course import Course
+from models.enrolment import Enrolment
+from schemas.schemas import student_schema, students_schema, student_timetable_schema
+from utils.seats import release_seats
+from utils.coalescing import coalesce
+from utils.pagination import get_page_args, page_response
+from utils.query_budget import query_budget
+from utils.read_only import read_only
+from utils.counting import total_count_headers
 
 
 # Create the Template Web Application Interface for student routes to be applied 
 # to the Flask application
 students_bp = Blueprint("students", __name__, url_prefix = "/students")
 
+# The relationships shown with a student, loaded for every student read at once
+# rather than one student at a time
+STUDENT_LOADERS = (
+    selectinload(Student.enrolments).joinedload(Enrolment.course),
+)
+
 
 """
 Student Controller Messages
@@ -36,13 +51,24 @@ API Routes
 """
 
 @students_bp.route("/")
+@query_budget(2)
+@coalesce
+@read_only
 def get_students():
     """
     Retrieve and read all the students from the student database,
-    this is the equivalent of GET in postgresql.
+    this is the equivalent of GET in postgresql. A HEAD request only
+    returns the count asked for with ?count=.
     """
-    # Selects all the students from the database
+    # Count the students if asked to
     statement = db.select(Student)
+    countHeaders = total_count_headers(statement)
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Selects all the students from the database, with their enrolments and 
+    # the enrolled courses loaded up front rather than one student at a time
+    statement = statement.options(*STUDENT_LOADERS)
     students_list = db.session.scalars(statement)
 
     # Serialise it as the scalar result is unserialised
@@ -52,13 +78,16 @@ def get_students():
     # otherwise inform the user that the database is empty.
     if queryData:
         # Return the list of students in JSON format
-        return jsonify(queryData)
+        return jsonify(queryData), 200, countHeaders
     else:
         # Return an error message: Student table is empty
         return error_empty_table()
 
 
 @students_bp.route("/<int:student_id>")
+@query_budget(2)
+@coalesce
+@read_only
 def get_a_student(student_id):
     """
     Retrieve and read a specific student's information from 
@@ -66,7 +95,11 @@ def get_a_student(student_id):
     """
     # Selects all the students from the database and filter the student with
     # matching ID
-    statement = db.select(Student).where(Student.student_id == student_id)
+    statement = (
+        db.select(Student)
+        .where(Student.student_id == student_id)
+        .options(*STUDENT_LOADERS)
+    )
     student = db.session.scalar(statement)
 
     # Serialise it as the scalar result is unserialised
@@ -82,7 +115,58 @@ def get_a_student(student_id):
         return error_student_does_not_exist(student_id)
 
 
+@students_bp.route("/<int:student_id>/courses")
+@query_budget(2)
+@coalesce
+@read_only
+def get_student_courses(student_id):
+    """
+    Retrieve a page of the courses a student is enrolled in, ordered by course ID.
+    The courses are read in one query joining the student's enrolments, found 
+    through the student and course unique index, to the courses table.
+    A HEAD request only returns the count asked for with ?count=.
+    """
+    limit, after = get_page_args()
+
+    # Count the student's courses if asked to. A student has few enrolments,
+    # so even an estimate is counted exactly from the student and course
+    # index, and reported as exact
+    enrolled = db.select(Enrolment.id).where(Enrolment.student_id == student_id)
+    countHeaders = total_count_headers(enrolled, always_exact = True)
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Select the student's courses after the last one the client has seen,
+    # fetching one extra row to tell if there is another page
+    statement = (
+        db.select(
+            Course.course_id,
+            Course.name,
+            Course.duration,
+            Enrolment.id.label("enrolment_id"),
+            Enrolment.enrolment_date
+        )
+        .join(Course, Course.course_id == Enrolment.course_id)
+        .where(
+            Enrolment.student_id == student_id,
+            Enrolment.course_id > after
+        )
+        .order_by(Enrolment.course_id)
+        .limit(limit + 1)
+    )
+    queryData = student_timetable_schema.dump(db.session.execute(statement).mappings())
+
+    # Only check the student exists when they have no courses to show
+    if not queryData and not after and not db.session.get(Student, student_id):
+        return error_student_does_not_exist(student_id)
+
+    # Return the page of courses in JSON format
+    page = page_response(queryData, limit, "course_id")
+    return jsonify({"student_id": student_id, **page}), 200, countHeaders
+
+
 @students_bp.route("/", methods = ["POST"])
+@query_budget(3, allow_lazy_loads = True)
 def create_student():
     """
     Retrieve the body data and add the details of the student into the student database,
@@ -113,6 +197,7 @@ def create_student():
 
 
 @students_bp.route("/<int:student_id>", methods = ["DELETE"])
+@query_budget(10, allow_repeats = True, allow_lazy_loads = True)
 def delete_student(student_id):
     """
     Find the student with the matching ID in the student database and remove them.
@@ -125,8 +210,12 @@ def delete_student(student_id):
 
     # Delete the student from the students database if they exist
     if student:
-        # Remove the student from the session
+        # Remove the student from the session, their enrolments are deleted
+        # along with them so give those seats to the courses' waitlists
+        freedCourses = [enrolment.course_id for enrolment in student.enrolments]
         db.session.delete(student)
+        db.session.flush()
+        release_seats(freedCourses)
         
         # Commit and permanently remove the student data from the 
         # postgresql database
@@ -139,6 +228,7 @@ def delete_student(student_id):
         return error_student_does_not_exist(student_id)
 
 @students_bp.route("/<int:student_id>", methods = ["PUT", "PATCH"])
+@query_budget(3)
 def update_student(student_id):
     """
     Retrieve the body data and update the details of the student with the 
@@ -146,8 +236,8 @@ def update_student(student_id):
     PUT/PATCH in postgresql.
     """
     # Selects all the students from the database and filter the student with
-    # matching ID
-    statement = db.select(Student).where(Student.student_id == student_id)
+    # matching ID, with the courses shown in the response
+    statement = db.select(Student).options(*STUDENT_LOADERS).where(Student.student_id == student_id)
     student = db.session.scalar(statement)
 
     # Update the student information in the students database if they exist
@@ -164,11 +254,13 @@ def update_student(student_id):
         student.address = bodyData.get("address", student.address)
         
         # Commit and permanently update the student data in the 
-        # postgresql database
+        # postgresql database, serialising it first so the loaded courses
+        # are not read again
+        queryData = student_schema.dump(student)
         db.session.commit()
 
         # Return the updated student info in JSON format
-        return jsonify(student_schema.dump(student))
+        return jsonify(queryData)
     else:
         # Return an error message: Student with this ID does not exist
-        return error_student_does_not_exist(student_id)
+        return error_student_does_not_exist(student_id)
\ No newline at end of file
@@ -5,17 +5,33 @@ through REST API design using Flask Blueprint.
 
 # Installed import packages
 from flask import Blueprint, jsonify, request
+from sqlalchemy.orm import joinedload, selectinload
 
 # Local imports
 from init import db
 from models.teacher import Teacher
+from models.course import Course
+from models.enrolment import Enrolment
 from schemas.schemas import teacher_schema, teachers_schema
+from utils.coalescing import coalesce
+from utils.query_budget import query_budget
+from utils.read_only import read_only
+from utils.counting import total_count_headers
+from utils.departments import department_code, require_department_code
 
 
 # Create the Template Web Application Interface for teachers routes to be applied 
 # to the Flask application
 teachers_bp = Blueprint("teachers", __name__, url_prefix = "/teachers")
 
+# The relationships shown with a teacher, loaded for every teacher read at once
+# rather than one teacher at a time
+TEACHER_LOADERS = (
+    selectinload(Teacher.courses)
+    .selectinload(Course.enrolments)
+    .joinedload(Enrolment.student),
+)
+
 
 """
 Teacher Controller Messages
@@ -36,6 +52,7 @@ API Routes
 """
 
 @teachers_bp.route("/", methods = ["POST"])
+@query_budget(3, allow_lazy_loads = True)
 def create_teacher():
     """
     Retrieve and read all the teachers from the teachers database,
@@ -63,21 +80,34 @@ def create_teacher():
 
     
 @teachers_bp.route("/")
+@query_budget(3)
+@coalesce
+@read_only
 def get_teachers():
     """
     Retrieve and read all the teachers from the teachers database,
-    this is the equivalent of GET in postgresql.
+    this is the equivalent of GET in postgresql. A HEAD request only
+    returns the count asked for with ?count=.
     """
     # Check for filter requests by department name from the URL
     department = request.args.get("department")
 
     # Display teachers within the queried department
     if department:
-        statement = db.select(Teacher).where(Teacher.department == department)
+        statement = db.select(Teacher).where(Teacher.department_code == department_code(department))
     else:    
         # Select all teachers in the database
         statement = db.Select(Teacher)
 
+    # Count the teachers if asked to
+    countHeaders = total_count_headers(statement)
+    if request.method == "HEAD":
+        return "", 200, countHeaders
+
+    # Load the courses taught and their enrolled students up front rather 
+    # than one teacher at a time
+    statement = statement.options(*TEACHER_LOADERS)
+
     # Serialise it as the scalar result is unserialised
     teachers_list = db.session.scalars(statement)
     queryData = teachers_schema.dump(teachers_list)
@@ -86,7 +116,7 @@ def get_teachers():
     # otherwise inform the user that the database is empty.
     if queryData:
         # Return the list of teachers in JSON format
-        return jsonify(queryData)
+        return jsonify(queryData), 200, countHeaders
     # else:
     else:
         # Return an error message: Teachers table is empty
@@ -94,6 +124,9 @@ def get_teachers():
 
 
 @teachers_bp.route("/<int:teacher_id>")
+@query_budget(3)
+@coalesce
+@read_only
 def get_a_teacher(teacher_id):
     """
     Retrieve and read a specific teacher's information from 
@@ -101,7 +134,11 @@ def get_a_teacher(teacher_id):
     """
     # Selects all the teachers from the database and filter the teacher with
     # matching ID
-    statement = db.Select(Teacher).where(Teacher.teacher_id == teacher_id)
+    statement = (
+        db.select(Teacher)
+        .where(Teacher.teacher_id == teacher_id)
+        .options(*TEACHER_LOADERS)
+    )
     teachers_list = db.session.scalar(statement)
 
     # Serialise it as the scalar result is unserialised
@@ -119,6 +156,7 @@ def get_a_teacher(teacher_id):
 
 
 @teachers_bp.route("/<int:teacher_id>", methods = ["PUT", "PATCH"])
+@query_budget(4)
 def update_teacher(teacher_id):
     """
     Retrieve the body data and update the details of the teacher with the 
@@ -126,8 +164,8 @@ def update_teacher(teacher_id):
     PUT/PATCH in postgresql.
     """
     # Selects all the teachers from the database and filter the teacher with
-    # matching ID
-    statement = db.select(Teacher).where(Teacher.teacher_id == teacher_id)
+    # matching ID, with the courses shown in the response
+    statement = db.select(Teacher).options(*TEACHER_LOADERS).where(Teacher.teacher_id == teacher_id)
     teacher = db.session.scalar(statement)
 
     # Update the teacher information in the teachers database if they exist
@@ -139,23 +177,27 @@ def update_teacher(teacher_id):
         # reuse the same information
         teacher.first_name = bodyData.get("first_name", teacher.first_name)
         teacher.last_name = bodyData.get("last_name", teacher.last_name)
-        teacher.department = bodyData.get("department", teacher.department)
+        if "department" in bodyData:
+            teacher.department_code = require_department_code(bodyData["department"])
         teacher.address = bodyData.get("address", teacher.address)
         teacher.phone = bodyData.get("phone", teacher.phone)
         teacher.email = bodyData.get("email", teacher.email)
 
         # Commit and permanently update the teacher data in the 
-        # postgresql database
+        # postgresql database, serialising it first so the loaded courses
+        # are not read again
+        queryData = teacher_schema.dump(teacher)
         db.session.commit()
 
         # Return the updated teacher info in JSON format
-        return jsonify(teacher_schema.dump(teacher))
+        return jsonify(queryData)
     else:
         # Return an error message: Teacher with this ID does not exist
         return error_teacher_does_not_exist(teacher_id)
 
         
 @teachers_bp.route("/<int:teacher_id>", methods = ["DELETE"])
+@query_budget(4, allow_lazy_loads = True)
 def delete_teacher(teacher_id):
     """
     Find the teacher with the matching ID in the teacher database and remove it.
@@ -0,0 +1,68 @@
+"""
+Gunicorn deployment profile for the LMS API. Start the server with:
+
+    gunicorn
+
+The app is loaded once in the master process and warmed up there (see
+utils/warmup.py), then forked into the workers, which share that memory
+copy-on-write. Each worker opens its database connections straight after the
+fork so the first request does not pay for them.
+"""
+
+# Built-in imports
+import gc
+import multiprocessing
+import os
+
+# Serve the application created by the app factory
+wsgi_app = "main:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Worker processes, recycled after a number of requests to keep memory in check.
+# The jitter stops every worker from restarting at the same time
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Threads per worker, so the admission control in each worker sees how many 
+# requests are in flight and can shed load before they queue on the pool
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Load and warm up the app in the master before forking the workers
+preload_app = True
+
+# Number of database connections each worker opens before taking requests
+pool_warm_connections = int(os.getenv("POOL_WARM_CONNECTIONS", 2))
+
+
+def when_ready(server):
+    """
+    Move everything loaded so far out of the garbage collector's reach, so the
+    collector does not write to those pages in the workers and break the
+    copy-on-write sharing.
+    """
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Open the new worker's own database connections and read its id bitmaps.
+    """
+    from utils.warmup import warm_up_pool, mark_warmed_up
+    from utils.id_filter import warm_up_id_filters
+
+    try:
+        warm_up_pool(server.app.wsgi(), pool_warm_connections)
+    except Exception:
+        # The database may still be starting, the pool will connect on demand
+        # and the readiness check waits until the database can be reached
+        worker.log.exception("Database pool warm-up failed.")
+        mark_warmed_up(server.app.wsgi())
+
+    try:
+        warm_up_id_filters(server.app.wsgi())
+    except Exception:
+        # The bitmaps are read in the background once the database is up,
+        # and every id is let through until then
+        worker.log.exception("Id filter warm-up failed.")
\ No newline at end of file
@@ -4,7 +4,30 @@ This lets us map our Python objects with our SQL database.
 """
 
 # Installed import packages
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+
+class TenantSession(Session):
+    """
+    The session used throughout the app. Once a tenant has been chosen for the
+    request or command (see utils/tenancy.py), every query runs on that
+    tenant's engine instead of the default one. A read only route with a
+    read replica (see utils/read_only.py) runs on the replica's engine. While
+    the write routes' query budgets are checked (see utils/query_budget.py),
+    every query runs on the one connection whose changes are rolled back.
+    """
+
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if bind is None and has_app_context() and "pinned_connection" in g:
+            return g.pinned_connection
+        if bind is None and has_app_context() and "read_engine" in g:
+            return g.read_engine
+        if bind is None and has_app_context() and "tenant_engine" in g:
+            return g.tenant_engine
+        return super().get_bind(mapper = mapper, clause = clause, bind = bind, **kwargs)
+
 
 # Initialise by creating a single instance of the Object Relational Mapper that we can refer to throughout the code
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy(session_options = {"class_": TenantSession})
\ No newline at end of file
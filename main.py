@@ -8,6 +8,7 @@ import os
 # Installed import packages
 from flask import Flask
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Local imports
 from init import db
@@ -16,7 +17,24 @@ from controllers.student_controller import students_bp
 from controllers.teacher_controller import teachers_bp
 from controllers.course_controller import courses_bp
 from controllers.enrolment_controller import enrolments_bp
+from controllers.export_controller import exports_bp
+from controllers.health_controller import health_bp
+from controllers.batch_controller import batch_bp
+from controllers.change_controller import changes_bp
+from controllers.loadtest_controller import loadtest_commands
+from controllers.admin_controller import admin_bp
 from utils.error_handlers import register_error_handlers
+from utils.admission import TimedQueuePool, register_admission_control
+from utils.warmup import warm_up_app
+from utils.outbox import register_change_capture
+from utils.tenancy import load_tenants, tenant_binds, register_tenancy
+from utils.profiling import register_profiling
+from utils.slow_queries import register_slow_query_log
+from utils.compression import register_compression
+from utils.counting import register_count_estimates
+from utils.driver import driver_uri, driver_engine_options
+from utils.id_filter import register_id_filters
+from utils.statement_timeouts import parse_timeouts, register_statement_timeouts
 
 load_dotenv()
 
@@ -30,12 +48,172 @@ def create_app():
     app = Flask(__name__)
     print("Flask server started.")
 
+    # Postgres driver settings: "psycopg2" (the default) or "psycopg" for 
+    # psycopg 3 (see utils/driver.py), and on psycopg 3 how many times a 
+    # statement runs on a connection before it is prepared on the server 
+    # ("none" never prepares, as needed behind PgBouncer in transaction mode)
+    app.config['DATABASE_DRIVER'] = os.getenv("DATABASE_DRIVER", "psycopg2")
+    prepareThreshold = os.getenv("PREPARE_THRESHOLD", "5")
+    app.config['PREPARE_THRESHOLD'] = None if prepareThreshold.lower() == "none" else int(prepareThreshold)
+
     # Load the database address from the .env file. This function requires 
     # load_dotenv()
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URI")
+    app.config['SQLALCHEMY_DATABASE_URI'] = driver_uri(os.getenv("DATABASE_URI"), app.config['DATABASE_DRIVER'])
+
+    # Time how long requests wait for a pooled connection, and give up after
+    # POOL_TIMEOUT seconds instead of queueing for the default 30 seconds
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "poolclass": TimedQueuePool,
+        "pool_timeout": float(os.getenv("POOL_TIMEOUT", 5)),
+        **driver_engine_options(app.config['DATABASE_DRIVER'], app.config['PREPARE_THRESHOLD'])
+    }
+
+    # Tenant settings: the colleges hosted by this deployment (see 
+    # utils/tenancy.py), each given its own engine and connection pool, and 
+    # the request header or parent domain a request names its college with
+    app.config['TENANTS'] = load_tenants(os.getenv("TENANTS"))
+    app.config['SQLALCHEMY_BINDS'] = tenant_binds(
+        app.config['TENANTS'], 
+        app.config['SQLALCHEMY_DATABASE_URI'], 
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+        os.getenv("READ_REPLICA_URI")
+    )
+    for bind in app.config['SQLALCHEMY_BINDS'].values():
+        bind["url"] = driver_uri(bind["url"], app.config['DATABASE_DRIVER'])
+    app.config['TENANT_HEADER'] = os.getenv("TENANT_HEADER", "X-Tenant")
+    app.config['TENANT_DOMAIN'] = os.getenv("TENANT_DOMAIN")
+
+    # Admission control settings: per-client token buckets (requests per second
+    # and burst size), the most requests handled at once per worker, and the 
+    # average pool wait in seconds above which new requests are shed. Writes are
+    # limited separately from reads and are shed last. The rate limit store is
+    # "memory" (per worker) or the path of a SQLite file shared by the workers
+    app.config['ADMISSION_CONTROL'] = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+    app.config['RATE_LIMIT_STORE'] = os.getenv("RATE_LIMIT_STORE", "memory")
+    app.config['SHED_RETRY_AFTER'] = int(os.getenv("SHED_RETRY_AFTER", 2))
+
+    # How many reverse proxies sit in front of the app. Behind a load balancer
+    # every request comes from the proxy's address, so the client's address is
+    # read from the X-Forwarded-For header the proxies add instead. Leave it
+    # at 0 when clients connect directly, as the header can then be forged
+    app.config['TRUSTED_PROXIES'] = int(os.getenv("TRUSTED_PROXIES", 0))
+    app.config['ADMISSION_LIMITS'] = {
+        "read": {
+            "rate": float(os.getenv("RATE_LIMIT_READ_RATE", 20)),
+            "burst": float(os.getenv("RATE_LIMIT_READ_BURST", 40)),
+            "max_inflight": int(os.getenv("MAX_INFLIGHT_READS", 32)),
+            "max_pool_wait": float(os.getenv("MAX_POOL_WAIT_READS", 0.25))
+        },
+        "write": {
+            "rate": float(os.getenv("RATE_LIMIT_WRITE_RATE", 5)),
+            "burst": float(os.getenv("RATE_LIMIT_WRITE_BURST", 10)),
+            "max_inflight": int(os.getenv("MAX_INFLIGHT_WRITES", 16)),
+            "max_pool_wait": float(os.getenv("MAX_POOL_WAIT_WRITES", 1.0))
+        }
+    }
+
+    # Background export settings: where export files are written, how many
+    # exports run at once per worker, how many rows are written per chunk, and
+    # how long an export can go without progress before another worker resumes it
+    app.config['EXPORT_DIR'] = os.path.abspath(os.getenv("EXPORT_DIR", "exports"))
+    app.config['EXPORT_WORKERS'] = int(os.getenv("EXPORT_WORKERS", 2))
+    app.config['EXPORT_CHUNK_SIZE'] = int(os.getenv("EXPORT_CHUNK_SIZE", 5000))
+    app.config['EXPORT_STALE_SECONDS'] = int(os.getenv("EXPORT_STALE_SECONDS", 60))
+
+    # Request coalescing settings: whether identical concurrent reads share one
+    # response, and how many seconds a request waits on an identical one before
+    # handling itself
+    app.config['COALESCE_READS'] = os.getenv("COALESCE_READS", "true").lower() == "true"
+    app.config['COALESCE_TIMEOUT'] = float(os.getenv("COALESCE_TIMEOUT", 10))
+
+    # Whether the routes marked @read_only run in read only transactions, on
+    # the read replica of the default database (READ_REPLICA_URI) or of the
+    # tenant ("replica_uri" in TENANTS) when there is one
+    app.config['READ_ONLY_ROUTES'] = os.getenv("READ_ONLY_ROUTES", "true").lower() == "true"
+
+    # The default and largest page sizes of the paginated list routes
+    app.config['PAGE_SIZE_DEFAULT'] = int(os.getenv("PAGE_SIZE_DEFAULT", 50))
+    app.config['PAGE_SIZE_MAX'] = int(os.getenv("PAGE_SIZE_MAX", 500))
+
+    # The most operations a single request to the batch route can contain
+    app.config['BATCH_MAX_OPERATIONS'] = int(os.getenv("BATCH_MAX_OPERATIONS", 10000))
+
+    # How many seconds each worker keeps the department names before reading
+    # them again, which is how long a renamed department shows its old name
+    app.config['DEPARTMENT_CACHE_SECONDS'] = float(os.getenv("DEPARTMENT_CACHE_SECONDS", 300))
+
+    # How many seconds must pass before a department code or name that is not
+    # found reads the names again, so a new department is seen soon after it
+    # is added without every request for a missing one reading the table
+    app.config['DEPARTMENT_MISS_SECONDS'] = float(os.getenv("DEPARTMENT_MISS_SECONDS", 5))
+
+    # ID filter settings: whether new enrolments are checked against each 
+    # worker's bitmap of student and course ids before reaching the database, 
+    # and how many seconds a bitmap is kept before it is read again (see 
+    # utils/id_filter.py)
+    app.config['ID_FILTER'] = os.getenv("ID_FILTER", "true").lower() == "true"
+    app.config['ID_FILTER_SECONDS'] = float(os.getenv("ID_FILTER_SECONDS", 300))
+
+    # Statement timeout settings: how many milliseconds a statement run for a 
+    # request may take (0 for no limit), the timeouts of particular blueprints 
+    # or routes, e.g. "enrolments=5000,courses.get_courses=2000", and how often 
+    # in seconds the clients of running statements are checked for hanging up 
+    # (0 turns the check off, see utils/statement_timeouts.py)
+    app.config['STATEMENT_TIMEOUT_MS'] = int(os.getenv("STATEMENT_TIMEOUT_MS", 15000))
+    app.config['STATEMENT_TIMEOUTS'] = parse_timeouts(os.getenv("STATEMENT_TIMEOUTS"))
+    app.config['STATEMENT_CANCEL_INTERVAL'] = float(os.getenv("STATEMENT_CANCEL_INTERVAL", 0.5))
+
+    # How many days changes are kept in the outbox before they are pruned
+    app.config['CHANGES_RETENTION_DAYS'] = int(os.getenv("CHANGES_RETENTION_DAYS", 7))
+
+    # Term settings: the months terms start in (on the first day of the month),
+    # and an optional ISO date that overrides the start of the current term
+    app.config['TERM_START_MONTHS'] = [
+        int(month) for month in os.getenv("TERM_START_MONTHS", "2,7").split(",")
+    ]
+    app.config['CURRENT_TERM_START'] = os.getenv("CURRENT_TERM_START")
+
+    # Profiling settings: whether requests can be profiled, where profiles are
+    # written, the clients allowed to ask for a profile with the X-Profile 
+    # header or ?profile=1, the share of all requests profiled at random, and
+    # how many seconds apart the sampling profiler reads the stack
+    app.config['PROFILING'] = os.getenv("PROFILING", "false").lower() == "true"
+    app.config['PROFILE_DIR'] = os.path.abspath(os.getenv("PROFILE_DIR", "profiles"))
+    app.config['PROFILE_ALLOWED_CLIENTS'] = os.getenv("PROFILE_ALLOWED_CLIENTS", "127.0.0.1").split(",")
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    app.config['PROFILE_INTERVAL'] = float(os.getenv("PROFILE_INTERVAL", 0.005))
+
+    # Slow query log settings: the duration in milliseconds above which a 
+    # statement is logged (0 turns the log off), the share of slow reads whose
+    # plan is captured with EXPLAIN ANALYZE, how many entries are kept, and 
+    # where they are kept: "memory" (per worker) or a SQLite file shared by the
+    # workers and the CLI
+    app.config['SLOW_QUERY_MS'] = float(os.getenv("SLOW_QUERY_MS", 500))
+    app.config['SLOW_QUERY_EXPLAIN_RATE'] = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 0.05))
+    app.config['SLOW_QUERY_LOG_SIZE'] = int(os.getenv("SLOW_QUERY_LOG_SIZE", 200))
+    app.config['SLOW_QUERY_STORE'] = os.getenv("SLOW_QUERY_STORE", "memory")
+
+    # Compression settings: whether responses are compressed, the smallest body
+    # in bytes worth compressing, the gzip and zstd levels (kept low, as the 
+    # time to compress adds to every response's latency), and how many bytes of
+    # compressed bodies each worker keeps for reuse
+    app.config['COMPRESSION'] = os.getenv("COMPRESSION", "true").lower() == "true"
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+    app.config['COMPRESSION_GZIP_LEVEL'] = int(os.getenv("COMPRESSION_GZIP_LEVEL", 5))
+    app.config['COMPRESSION_ZSTD_LEVEL'] = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+    app.config['COMPRESSION_CACHE_BYTES'] = int(os.getenv("COMPRESSION_CACHE_BYTES", 32 * 1024 * 1024))
+
+    # The clients allowed to use the admin routes and to read the pool usage
+    # and metrics at /poolz and /metrics
+    app.config['ADMIN_ALLOWED_CLIENTS'] = os.getenv("ADMIN_ALLOWED_CLIENTS", "127.0.0.1").split(",")
     
     # Keep the order of keys in JSON response
     app.json.sort_keys = False
+
+    # Take the client's address from the trusted proxies, so the rate limits
+    # and allowed client lists apply to the client rather than the proxy
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for = app.config['TRUSTED_PROXIES'])
     db.init_app(app)
 
     # Apply the imported routes created in the controllers folder to this 
@@ -45,8 +223,47 @@ def create_app():
     app.register_blueprint(teachers_bp)
     app.register_blueprint(courses_bp)
     app.register_blueprint(enrolments_bp)
+    app.register_blueprint(exports_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(changes_bp)
+    app.register_blueprint(loadtest_commands)
+    app.register_blueprint(admin_bp)
 
     # Apply the imported error handling created in the utilities folder to 
     # this Flask app instance
     register_error_handlers(app)
-    return app
\ No newline at end of file
+
+    # Compress large responses in the encoding the client prefers
+    register_compression(app)
+
+    # Log the statements that run longer than SLOW_QUERY_MS
+    register_slow_query_log(app)
+
+    # Profile the requests that ask for it, and a random share of the rest
+    register_profiling(app)
+
+    # Route every request to the database of the college it belongs to
+    register_tenancy(app)
+
+    # Limit how long each request's statements may run, and cancel them when
+    # the client hangs up
+    register_statement_timeouts(app)
+
+    # Apply the rate limits and load shedding to every request
+    register_admission_control(app)
+
+    # Write every change to the students, teachers, courses and enrolments 
+    # tables to the outbox, in the same transaction as the change
+    register_change_capture()
+
+    # Clear the ids of deleted students and courses from this worker's bitmaps
+    register_id_filters()
+
+    # Let the list routes read the planner's row estimates for ?count=estimated
+    register_count_estimates()
+
+    # Set up the ORM mappers and schemas now rather than on the first request,
+    # so a preloaded gunicorn master hands them to every worker ready to use
+    warm_up_app(app)
+    return app
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+This file defines the model for the 'changes' table, the transactional outbox. A row
+is written here for every insert, update and delete on the students, teachers,
+courses and enrolments tables, in the same transaction as the change itself, so
+downstream systems can follow the changes instead of re-reading whole tables.
+"""
+
+# Local imports
+from init import db
+
+class Change(db.Model):
+    """
+    The change table template contains the table and row that changed, the kind
+    of change, and the row's values after the change. Each row also records the
+    id of the transaction that wrote it, which is what lets readers return the
+    changes in an order that never skips a change committed late.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "changes"
+
+    # Changes are read in transaction order, then in the order they were written
+    __table_args__ = (
+        db.Index("changes_txid_id", "txid", "id"),
+    )
+
+    # Table columns
+    id = db.Column(db.BigInteger, primary_key = True)
+    txid = db.Column(
+        db.BigInteger, 
+        nullable = False, 
+        server_default = db.text("pg_current_xact_id()::text::bigint")
+    )
+    table_name = db.Column(db.String(50), nullable = False)
+    row_id = db.Column(db.Integer, nullable = False)
+    operation = db.Column(db.String(10), nullable = False)
+
+    # The row's column values after an insert or update, or only its id after
+    # a delete
+    payload = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable = False, server_default = db.func.now())
\ No newline at end of file
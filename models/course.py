@@ -9,8 +9,8 @@ from init import db
 class Course(db.Model):
     """
     The course table template contains the names of the course, the duration
-    the course will run til completion, and the teacher who will be teaching
-    it. 
+    the course will run til completion, the teacher who will be teaching
+    it, and how many seats are available. 
     """
 
     # Name of the table and what is referenced by Flask-SQLAlchemy methods
@@ -20,10 +20,25 @@ class Course(db.Model):
     course_id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(100), nullable = False, unique = True)
     duration = db.Column(db.Float, nullable = False)
+
+    # Table columns (Seats) - A course without a capacity has unlimited seats.
+    # The number of taken seats is kept as a counter so a seat can be claimed
+    # with a single conditional update instead of counting enrolments
+    capacity = db.Column(db.Integer)
+    enrolled_count = db.Column(db.Integer, nullable = False, default = 0, server_default = "0")
     
     # Foreign Key: Teacher ID is the common link between 
     # the course and teacher tables
     teacher_id = db.Column(db.Integer, db.ForeignKey("teachers.teacher_id"))
+
+    # Table columns (Change Tracking) - Set by the database whenever the row is
+    # written, so snapshots can pick out the rows changed since the last one
+    updated_at = db.Column(
+        db.DateTime, 
+        nullable = False, 
+        server_default = db.func.now(), 
+        onupdate = db.func.now()
+    )
     
     # Define the relationship between teachers teaching courses, and 
     # student course enrolments
@@ -0,0 +1,23 @@
+"""
+This file defines the model for the 'departments' lookup table, which the 'teachers'
+table references by code. 
+"""
+
+# Local imports
+from init import db
+
+class Department(db.Model):
+    """
+    The department table template contains the departments teachers can work
+    in. Each department is stored once and teachers store its small code, so
+    the name is not repeated on every teacher. Departments are managed with
+    the 'flask db' department commands.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "departments"
+
+    # Table columns - The code is given when the department is added, as it 
+    # is also the value the changes feed and snapshots carry for a teacher
+    department_code = db.Column(db.SmallInteger, primary_key = True, autoincrement = False)
+    name = db.Column(db.String(100), nullable = False, unique = True)
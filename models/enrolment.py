@@ -22,19 +22,40 @@ class Enrolment(db.Model):
     # Create a unique constraint that prevents duplicate enrolment entries of
     # with the same student and course combination
     __table_args__ = (
+        # The unique constraint also serves lookups by student, such as a
+        # student's timetable, and carries the enrolment's id and date so
+        # those lookups can be answered from the index
         db.UniqueConstraint(
             "student_id", 
             "course_id", 
-            name = "enrolments_unique_student_course"
+            name = "enrolments_unique_student_course",
+            postgresql_include = ["id", "enrolment_date"]
+        ),
+        # This index does the same for lookups by course, such as a course's
+        # roster
+        db.Index(
+            "enrolments_course_student", 
+            "course_id", 
+            "student_id", 
+            postgresql_include = ["id", "enrolment_date"]
         ),
     )
 
     # Table columns
     id = db.Column(db.Integer, primary_key = True)
-    enrolment_date = db.Column(db.Date, default = date.today)
+    enrolment_date = db.Column(db.Date, default = date.today, index = True)
     student_id = db.Column(db.Integer, db.ForeignKey("students.student_id"), nullable = False)
     course_id = db.Column(db.Integer, db.ForeignKey("courses.course_id"), nullable = False)
 
+    # Table columns (Change Tracking) - Set by the database whenever the row is
+    # written, so snapshots can pick out the rows changed since the last one
+    updated_at = db.Column(
+        db.DateTime, 
+        nullable = False, 
+        server_default = db.func.now(), 
+        onupdate = db.func.now()
+    )
+
     # Define the relationships between courses, students, and enrolments
     student = db.relationship("Student", back_populates = "enrolments")
     course = db.relationship("Course", back_populates = "enrolments")
\ No newline at end of file
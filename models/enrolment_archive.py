@@ -0,0 +1,30 @@
+"""
+This file defines the model for the 'enrolments_archive' table. Enrolments from past
+terms are moved here by 'flask db archive', so the live 'enrolments' table and every
+query against it only hold current terms.
+"""
+
+# Built-in imports
+from datetime import datetime
+
+# Local imports
+from init import db
+
+class EnrolmentArchive(db.Model):
+    """
+    The enrolment archive table template has the same columns as the enrolments
+    table, keeping each enrolment's original id, plus when it was archived. There
+    are no foreign keys, so archived enrolments never stop a student or course
+    from being removed.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "enrolments_archive"
+
+    # Table columns
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    enrolment_date = db.Column(db.Date, index = True)
+    student_id = db.Column(db.Integer, nullable = False, index = True)
+    course_id = db.Column(db.Integer, nullable = False, index = True)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+This file defines the model for the 'export_jobs' table. Each row tracks an
+export of the enrolment data that runs in the background, along with the
+checkpoint it has reached so an interrupted export can carry on from there.
+"""
+
+# Built-in imports
+from datetime import datetime
+
+# Local imports
+from init import db
+
+class ExportJob(db.Model):
+    """
+    The export job table template contains the requested file format, the
+    progress of the export, and where the finished file is kept.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "export_jobs"
+
+    # Table columns
+    id = db.Column(db.Integer, primary_key = True)
+    format = db.Column(db.String(10), nullable = False)
+    status = db.Column(db.String(20), nullable = False, default = "queued")
+    file_path = db.Column(db.String(255))
+    error = db.Column(db.String(255))
+
+    # Table columns (Progress) - The checkpoint is the last enrolment written
+    # to the file and how many bytes the file held at that point
+    total_rows = db.Column(db.Integer)
+    rows_written = db.Column(db.Integer, nullable = False, default = 0)
+    last_enrolment_id = db.Column(db.Integer, nullable = False, default = 0)
+    bytes_written = db.Column(db.BigInteger, nullable = False, default = 0)
+
+    # Table columns (Claim) - A token that changes every time a worker takes
+    # the job on, so a worker that has lost the job to another one can tell
+    claim_token = db.Column(db.String(32))
+
+    # Table columns (Timestamps) - updated_at doubles as the heartbeat of the
+    # worker holding the export, whether it is running or still queued
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+This file defines the model for the 'idempotency_keys' table. This table keeps
+a record of the requests sent with an 'Idempotency-Key' header so a retried
+request can be answered with the original response instead of being repeated.
+"""
+
+# Built-in imports
+from datetime import datetime
+
+# Local imports
+from init import db
+
+class IdempotencyKey(db.Model):
+    """
+    The idempotency key table template contains the key sent by the client,
+    the route it was sent to, and the response that was returned the first
+    time the request was processed.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "idempotency_keys"
+
+    # Table columns
+    key = db.Column(db.String(255), primary_key = True)
+    endpoint = db.Column(db.String(100), nullable = False)
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+    # Table columns (Stored Response) - These are left empty until the request
+    # that claimed this key has finished processing
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.JSON)
\ No newline at end of file
@@ -26,6 +26,15 @@ class Student(db.Model):
     address = db.Column(db.String(100))
     phone = db.Column(db.String(100))
 
+    # Table columns (Change Tracking) - Set by the database whenever the row is
+    # written, so snapshots can pick out the rows changed since the last one
+    updated_at = db.Column(
+        db.DateTime, 
+        nullable = False, 
+        server_default = db.func.now(), 
+        onupdate = db.func.now()
+    )
+
     """
     Define the relationship between students and the courses they are enroled in.
     An enrolment can't exist if there is no student to attend the course
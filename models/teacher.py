@@ -19,13 +19,30 @@ class Teacher(db.Model):
     teacher_id = db.Column(db.Integer, primary_key = True)
     first_name = db.Column(db.String(100), nullable = False)
     last_name = db.Column(db.String(100), nullable = False)
-    department = db.Column(db.String(100), nullable = False)
+
+    # Foreign Key: The code of the department the teacher works in. The name
+    # is looked up from the departments cache when the teacher is shown
+    department_code = db.Column(
+        db.SmallInteger, 
+        db.ForeignKey("departments.department_code"), 
+        nullable = False, 
+        index = True
+    )
     
     # Table columns (Contact Details) - For privacy concerns these can be left empty
     address = db.Column(db.String(100))
     phone = db.Column(db.String(100))
     email = db.Column(db.String(100))   
 
+    # Table columns (Change Tracking) - Set by the database whenever the row is
+    # written, so snapshots can pick out the rows changed since the last one
+    updated_at = db.Column(
+        db.DateTime, 
+        nullable = False, 
+        server_default = db.func.now(), 
+        onupdate = db.func.now()
+    )
+
     """
     Define the relationship between teachers and the courses they are teaching.
     When a teacher leaves, the course can still continue to exist
@@ -0,0 +1,48 @@
+"""
+This file defines the model for the 'waitlist' table and it's relationships with
+'students' and the 'courses' models. 
+"""
+
+# Built-in imports
+from datetime import datetime
+
+# Local imports
+from init import db
+
+class WaitlistEntry(db.Model):
+    """
+    The waitlist table template contains the students waiting for a seat in a
+    course that is at capacity. Entries are promoted to enrolments in the order
+    they were added, whenever a seat in the course is freed.
+    """
+
+    # Name of the table and what is referenced by Flask-SQLAlchemy methods
+    __tablename__ = "waitlist"
+
+    # Create a unique constraint that prevents a student from joining the same
+    # course's waitlist more than once
+    __table_args__ = (
+        db.UniqueConstraint(
+            "student_id", 
+            "course_id", 
+            name = "waitlist_unique_student_course"
+        ),
+    )
+
+    # Table columns
+    id = db.Column(db.Integer, primary_key = True)
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+    # Foreign Keys: Waitlist entries are removed by the database along with the
+    # student or the course they belong to
+    student_id = db.Column(
+        db.Integer, 
+        db.ForeignKey("students.student_id", ondelete = "CASCADE"), 
+        nullable = False
+    )
+    course_id = db.Column(
+        db.Integer, 
+        db.ForeignKey("courses.course_id", ondelete = "CASCADE"), 
+        nullable = False, 
+        index = True
+    )
\ No newline at end of file
@@ -5,14 +5,19 @@ their constraints, and the relationships between each of these tables.
 
 # Installed import packages
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, auto_field
-from marshmallow.validate import Length, Regexp, Range, OneOf
-from marshmallow import fields, ValidationError, validates
+from marshmallow.validate import Length, Regexp, Range
+from marshmallow import Schema, fields, ValidationError, validates
 
 # Local imports - Tables
 from models.student import Student
 from models.teacher import Teacher
 from models.course import Course
 from models.enrolment import Enrolment
+from models.export_job import ExportJob
+from models.change import Change
+
+# Local imports - Department names
+from utils.departments import department_name, require_department_code
 
 
 class StudentSchema(SQLAlchemyAutoSchema):
@@ -75,16 +80,13 @@ class TeacherSchema(SQLAlchemyAutoSchema):
             "email"
         )
 
-    # The valid department values: Science, Management, Engineering
-    department = auto_field(
-        validate = OneOf(
-            [
-                "Science", 
-                "Management", 
-                "Engineering"
-            ], 
-            error = "Only valid departments are: Science, Management, and Engineering."
-        )
+    # The department is stored as its code and shown by name. The valid names
+    # are the departments added with the CLI
+    department = fields.Function(
+        lambda teacher: department_name(teacher.department_code), 
+        deserialize = require_department_code, 
+        attribute = "department_code", 
+        required = True
     )
     # Exclude teachers to prevent reference recursion when displaying the course information
     # that this teacher teaches
@@ -116,11 +118,13 @@ class CourseSchema(SQLAlchemyAutoSchema):
         include_fk = True
         
         # Define the exact order of how the JSON query is displayed
-        # Name, Duration, Course Teacher, Student Enrolments
+        # Name, Duration, Seats, Course Teacher, Student Enrolments
         fields = (
             "course_id", 
             "name", 
             "duration", 
+            "capacity", 
+            "enrolled_count", 
             "teacher_id", 
             "teacher", 
             "enrolments"
@@ -147,6 +151,16 @@ class CourseSchema(SQLAlchemyAutoSchema):
         if duration <= 1:
             raise ValidationError("Duration can't be less than 1.")
 
+    # Course capacity can be left empty for unlimited seats, otherwise it
+    # cannot be negative
+    @validates('capacity')
+    def validates_capacity(self, capacity, data_key):
+        if capacity is not None and capacity < 0:
+            raise ValidationError("Capacity can't be less than 0.")
+
+    # The number of taken seats is maintained by the enrolment routes
+    enrolled_count = auto_field(dump_only = True)
+
     # Only show the teacher's name and the department they work in
     # when showing the teacher teaching this course
     teacher = fields.Nested(
@@ -219,4 +233,91 @@ class EnrolmentSchema(SQLAlchemyAutoSchema):
 # Create instances of the schema for the controllers to call when applying validation,
 # error handling and restrictions
 enrolment_schema = EnrolmentSchema()
-enrolments_schema = EnrolmentSchema(many = True)
\ No newline at end of file
+enrolments_schema = EnrolmentSchema(many = True)
+
+
+class CourseRosterSchema(Schema):
+    """
+    The course roster schema template. This organises one row of a course's student 
+    list: the enrolled student's name and when they enrolled. The course itself is
+    not repeated on every row.
+    """
+    student_id = fields.Integer()
+    first_name = fields.String()
+    last_name = fields.String()
+    enrolment_id = fields.Integer()
+    enrolment_date = fields.Date()
+
+# Create an instance of the schema for the controllers to call when displaying
+# a course's students
+course_roster_schema = CourseRosterSchema(many = True)
+
+
+class StudentTimetableSchema(Schema):
+    """
+    The student timetable schema template. This organises one row of a student's
+    course list: the course's name and duration and when the student enrolled. The 
+    student is not repeated on every row.
+    """
+    course_id = fields.Integer()
+    name = fields.String()
+    duration = fields.Float()
+    enrolment_id = fields.Integer()
+    enrolment_date = fields.Date()
+
+# Create an instance of the schema for the controllers to call when displaying
+# a student's courses
+student_timetable_schema = StudentTimetableSchema(many = True)
+
+
+class ExportJobSchema(SQLAlchemyAutoSchema):
+    """
+    The export job schema template. This organises the JSON response when checking
+    on an export, such as the file format, how far along the export is, and when it
+    was last updated.
+    """
+    class Meta:
+        model = ExportJob
+        load_instance = True
+
+        # Define the exact order of how the JSON query is displayed
+        # Format, Status, Progress, Timestamps
+        fields = (
+            "id", 
+            "format", 
+            "status", 
+            "rows_written", 
+            "total_rows", 
+            "error", 
+            "created_at", 
+            "updated_at"
+        )
+
+# Create instances of the schema for the controllers to call when displaying
+# export jobs
+export_job_schema = ExportJobSchema()
+
+
+class ChangeSchema(SQLAlchemyAutoSchema):
+    """
+    The change schema template. This organises the JSON response of the changes feed:
+    which row of which table changed, how it changed, and its values afterwards.
+    """
+    class Meta:
+        model = Change
+        load_instance = True
+
+        # Define the exact order of how the JSON query is displayed
+        # Change, Changed Row, Values, Timestamp
+        fields = (
+            "id", 
+            "operation", 
+            "table_name", 
+            "row_id", 
+            "payload", 
+            "created_at"
+        )
+
+# Create instances of the schema for the controllers to call when displaying
+# the changes feed
+changes_schema = ChangeSchema(many = True)
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+This file decides whether a request is let in before any work is done on it. Each
+client gets a token bucket per kind of request, and the worker sheds requests with
+a 503 once too many are already in flight or the database pool is slow to hand out
+connections, so a slow database fails fast instead of piling up requests until they
+time out. Writes (POST, PUT, PATCH, DELETE) are tracked separately from reads and
+have their own limits, so a flood of cheap reads cannot lock out enrolments.
+"""
+
+# Built-in imports
+import math
+import os
+import sqlite3
+import time
+from threading import Lock, local
+
+# Installed import packages
+from flask import g, request
+from sqlalchemy.pool import QueuePool
+
+# Local imports
+from utils.tenancy import EXEMPT_ENDPOINTS
+
+# The request methods that are treated as writes
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class PoolWaitTracker:
+    """
+    A moving average of how long requests wait for a database connection. The
+    average decays over time, so it falls back to zero once requests stop
+    waiting, including while requests are being shed.
+    """
+
+    def __init__(self, half_life = 5.0):
+        self.decay = math.log(2) / half_life
+        self.value = 0.0
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def _decayed(self, now):
+        return self.value * math.exp(-self.decay * (now - self.updated))
+
+    def record(self, seconds):
+        with self.lock:
+            now = time.monotonic()
+            weight = 1 - math.exp(-self.decay)
+            self.value = self._decayed(now) * (1 - weight) + seconds * weight
+            self.updated = now
+
+    def average(self):
+        with self.lock:
+            return self._decayed(time.monotonic())
+
+
+# The pool wait time of this worker process, for the default pool and for
+# each tenant's pool
+pool_wait = PoolWaitTracker()
+tenant_pool_waits = {}
+tenant_pool_waits_lock = Lock()
+
+
+def pool_wait_for(tenant):
+    """
+    Return the pool wait tracker of a tenant's pool, or of the default pool
+    when there is no tenant.
+    """
+    if tenant is None:
+        return pool_wait
+    with tenant_pool_waits_lock:
+        return tenant_pool_waits.setdefault(tenant, PoolWaitTracker())
+
+
+class TimedQueuePool(QueuePool):
+    """
+    The default connection pool, timing how long each checkout waits for a
+    connection. A tenant's pool is named after the tenant and timed on its
+    own, so one busy tenant does not shed the requests of the others.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_wait_for(self.logging_name).record(time.perf_counter() - started)
+
+    def usage(self):
+        """
+        Report how many connections are in use and how long checkouts wait.
+        """
+        return {
+            "checked_out": self.checkedout(),
+            "capacity": self.size() + self._max_overflow,
+            "average_wait_ms": round(pool_wait_for(self.logging_name).average() * 1000, 2)
+        }
+
+
+class MemoryTokenBucketStore:
+    """
+    Token buckets kept in this worker's memory. Each worker enforces the limit
+    on its own, so the effective limit is multiplied by the number of workers.
+    """
+
+    def __init__(self, retention = 3600):
+        self.buckets = {}
+        self.lock = Lock()
+        self.retention = retention
+        self.calls = 0
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket. Returns how long to wait before retrying,
+        or 0 if the request is allowed.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            # Now and then remove the buckets of clients that have gone quiet,
+            # as they have refilled and would start out full again anyway
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                self.buckets = {
+                    bucket: state for bucket, state in self.buckets.items() 
+                    if state[1] >= now - self.retention
+                }
+
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+class SqliteTokenBucketStore:
+    """
+    Token buckets kept in a SQLite file shared by every worker on the host, such
+    as one on /dev/shm. Each bucket is updated inside an immediate transaction,
+    so workers cannot spend the same token twice.
+    """
+
+    def __init__(self, path, retention = 3600):
+        self.path = path
+        self.retention = retention
+        self.local = local()
+        self.calls = 0
+
+        # Create the table on a throwaway connection, as this may run in the
+        # gunicorn master and a SQLite connection must not cross a fork
+        connection = sqlite3.connect(self.path, timeout = 1, isolation_level = None)
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+    def _connection(self):
+        if not hasattr(self.local, "connection"):
+            self.local.connection = sqlite3.connect(
+                self.path,
+                timeout = 1,
+                isolation_level = None
+            )
+        return self.local.connection
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from the bucket. Returns how long to wait before retrying,
+        or 0 if the request is allowed.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if tokens >= 1:
+                tokens -= 1
+            connection.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+
+            # Now and then remove the buckets of clients that have gone quiet
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                connection.execute(
+                    "DELETE FROM buckets WHERE updated < ?", (now - self.retention,)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def create_token_bucket_store(setting):
+    """
+    Create the token bucket store named in the configuration: "memory" for a
+    store per worker, or the path of a SQLite file shared by the workers.
+    """
+    if not setting or setting == "memory":
+        return MemoryTokenBucketStore()
+    return SqliteTokenBucketStore(os.path.abspath(setting))
+
+
+def error_rate_limited(retry_after):
+    return {"message": "Too many requests. Please slow down and try again."}, 429, {
+        "Retry-After": str(max(1, math.ceil(retry_after)))
+    }
+
+def error_overloaded(retry_after):
+    return {"message": "Service is busy. Please try again shortly."}, 503, {
+        "Retry-After": str(retry_after)
+    }
+
+
+def register_admission_control(app):
+    """
+    This function attaches the rate limits and load shedding to the Flask app,
+    using the limits set in its configuration.
+    """
+    if not app.config["ADMISSION_CONTROL"]:
+        return
+
+    store = create_token_bucket_store(app.config["RATE_LIMIT_STORE"])
+    inflight = {}
+    inflightLock = Lock()
+
+    @app.before_request
+    def admit_request():
+        """
+        Reject the request with a 429 if the client has used up its tokens,
+        or with a 503 if this worker is already overloaded.
+        """
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        # The query budget check requests every route in turn from the
+        # command line, which is not client traffic
+        if g.get("checking_query_budgets"):
+            return None
+
+        kind = "write" if request.method in WRITE_METHODS else "read"
+        limits = app.config["ADMISSION_LIMITS"][kind]
+
+        # Each tenant is limited on its own, so a busy college cannot use
+        # up the requests of the others
+        tenant = g.get("tenant")
+
+        # Per-client rate limit
+        client = request.remote_addr or "unknown"
+        retryAfter = store.take(f"{kind}:{tenant or ''}:{client}", limits["rate"], limits["burst"])
+        if retryAfter:
+            return error_rate_limited(retryAfter)
+
+        # Shed load when the pool is slow to hand out connections
+        if pool_wait_for(tenant).average() > limits["max_pool_wait"]:
+            return error_overloaded(app.config["SHED_RETRY_AFTER"])
+
+        # Shed load when too many requests of this kind are being handled
+        with inflightLock:
+            if inflight.get((tenant, kind), 0) >= limits["max_inflight"]:
+                return error_overloaded(app.config["SHED_RETRY_AFTER"])
+            inflight[(tenant, kind)] = inflight.get((tenant, kind), 0) + 1
+        g.admitted = (tenant, kind)
+        return None
+
+    @app.teardown_request
+    def release_request(err):
+        """
+        Count the admitted request as finished, whether it succeeded or not.
+        """
+        admitted = g.pop("admitted", None)
+        if admitted:
+            with inflightLock:
+                inflight[admitted] -= 1
\ No newline at end of file
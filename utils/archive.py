@@ -0,0 +1,65 @@
+"""
+This file moves the enrolments of past terms from the enrolments table into the
+enrolments archive (see models/enrolment_archive.py), keeping the live table, its
+indexes and the seat counts down to the current terms. The rows are moved with a
+single set-based statement, so an archive run either moves every row or none.
+"""
+
+# Local imports
+from init import db
+from models.enrolment import Enrolment
+from models.enrolment_archive import EnrolmentArchive
+from models.change import Change
+
+# The columns copied from an enrolment into the archive
+ARCHIVED_COLUMNS = ("id", "enrolment_date", "student_id", "course_id", "updated_at")
+
+
+def count_archivable(before):
+    """
+    Count the enrolments dated before the cutoff by year, without moving
+    them. Returns {year: enrolments}.
+    """
+    year = db.extract("year", Enrolment.enrolment_date)
+    statement = (
+        db.select(year, db.func.count())
+        .where(Enrolment.enrolment_date < before)
+        .group_by(year)
+        .order_by(year)
+    )
+    return {int(row[0]): row[1] for row in db.session.execute(statement)}
+
+
+def archive_enrolments(before):
+    """
+    Move the enrolments dated before the cutoff into the archive in one
+    statement: the delete hands its rows to the archive insert, which hands
+    their ids to an insert into the outbox, so consumers of the changes feed
+    see an "archive" change for each enrolment. The caller commits. Returns
+    the number of enrolments archived.
+    """
+    enrolments = Enrolment.__table__
+    archive = EnrolmentArchive.__table__
+
+    moved = (
+        db.delete(enrolments)
+        .where(enrolments.c.enrolment_date < before)
+        .returning(*(enrolments.c[name] for name in ARCHIVED_COLUMNS))
+        .cte("moved")
+    )
+    archived = (
+        db.insert(archive)
+        .from_select(ARCHIVED_COLUMNS, db.select(*(moved.c[name] for name in ARCHIVED_COLUMNS)))
+        .returning(archive.c.id)
+        .cte("archived")
+    )
+    statement = db.insert(Change.__table__).from_select(
+        ["table_name", "row_id", "operation", "payload"],
+        db.select(
+            db.literal(enrolments.name),
+            archived.c.id,
+            db.literal("archive"),
+            db.func.json_build_object("id", archived.c.id)
+        )
+    )
+    return db.session.execute(statement).rowcount
\ No newline at end of file
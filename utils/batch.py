@@ -0,0 +1,209 @@
+"""
+This file runs a batch of create and update operations in one transaction. Each
+operation goes through the same schema validation as its REST route, and an
+operation can use the id of a record created earlier in the batch by naming it
+with "ref" and referring to it as "$name". Each operation is flushed before the
+next one runs, so a constraint it breaks is reported against it, and the whole
+batch is committed once. Enrolments are written the same way as the enrolment
+route: a duplicate is turned away and a student who finds the course full is
+put on its waitlist, without failing the rest of the batch.
+"""
+
+# Built-in imports
+import re
+
+# Installed import packages
+from marshmallow import ValidationError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+# Local imports
+from init import db
+from models.student import Student
+from models.teacher import Teacher
+from models.course import Course
+from models.enrolment import Enrolment
+from schemas.schemas import student_schema, teacher_schema, course_schema
+from utils.driver import pipeline
+from utils.id_filter import missing_reference, error_missing_reference
+from utils.seats import reserve_seat, add_to_waitlist
+
+# The resources a batch can write to, with their model and validation schema.
+# Enrolments are created the same way as the enrolment route, from the ids
+RESOURCES = {
+    "students": (Student, student_schema),
+    "teachers": (Teacher, teacher_schema),
+    "courses": (Course, course_schema),
+    "enrolments": (Enrolment, None)
+}
+
+# Paths look like the REST routes: /students/ or /courses/3 (or /courses/$ref)
+PATH_PATTERN = re.compile(r"^/(?P<resource>[a-z]+)/?(?P<id>\d+|\$\w+)?/?$")
+
+
+class BatchError(Exception):
+    """
+    Raised when an operation in the batch cannot be carried out. The index
+    identifies the operation and the batch is rolled back.
+    """
+
+    def __init__(self, index, message, status_code = 400, errors = None):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+        self.status_code = status_code
+        self.errors = errors
+
+
+class BatchRun:
+    """
+    The state of one batch: the records created under each ref and the
+    result of each operation.
+    """
+
+    def __init__(self):
+        self.refs = {}
+        self.results = []
+
+    def resolve(self, index, value):
+        """
+        Replace "$name" back-references in a value with the id of the record
+        created under that name.
+        """
+        if isinstance(value, dict):
+            return {key: self.resolve(index, item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(index, item) for item in value]
+        if isinstance(value, str) and value.startswith("$"):
+            record = self.refs.get(value[1:])
+            if value[1:] not in self.refs:
+                raise BatchError(index, f"Unknown reference {value}.")
+            # A waitlisted enrolment has no id to refer to
+            if primary_key(record) is None:
+                raise BatchError(index, f"Reference {value} has no id, as the enrolment was waitlisted.", 409)
+            return primary_key(record)
+        return value
+
+
+def primary_key(record):
+    """
+    Return the id of a record, whatever its primary key column is called.
+    Enrolments are written with a statement and kept as their id, or None
+    when the student was waitlisted.
+    """
+    if record is None or isinstance(record, int):
+        return record
+    return db.inspect(record).identity[0] if db.inspect(record).identity else None
+
+
+def run_operation(run, index, operation):
+    """
+    Carry out one create (POST) or update (PUT/PATCH) operation.
+    """
+    method = str(operation.get("method", "")).upper()
+    match = PATH_PATTERN.match(str(operation.get("path", "")))
+    if not match or match["resource"] not in RESOURCES:
+        raise BatchError(index, f"Unsupported path {operation.get('path')}.")
+    model, schema = RESOURCES[match["resource"]]
+    data = run.resolve(index, operation.get("body") or {})
+
+    if method == "POST" and not match["id"]:
+        if schema is None:
+            record, statusCode = create_enrolment(index, data)
+        else:
+            record = schema.load(data, session = db.session)
+            db.session.add(record)
+            statusCode = 201
+
+    elif method in ("PUT", "PATCH") and match["id"] and schema is not None:
+        recordId = run.resolve(index, match["id"])
+        record = db.session.get(model, int(recordId))
+        if record is None:
+            raise BatchError(index, f"{model.__name__} with id {recordId} does not exist", 404)
+        schema.load(data, instance = record, session = db.session, partial = True)
+        statusCode = 200
+
+    else:
+        raise BatchError(index, f"Unsupported operation {method} {operation.get('path')}.")
+
+    if operation.get("ref"):
+        run.refs[operation["ref"]] = record
+    run.results.append((index, operation.get("ref"), match["resource"], record, statusCode))
+
+
+def create_enrolment(index, data):
+    """
+    Enrol a student in a course as the enrolment route does: the enrolment
+    is inserted unless the student is already enrolled, and then takes a
+    seat, or is swapped for a place on the waitlist when the course is full.
+    Returns the new enrolment's id, or None when waitlisted, and the status.
+    """
+    student_id, course_id = data.get("student_id"), data.get("course_id")
+    if student_id is None or course_id is None:
+        raise BatchError(index, "An enrolment needs a student_id and a course_id.")
+    missing = missing_reference(students = student_id, courses = course_id)
+    if missing:
+        raise BatchError(index, error_missing_reference(*missing)[0]["message"], 409)
+
+    values = {"student_id": student_id, "course_id": course_id}
+    if data.get("enrolment_date"):
+        values["enrolment_date"] = data.get("enrolment_date")
+    enrolment_id = db.session.execute(
+        insert(Enrolment)
+        .values(**values)
+        .on_conflict_do_nothing(
+            index_elements = [
+                Enrolment.student_id, 
+                Enrolment.course_id
+            ]
+        )
+        .returning(Enrolment.id)
+    ).scalar()
+    if enrolment_id is None:
+        raise BatchError(index, f"Student {student_id} is already enrolled in course {course_id}.", 409)
+
+    if not reserve_seat(course_id):
+        db.session.execute(db.delete(Enrolment).where(Enrolment.id == enrolment_id))
+        add_to_waitlist(student_id, course_id)
+        return None, 202
+    return enrolment_id, 201
+
+
+def integrity_message(err):
+    """
+    Describe the constraint an operation broke, as the integrity error
+    handler does for the REST routes.
+    """
+    diag = getattr(err.orig, "diag", None)
+    return getattr(diag, "message_detail", None) or getattr(diag, "message_primary", None) or "Integrity Error occured."
+
+
+def run_batch(operations):
+    """
+    Run the operations in order, flushing each one. The caller commits once
+    the batch has succeeded, or rolls back on a BatchError. Returns the
+    result of each operation. On psycopg 3 the writes are pipelined.
+    """
+    run = BatchRun()
+    with pipeline(), db.session.no_autoflush:
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise BatchError(index, "Each operation must be an object.")
+            try:
+                run_operation(run, index, operation)
+                db.session.flush()
+            except ValidationError as err:
+                raise BatchError(index, "Validation failed.", 400, err.messages)
+            except IntegrityError as err:
+                raise BatchError(index, integrity_message(err), 409)
+
+    return [
+        {
+            "index": index,
+            "ref": ref,
+            "resource": resource,
+            "id": primary_key(record),
+            "status": statusCode
+        }
+        for index, ref, resource, record, statusCode in run.results
+    ]
\ No newline at end of file
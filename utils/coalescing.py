@@ -0,0 +1,89 @@
+"""
+This file lets identical read requests that arrive at the same time share one
+response. The first request for a given route, arguments and caller runs the
+handler as normal, and any identical request that arrives while it is running
+waits for it and is sent a copy of the same response bytes, so a stampede of
+identical reads costs one database query and one serialisation per worker.
+"""
+
+# Built-in imports
+import hashlib
+from functools import wraps
+from threading import Event, Lock
+
+# Installed import packages
+from flask import current_app, g, request
+
+
+class Flight:
+    """
+    A request being handled on behalf of every identical request waiting on it.
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+
+
+# The requests currently being handled in this worker, by request key
+_flights = {}
+_flights_lock = Lock()
+
+
+def request_key():
+    """
+    Build the key that identical requests share: the tenant, the route, its URL
+    and query arguments, and the caller's credentials, so callers with different
+    access never share a response.
+    """
+    scope = request.headers.get("Authorization", "")
+    return (
+        g.get("tenant"),
+        request.method,
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi = True))),
+        hashlib.sha256(scope.encode("utf-8")).hexdigest()
+    )
+
+
+def coalesce(view):
+    """
+    Decorate a read-only route so identical concurrent requests share the one
+    response. A request that finds no identical request in flight, or whose
+    leader failed or took longer than COALESCE_TIMEOUT, runs the route itself.
+    """
+    @wraps(view)
+    def coalesced_view(*args, **kwargs):
+        if not current_app.config["COALESCE_READS"]:
+            return view(*args, **kwargs)
+
+        key = request_key()
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = Flight()
+
+        # Follow the identical request already in flight
+        if not leader:
+            if flight.done.wait(current_app.config["COALESCE_TIMEOUT"]) and flight.response:
+                body, status, headers = flight.response
+                return current_app.response_class(body, status = status, headers = headers)
+            return view(*args, **kwargs)
+
+        # Lead: handle the request and share the finished response
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+            flight.response = (
+                response.get_data(),
+                response.status_code,
+                list(response.headers.items())
+            )
+            return response
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.done.set()
+
+    return coalesced_view
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+This file compresses response bodies with gzip or zstd, whichever the client accepts
+and prefers, once they are large enough for compression to pay off. The list routes
+send large and repetitive JSON, which shrinks many times over. Compressed bodies are
+cached by the hash of the body they were made from, which is also the response's
+ETag, so a hot response (or a response shared by coalesced requests) is compressed
+once per worker rather than once per request, and a client that already holds it is
+sent a 304 with no body at all.
+"""
+
+# Built-in imports
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Installed import packages
+from flask import request
+
+# The encodings offered, in the order they are preferred when the client
+# accepts several equally
+ENCODINGS = ("zstd", "gzip")
+
+# The content types worth compressing. Export files are streamed from disk and
+# are left alone
+COMPRESSIBLE_TYPES = {"application/json", "text/csv", "text/plain"}
+
+
+def zstd_module():
+    """
+    Return the zstandard module, or None when it is not installed, in which
+    case only gzip is offered.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(body, encoding, level):
+    if encoding == "zstd":
+        return zstd_module().ZstdCompressor(level = level).compress(body)
+    # mtime = 0 keeps the output, and so its ETag, the same for the same body
+    return gzip.compress(body, compresslevel = level, mtime = 0)
+
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size = 16).hexdigest()
+
+
+class CompressedBodyCache:
+    """
+    The compressed bodies of recent responses, by body hash and encoding, kept
+    in this worker's memory up to a total size and evicted least recently
+    used first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.bodies = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.bodies:
+                return
+            self.bodies[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.bodies.popitem(last = False)
+                self.size -= len(evicted)
+
+
+def choose_encoding(accept_encodings, available):
+    """
+    Pick the encoding the client rates highest among those available, or
+    None when it accepts none of them.
+    """
+    best, bestQuality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > bestQuality:
+            best, bestQuality = encoding, quality
+    return best
+
+
+def is_compressible(response, min_size):
+    return (
+        response.status_code == 200
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_TYPES
+        and response.content_length is not None
+        and response.content_length >= min_size
+    )
+
+
+def register_compression(app):
+    """
+    This function attaches response compression to the Flask app, using the
+    size threshold and levels set in its configuration.
+    """
+    if not app.config["COMPRESSION"]:
+        return
+
+    available = [
+        encoding for encoding in ENCODINGS
+        if encoding != "zstd" or zstd_module() is not None
+    ]
+    levels = {"gzip": app.config["COMPRESSION_GZIP_LEVEL"], "zstd": app.config["COMPRESSION_ZSTD_LEVEL"]}
+    minSize = app.config["COMPRESSION_MIN_SIZE"]
+    cache = CompressedBodyCache(app.config["COMPRESSION_CACHE_BYTES"])
+    app.extensions["compression_cache"] = cache
+
+    @app.after_request
+    def compress_response(response):
+        """
+        Send the response compressed in the encoding the client prefers,
+        tagged with the hash of its uncompressed body.
+        """
+        if not is_compressible(response, minSize):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        body = response.get_data()
+        etag = body_etag(body)
+        encoding = choose_encoding(request.accept_encodings, available)
+
+        if encoding:
+            key = (etag, encoding)
+            compressed = cache.get(key)
+            if compressed is None:
+                compressed = compress(body, encoding, levels[encoding])
+                cache.put(key, compressed)
+            response.set_data(compressed)
+            response.headers["Content-Encoding"] = encoding
+            etag = f"{etag}-{encoding}"
+
+        # Each encoding is a different representation, so it has its own ETag
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+
+def benchmark_compression(body, iterations, gzip_levels, zstd_levels, cached_encoding = "gzip", cached_level = 5):
+    """
+    Compress the body with each encoding and level 'iterations' times and
+    report the bytes it would take on the wire and the CPU time spent per
+    response, next to the cost of serving it from the compressed body cache
+    in 'cached_encoding' at 'cached_level'.
+    """
+    cache = CompressedBodyCache(len(body) * 2)
+
+    results = [{"encoding": "identity", "level": None, "bytes": len(body), "cpu_ms": 0.0}]
+    options = [("gzip", level) for level in gzip_levels]
+    if zstd_module() is not None:
+        options += [("zstd", level) for level in zstd_levels]
+
+    for encoding, level in options:
+        started = time.process_time()
+        for _ in range(iterations):
+            compressed = compress(body, encoding, level)
+        elapsed = time.process_time() - started
+        results.append({
+            "encoding": encoding,
+            "level": level,
+            "bytes": len(compressed),
+            "cpu_ms": round(elapsed / iterations * 1000, 3)
+        })
+
+    # A cache hit hashes the body and looks it up, and compresses nothing
+    cachedBody = compress(body, cached_encoding, cached_level)
+    cache.put((body_etag(body), cached_encoding), cachedBody)
+    started = time.process_time()
+    for _ in range(iterations):
+        cache.get((body_etag(body), cached_encoding))
+    elapsed = time.process_time() - started
+    results.append({
+        "encoding": "cached",
+        "level": cached_level,
+        "bytes": len(cachedBody),
+        "cpu_ms": round(elapsed / iterations * 1000, 3)
+    })
+    return results
+
+
+def format_benchmark(path, results):
+    """
+    Lay out the benchmark of one route as a table, with each encoding's size
+    relative to the uncompressed body.
+    """
+    original = results[0]["bytes"]
+    lines = [
+        f"Compression of {path} ({original} bytes)",
+        f"{'encoding':<10} {'level':>5} {'bytes':>10} {'ratio':>7} {'cpu ms':>9}"
+    ]
+    for result in results:
+        size = result["bytes"]
+        lines.append(
+            f"{result['encoding']:<10} {result['level'] if result['level'] is not None else '-':>5} "
+            f"{size if size is not None else '-':>10} "
+            f"{f'{original / size:.1f}x' if size else '-':>7} {result['cpu_ms']:>9.3f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""
+This file counts the rows a list route matches, for the X-Total-Count header that
+paging UIs show. The client picks how with ?count=: "exact" runs COUNT(*), which
+reads every matching row, "estimated" reads the planner's row estimate (or a counter
+the app already keeps, such as a course's seat counter) for the cost of planning the
+query, and "none", the default, skips counting. A HEAD request to a list route runs
+only the count and returns the headers without the list.
+"""
+
+# Built-in imports
+import json
+
+# Installed import packages
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Local imports
+from init import db
+
+# The ways a list route can count its rows
+COUNT_MODES = ("exact", "estimated", "none")
+
+
+class CountModeError(ValueError):
+    """
+    Raised when ?count= names a way of counting that is not supported.
+    """
+
+
+def explain_estimates(conn, cursor, statement, parameters, context, executemany):
+    """
+    Swap a statement run with the "estimate_rows" execution option for its
+    EXPLAIN, so the statement is compiled (with the tenant's schema and its
+    parameters) exactly as it would run, but only planned.
+    """
+    if context is not None and context.execution_options.get("estimate_rows"):
+        statement = f"EXPLAIN (FORMAT JSON) {statement}"
+    return statement, parameters
+
+
+def register_count_estimates():
+    """
+    Attach the row estimates to every engine. Calling this again, such as
+    when a second app is created, does not attach them twice.
+    """
+    if not event.contains(Engine, "before_cursor_execute", explain_estimates):
+        event.listen(Engine, "before_cursor_execute", explain_estimates, retval = True)
+
+
+def count_mode():
+    mode = request.args.get("count", "none")
+    if mode not in COUNT_MODES:
+        raise CountModeError(mode)
+    return mode
+
+
+def exact_count(statement):
+    return db.session.scalar(
+        db.select(db.func.count()).select_from(statement.order_by(None).subquery())
+    )
+
+
+def estimated_count(statement):
+    """
+    Return the planner's estimate of the rows the statement matches, taken
+    from the table statistics kept up to date by autovacuum's ANALYZE.
+    """
+    # The statement's rows are planned rather than a count of them, as the
+    # nodes under a count of a large table are the partial counts of a
+    # parallel plan. The planner pulls the subquery up, so the top node
+    # gives the rows the statement returns
+    rows = db.select(db.text("*")).select_from(statement.order_by(None).subquery())
+    plan = db.session.scalar(rows, execution_options = {"estimate_rows": True})
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def total_count_headers(statement, counter = None, always_exact = False):
+    """
+    Count the rows of a list route's statement as the client asked, and
+    return the headers that report it. A statement reading a counter kept by
+    the app can be given to use in place of the planner's estimate. A route
+    whose rows are always few enough to count can ask for 'always_exact',
+    and an estimate is then counted exactly and reported as exact.
+    """
+    mode = count_mode()
+    if mode == "none":
+        return {}
+    if always_exact:
+        mode = "exact"
+    if mode == "exact":
+        total = exact_count(statement)
+    elif counter is not None:
+        total = db.session.scalar(counter) or 0
+    else:
+        total = estimated_count(statement)
+    return {"X-Total-Count": str(total), "X-Total-Count-Mode": mode}
@@ -0,0 +1,197 @@
+"""
+This file maps department codes to names and back. Teachers store a department's
+code, and the names are read into each worker's memory rather than joined on every
+query. The names are read again once they are DEPARTMENT_CACHE_SECONDS old, and a
+code or name that is not found reads them again if they are more than
+DEPARTMENT_MISS_SECONDS old, so a department added with the CLI is picked up by the
+running workers without a restart, while requests naming a department that does not
+exist cannot make every request read the table.
+"""
+
+# Built-in imports
+import time
+from threading import Lock
+
+# Installed import packages
+from flask import current_app
+from marshmallow import ValidationError
+
+# Local imports
+from init import db
+from models.department import Department
+from models.teacher import Teacher
+from utils.tenancy import current_tenant, current_schema, table_name
+
+
+# The department names of each tenant read by this worker, as
+# (names by code, codes by name, time read)
+_departments = {}
+_departments_lock = Lock()
+
+
+def load_departments():
+    """
+    Read the current tenant's departments from the database into the cache.
+    """
+    rows = db.session.execute(db.select(Department.department_code, Department.name)).all()
+    names = {code: name for code, name in rows}
+    codes = {name: code for code, name in rows}
+    with _departments_lock:
+        _departments[current_tenant()] = (names, codes, time.monotonic())
+    return names, codes
+
+
+def cached_departments(missed = False):
+    """
+    Return the current tenant's departments, reading them again if the cached
+    ones are too old. After a code or name was 'missed', the cached ones are
+    only kept for DEPARTMENT_MISS_SECONDS.
+    """
+    cached = _departments.get(current_tenant())
+    maxAge = current_app.config["DEPARTMENT_MISS_SECONDS" if missed else "DEPARTMENT_CACHE_SECONDS"]
+    if cached is None or time.monotonic() - cached[2] > maxAge:
+        return load_departments()
+    return cached[0], cached[1]
+
+
+def forget_departments():
+    """
+    Drop the current tenant's cached departments, after they are changed.
+    """
+    with _departments_lock:
+        _departments.pop(current_tenant(), None)
+
+
+def department_name(code):
+    if code is None:
+        return None
+    names, _ = cached_departments()
+    if code not in names:
+        names, _ = cached_departments(missed = True)
+    return names.get(code)
+
+
+def department_code(name):
+    """
+    Return the code of the department with this name, or None if there is no
+    such department.
+    """
+    _, codes = cached_departments()
+    if name not in codes:
+        _, codes = cached_departments(missed = True)
+    return codes.get(name)
+
+
+def error_invalid_department():
+    names = sorted(cached_departments()[1])
+    return f"Only valid departments are: {', '.join(names)}."
+
+
+def require_department_code(name):
+    """
+    Return the code of the department with this name, raising a validation
+    error naming the valid departments if there is no such department.
+    """
+    code = department_code(name)
+    if code is None:
+        raise ValidationError(error_invalid_department())
+    return code
+
+
+def list_departments():
+    """
+    Return every department with the number of teachers in it, by code.
+    """
+    statement = (
+        db.select(Department.department_code, Department.name, db.func.count(Teacher.teacher_id))
+        .outerjoin(Teacher, Teacher.department_code == Department.department_code)
+        .group_by(Department.department_code, Department.name)
+        .order_by(Department.department_code)
+    )
+    return db.session.execute(statement).all()
+
+
+def add_department(name, code = None):
+    """
+    Add a department, with the next free code unless one is given. Returns
+    the department's code.
+    """
+    if code is None:
+        code = (db.session.scalar(db.select(db.func.max(Department.department_code))) or 0) + 1
+    db.session.add(Department(department_code = code, name = name))
+    db.session.commit()
+    forget_departments()
+    return code
+
+
+def rename_department(name, new_name):
+    """
+    Rename a department. Its teachers keep its code, so none of them are
+    rewritten. Returns False if there is no such department.
+    """
+    department = db.session.scalar(db.select(Department).where(Department.name == name))
+    if department is None:
+        return False
+    department.name = new_name
+    db.session.commit()
+    forget_departments()
+    return True
+
+
+def remove_department(name):
+    """
+    Remove a department that no teacher works in. Returns the number of
+    teachers still in it, in which case it is kept, or None if there is no
+    such department.
+    """
+    department = db.session.scalar(db.select(Department).where(Department.name == name))
+    if department is None:
+        return None
+    teachers = db.session.scalar(
+        db.select(db.func.count()).where(Teacher.department_code == department.department_code)
+    )
+    if teachers:
+        return teachers
+    db.session.delete(department)
+    db.session.commit()
+    forget_departments()
+    return 0
+
+
+def migrate_department_column():
+    """
+    Convert a teachers table made before departments were coded: add every
+    department name it holds to the departments table, replace the name on
+    each teacher with the department's code, and index the codes. Returns
+    the number of departments added, or None if the table is already coded.
+    """
+    connection = db.session.connection()
+    columns = [column["name"] for column in db.inspect(connection).get_columns("teachers", schema = current_schema())]
+    if "department" not in columns:
+        return None
+
+    Department.__table__.create(connection, checkfirst = True)
+    departments = table_name(Department.__table__)
+    teachers = table_name(Teacher.__table__)
+    added = db.session.execute(db.text(
+        f"INSERT INTO {departments} (department_code, name) "
+        f"SELECT (SELECT COALESCE(MAX(department_code), 0) FROM {departments}) "
+        f"+ row_number() OVER (ORDER BY department), department "
+        f"FROM (SELECT DISTINCT department FROM {teachers}) AS names "
+        f"ON CONFLICT (name) DO NOTHING"
+    )).rowcount
+    db.session.execute(db.text(
+        f"ALTER TABLE {teachers} ADD COLUMN department_code SMALLINT "
+        f"REFERENCES {departments} (department_code)"
+    ))
+    db.session.execute(db.text(
+        f"UPDATE {teachers} SET department_code = departments.department_code "
+        f"FROM {departments} AS departments WHERE departments.name = {teachers}.department"
+    ))
+    db.session.execute(db.text(
+        f"ALTER TABLE {teachers} ALTER COLUMN department_code SET NOT NULL, DROP COLUMN department"
+    ))
+    db.session.execute(db.text(f"CREATE INDEX ix_teachers_department_code ON {teachers} (department_code)"))
+    db.session.commit()
+    forget_departments()
+    return added
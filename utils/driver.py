@@ -0,0 +1,148 @@
+"""
+This file lets the app run on either Postgres driver: psycopg2, the default, or
+psycopg 3, chosen with DATABASE_DRIVER. On psycopg 3 the bulk write paths run in
+pipeline mode, where statements are sent without waiting for the reply to the one
+before, and statements run repeatedly are prepared once on the server rather than
+parsed and planned on every run. psycopg 3 also sends the rows of an executemany
+in a pipeline, where psycopg2 makes a round trip for every row.
+"""
+
+# Built-in imports
+import time
+import uuid
+from contextlib import contextmanager
+
+# Installed import packages
+from sqlalchemy import bindparam, create_engine, event
+from sqlalchemy.pool import NullPool
+
+# Local imports
+from init import db
+from models.student import Student
+
+# The SQLAlchemy URL scheme of each driver
+DRIVER_SCHEMES = {
+    "psycopg2": "postgresql+psycopg2",
+    "psycopg": "postgresql+psycopg"
+}
+
+
+def driver_uri(uri, driver):
+    """
+    Point a Postgres URI at the driver, e.g. postgresql://... becomes
+    postgresql+psycopg://... for psycopg 3. Other URIs are left alone.
+    """
+    if not uri:
+        return uri
+    scheme, separator, rest = uri.partition("://")
+    if separator and scheme.split("+")[0] == "postgresql":
+        return f"{DRIVER_SCHEMES[driver]}://{rest}"
+    return uri
+
+
+def driver_engine_options(driver, prepare_threshold):
+    """
+    Return the engine options the driver needs. psycopg 3 prepares a
+    statement on the server once it has run 'prepare_threshold' times on a
+    connection, or never when the threshold is None (as needed behind a
+    pooler in transaction mode, such as PgBouncer).
+    """
+    if driver == "psycopg":
+        return {"connect_args": {"prepare_threshold": prepare_threshold}}
+    return {}
+
+
+@contextmanager
+def pipeline(session = None):
+    """
+    Run the statements of the block in pipeline mode when the session is on
+    psycopg 3. Statements whose results are not read straight away, such as
+    the updates of a flush, go out without waiting on each reply, and the
+    driver waits only when a result is needed. On psycopg2 the block runs as
+    normal. The block must not end the session's transaction.
+    """
+    connection = (session or db.session).connection().connection.driver_connection
+    if not hasattr(connection, "pipeline"):
+        yield
+        return
+    with connection.pipeline():
+        yield
+
+
+def benchmark_driver(uri, driver, rows, schema = None, prepare_threshold = 5):
+    """
+    Insert 'rows' students and then update each one with an executemany, on
+    a connection of the driver's own, inside a transaction that is rolled
+    back. Returns the statements SQLAlchemy sent and the wall time of each
+    step. psycopg2 makes a round trip for every row of an executemany, while
+    psycopg 3 pipelines them and waits once, which shows in the wall time;
+    the round trips themselves happen inside the driver, out of sight of
+    SQLAlchemy, so they are not counted. The inserts are sent in batches of
+    rows by SQLAlchemy on both drivers.
+    """
+    engine = create_engine(
+        driver_uri(uri, driver),
+        poolclass = NullPool,
+        **driver_engine_options(driver, prepare_threshold)
+    )
+    counts = {"statements": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        counts["statements"] += 1
+
+    if schema:
+        engine = engine.execution_options(schema_translate_map = {None: schema})
+
+    table = Student.__table__
+    marker = uuid.uuid4().hex[:8]
+    newStudents = [
+        {"first_name": "Bench", "last_name": str(number), "email": f"bench-{marker}-{number}@example.com"}
+        for number in range(rows)
+    ]
+    update = (
+        table.update()
+        .where(table.c.student_id == bindparam("updated_id"))
+        .values(phone = bindparam("updated_phone"))
+    )
+
+    results = []
+    try:
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                for step in ("insert", "update"):
+                    counts.update(statements = 0)
+                    started = time.perf_counter()
+                    if step == "insert":
+                        ids = connection.execute(
+                            table.insert().returning(table.c.student_id),
+                            newStudents
+                        ).scalars().all()
+                    else:
+                        connection.execute(
+                            update,
+                            [{"updated_id": studentId, "updated_phone": "0400000000"} for studentId in ids]
+                        )
+                    results.append({
+                        "driver": driver,
+                        "step": step,
+                        "rows": rows,
+                        "statements": counts["statements"],
+                        "wall_ms": round((time.perf_counter() - started) * 1000, 1)
+                    })
+            finally:
+                transaction.rollback()
+    finally:
+        engine.dispose()
+    return results
+
+
+def format_driver_benchmark(results):
+    lines = [f"{'driver':<10} {'step':<8} {'rows':>7} {'statements':>11} {'wall ms':>10}"]
+    for result in results:
+        lines.append(
+            f"{result['driver']:<10} {result['step']:<8} {result['rows']:>7} "
+            f"{result['statements']:>11} {result['wall_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
@@ -10,8 +10,35 @@ failures occur.
 # Imported libraries
 from flask import jsonify
 from marshmallow import ValidationError
-from sqlalchemy.exc import IntegrityError, DataError
-from psycopg2 import errorcodes
+from sqlalchemy.exc import IntegrityError, DataError, OperationalError, TimeoutError as PoolTimeoutError
+
+# Local imports
+from init import db
+from utils.counting import CountModeError, COUNT_MODES
+from utils.statement_timeouts import QUERY_CANCELED, record_cancelled_statement
+
+# The Postgres error codes (SQLSTATE) handled below. They are the same whichever
+# driver raised the error
+NOT_NULL_VIOLATION = "23502"
+FOREIGN_KEY_VIOLATION = "23503"
+UNIQUE_VIOLATION = "23505"
+
+
+def rollback_session():
+    """
+    Roll back the failed transaction so the session can be used again and its
+    connection is handed back to the pool in a clean state, instead of staying
+    checked out in an aborted transaction until the request is torn down.
+    """
+    db.session.rollback()
+
+
+def error_code(err):
+    """
+    Return the Postgres error code of a database error, which psycopg2 calls
+    pgcode and psycopg 3 calls sqlstate.
+    """
+    return getattr(err.orig, "sqlstate", None) or getattr(err.orig, "pgcode", None)
 
 
 def register_error_handlers(app):
@@ -36,10 +63,13 @@ def register_error_handlers(app):
         a value that defies the table column constraints as defined in the 
         models and their schemas.
         """
+        # Discard the failed insert/update before building the response
+        rollback_session()
+
         if hasattr(err, "orig") and err.orig:
             # Throw error code 23502: Not Null Violation when a user enters a 
             # null value to an attribute with a not null constraint
-            if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
+            if error_code(err) == NOT_NULL_VIOLATION:
                 return {
                     "message": 
                     f"Required field: {err.orig.diag.column_name} cannot be null."
@@ -47,7 +77,7 @@ def register_error_handlers(app):
             
             # Throw a unique violation message if a user enters a value that matches 
             # one already existing in this column in the respective table
-            if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
+            if error_code(err) == UNIQUE_VIOLATION:
                 return {
                     "message": 
                     err.orig.diag.message_detail
@@ -55,7 +85,7 @@ def register_error_handlers(app):
             
             # Throw a foreign key violation message if a user enters a value in place 
             # of the foreign keys that does not exist in its primary table
-            if err.orig.pgcode == errorcodes.FOREIGN_KEY_VIOLATION:
+            if error_code(err) == FOREIGN_KEY_VIOLATION:
                 return {
                     "message": 
                     err.orig.diag.message_detail
@@ -85,11 +115,69 @@ def register_error_handlers(app):
         This function throws a data error message whenever a user inputs
         a value out of range in that column.
         """
+        # Discard the failed insert/update before building the response
+        rollback_session()
+
         return {
             "message": 
             f"{err.orig.diag.message_primary}"
         }, 409
     
+    @app.errorhandler(PoolTimeoutError)
+    def handle_pool_timeout_error(err):
+        """
+        This function throws a service unavailable message when no database 
+        connection could be taken from the pool in time, telling the client 
+        when to try again instead of leaving the request waiting.
+        """
+        # Discard whatever the failed request left in the session
+        rollback_session()
+
+        return {
+            "message": 
+            "Service is busy. Please try again shortly."
+        }, 503, {"Retry-After": str(app.config["SHED_RETRY_AFTER"])}
+    
+    @app.errorhandler(OperationalError)
+    def handle_operational_error(err):
+        """
+        This function throws a gateway timeout message when a statement ran
+        past its route's statement timeout and was cancelled, and a service
+        unavailable message when it was cancelled because the client hung up.
+        The transaction is rolled back, which also ends its timeout, so the
+        connection goes back to the pool ready for the next request.
+        """
+        # Discard the cancelled transaction before building the response
+        rollback_session()
+
+        if hasattr(err, "orig") and err.orig and error_code(err) == QUERY_CANCELED:
+            if record_cancelled_statement():
+                return {
+                    "message": 
+                    "Request was cancelled as the client disconnected."
+                }, 503
+            return {
+                "message": 
+                "Request took too long and was cancelled. Try narrowing it down."
+            }, 504
+
+        # Any other database failure is a server error
+        return {
+            "message": 
+            "Server error occured. Please contact the site administration."
+        }, 500
+    
+    @app.errorhandler(CountModeError)
+    def handle_count_mode_error(err):
+        """
+        This function throws a bad request message when a list route is asked
+        to count its rows in a way it does not support.
+        """
+        return {
+            "message": 
+            f"Count '{err}' is not supported. Use ?count= with one of: {', '.join(COUNT_MODES)}."
+        }, 400
+    
     @app.errorhandler(404)
     def handle_404(err):
         """
@@ -108,6 +196,9 @@ def register_error_handlers(app):
         wrong on the server side. This may not return an error message if
         the server itself is down.
         """
+        # Discard whatever the failed request left in the session
+        rollback_session()
+
         return {
             "message": 
             "Server error occured. Please contact the site administration."
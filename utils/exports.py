@@ -0,0 +1,322 @@
+"""
+This file runs the enrolment exports in the background. Export jobs are handed to
+a small pool of threads inside the worker process, so the web request that queued
+the export returns straight away. Each job writes the enrolments to disk in chunks
+and saves a checkpoint after every chunk, which lets a job that was cut off (for
+example by a worker restart) carry on from the last chunk it finished. A worker
+takes a job on with a claim token and keeps the job's heartbeat going while it holds
+it, queued or running, and every checkpoint only saves while the token is still the
+job's, so a job taken over by another worker is never written by two at once.
+"""
+
+# Built-in imports
+import csv
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+
+# Installed import packages
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+# Local imports
+from init import db
+from models.enrolment import Enrolment
+from models.export_job import ExportJob
+from schemas.schemas import enrolments_schema
+from utils.tenancy import current_tenant, use_tenant
+from utils.read_only import read_only_session
+
+# The file formats an export can be written in
+EXPORT_FORMATS = ("csv", "ndjson")
+
+# The column headings of the CSV export
+CSV_COLUMNS = (
+    "enrolment_id",
+    "enrolment_date",
+    "student_id",
+    "first_name",
+    "last_name",
+    "course_id",
+    "course_name",
+    "duration"
+)
+
+# The thread pool is created on first use, so each worker process gets its own
+_executor = None
+_executor_lock = Lock()
+
+# The jobs this worker process holds, queued or running, by (tenant, job id),
+# with their claim tokens, and the process the heartbeat thread runs in
+_held_jobs = {}
+_held_jobs_lock = Lock()
+_heartbeat_pid = None
+
+
+class ExportClaimLost(Exception):
+    """
+    Raised when another worker has taken over the export, so this worker
+    must stop writing it.
+    """
+
+
+def new_claim_token():
+    return uuid.uuid4().hex
+
+
+def get_executor(app):
+    """
+    Return the thread pool that runs the exports for this worker process.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers = app.config["EXPORT_WORKERS"],
+                thread_name_prefix = "export"
+            )
+    return _executor
+
+
+def heartbeat_exports(app):
+    """
+    Keep the jobs this worker holds from looking stale, a few times per
+    EXPORT_STALE_SECONDS, including the jobs still waiting for a thread and
+    the ones in the middle of a long chunk. Only jobs whose claim token is
+    still this worker's are touched.
+    """
+    while True:
+        time.sleep(app.config["EXPORT_STALE_SECONDS"] / 3)
+        with _held_jobs_lock:
+            held = dict(_held_jobs)
+
+        tenants = {}
+        for (tenant, job_id), token in held.items():
+            tenants.setdefault(tenant, []).append((job_id, token))
+        for tenant, jobs in tenants.items():
+            with app.app_context():
+                try:
+                    if tenant:
+                        use_tenant(tenant)
+                    db.session.execute(
+                        db.update(ExportJob)
+                        .where(db.tuple_(ExportJob.id, ExportJob.claim_token).in_(jobs))
+                        .values(updated_at = datetime.utcnow())
+                    )
+                    db.session.commit()
+                except Exception:
+                    app.logger.exception("Export heartbeat failed.")
+                finally:
+                    db.session.remove()
+
+
+def hold_export(app, job_id, token, tenant):
+    """
+    Count the job as held by this worker until release_export, starting the
+    heartbeat thread in this process if it is not running yet.
+    """
+    global _heartbeat_pid
+    with _held_jobs_lock:
+        _held_jobs[(tenant, job_id)] = token
+        if _heartbeat_pid != os.getpid():
+            _heartbeat_pid = os.getpid()
+            Thread(target = heartbeat_exports, args = (app,), name = "export-heartbeat", daemon = True).start()
+
+
+def release_export(job_id, token, tenant):
+    with _held_jobs_lock:
+        if _held_jobs.get((tenant, job_id)) == token:
+            del _held_jobs[(tenant, job_id)]
+
+
+def submit_export(app, job_id, token):
+    """
+    Queue the export job, claimed with the token, on the thread pool, to run
+    against the current tenant's database.
+    """
+    hold_export(app, job_id, token, current_tenant())
+    get_executor(app).submit(run_export, app, job_id, token, current_tenant())
+
+
+def claim_stale_export(app, job_id):
+    """
+    Take over an unfinished export whose worker has stopped updating it, such as
+    after the worker was restarted. The conditional update makes sure only one
+    worker picks the job back up, and the new claim token stops the worker that
+    held it from writing any more of it. Returns True when this worker took it
+    over.
+    """
+    staleBefore = datetime.utcnow() - timedelta(seconds = app.config["EXPORT_STALE_SECONDS"])
+    token = new_claim_token()
+    statement = (
+        db.update(ExportJob)
+        .where(
+            ExportJob.id == job_id,
+            ExportJob.status.in_(("queued", "running")),
+            ExportJob.updated_at < staleBefore
+        )
+        .values(claim_token = token, updated_at = datetime.utcnow())
+        .returning(ExportJob.id)
+    )
+    claimed = db.session.execute(statement).scalar() is not None
+    db.session.commit()
+    if claimed:
+        submit_export(app, job_id, token)
+    return claimed
+
+
+def save_claimed(job_id, token, **values):
+    """
+    Save the values on the job and commit, as long as the job is still
+    claimed with the token. Raises ExportClaimLost otherwise.
+    """
+    updated = db.session.execute(
+        db.update(ExportJob)
+        .where(ExportJob.id == job_id, ExportJob.claim_token == token)
+        .values(updated_at = datetime.utcnow(), **values)
+    ).rowcount
+    db.session.commit()
+    if not updated:
+        raise ExportClaimLost(job_id)
+
+
+def format_header(file_format):
+    """
+    Return the text written at the start of a new export file.
+    """
+    if file_format != "csv":
+        return ""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue()
+
+
+def format_rows(enrolments, file_format):
+    """
+    Turn a chunk of enrolments into the text written to the export file.
+    """
+    if file_format == "ndjson":
+        return "".join(
+            json.dumps(row, default = str) + "\n"
+            for row in enrolments_schema.dump(enrolments)
+        )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for enrolment in enrolments:
+        writer.writerow((
+            enrolment.id,
+            enrolment.enrolment_date,
+            enrolment.student.student_id,
+            enrolment.student.first_name,
+            enrolment.student.last_name,
+            enrolment.course.course_id,
+            enrolment.course.name,
+            enrolment.course.duration
+        ))
+    return buffer.getvalue()
+
+
+def run_export(app, job_id, token, tenant = None):
+    """
+    Write every enrolment, with its student and course, to the export file. The
+    enrolments are read in chunks ordered by id, and after each chunk is written
+    the job's checkpoint is committed, as long as the job is still claimed with
+    the token. A resumed job cuts the file back to the last checkpoint and
+    carries on from the next enrolment. The enrolments are read in one
+    deferrable read only transaction of their own, on the read replica when
+    there is one, apart from the session saving the checkpoints, so the whole
+    export comes from one snapshot. A resumed job reads the rest from a new
+    snapshot.
+    """
+    with app.app_context():
+        if tenant:
+            use_tenant(tenant)
+
+        job = db.session.get(ExportJob, job_id)
+        if job is None or job.status in ("completed", "failed") or job.claim_token != token:
+            release_export(job_id, token, tenant)
+            db.session.remove()
+            return
+
+        try:
+            # Read every chunk, and the count, in one deferrable read only
+            # transaction, so the export waits for its snapshot once and
+            # every chunk comes from the same snapshot
+            fileFormat, lastEnrolmentId, bytesWritten = job.format, job.last_enrolment_id, job.bytes_written
+            with read_only_session(deferrable = True) as reader:
+                # Count the rows up front so the progress can be reported
+                totalRows = job.total_rows
+                if totalRows is None:
+                    totalRows = reader.scalar(db.select(func.count(Enrolment.id)))
+                filePath = job.file_path or os.path.join(
+                    app.config["EXPORT_DIR"],
+                    tenant or "",
+                    f"export_{job_id}.{fileFormat}"
+                )
+                save_claimed(job_id, token, status = "running", total_rows = totalRows, file_path = filePath)
+
+                os.makedirs(os.path.dirname(filePath) or ".", exist_ok = True)
+                with open(filePath, "ab") as exportFile:
+                    # Drop anything written after the last checkpoint
+                    exportFile.truncate(bytesWritten)
+
+                    if bytesWritten == 0:
+                        exportFile.write(format_header(fileFormat).encode("utf-8"))
+
+                    while True:
+                        statement = (
+                            db.select(Enrolment)
+                            .options(
+                                joinedload(Enrolment.student),
+                                joinedload(Enrolment.course)
+                            )
+                            .where(Enrolment.id > lastEnrolmentId)
+                            .order_by(Enrolment.id)
+                            .limit(app.config["EXPORT_CHUNK_SIZE"])
+                        )
+                        enrolments = reader.scalars(statement).all()
+                        if not enrolments:
+                            break
+
+                        exportFile.write(format_rows(enrolments, fileFormat).encode("utf-8"))
+                        exportFile.flush()
+                        os.fsync(exportFile.fileno())
+
+                        # Save the checkpoint once the chunk is safely on disk,
+                        # and let go of the chunk's objects
+                        lastEnrolmentId = enrolments[-1].id
+                        save_claimed(
+                            job_id,
+                            token,
+                            last_enrolment_id = lastEnrolmentId,
+                            rows_written = ExportJob.rows_written + len(enrolments),
+                            bytes_written = exportFile.tell()
+                        )
+                        reader.expunge_all()
+
+            save_claimed(job_id, token, status = "completed")
+
+        except ExportClaimLost:
+            # Another worker has taken the job over and carries on from the
+            # last checkpoint this worker saved
+            db.session.rollback()
+            app.logger.warning("Export %s was taken over by another worker.", job_id)
+
+        except Exception as err:
+            db.session.rollback()
+            try:
+                save_claimed(job_id, token, status = "failed", error = str(err)[:255])
+            except ExportClaimLost:
+                pass
+            app.logger.exception("Export %s failed.", job_id)
+
+        finally:
+            release_export(job_id, token, tenant)
+            db.session.remove()
\ No newline at end of file
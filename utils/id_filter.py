@@ -0,0 +1,225 @@
+"""
+This file keeps a bitmap of the student and course ids in each worker's memory, so a
+new enrolment that names a student or course that does not exist is turned away with
+a 409 before a transaction is opened, instead of costing an insert, a foreign key
+violation and a rollback.
+
+The bitmaps are read when a gunicorn worker starts, and read again by a background
+thread in each worker once they are ID_FILTER_SECONDS old, so the full id scan never
+runs on a request. Ids are handed out by sequences, so most rows made since a bitmap
+was read have a higher id than it knows of, and those ids are always let through to
+the database. An id at or below the highest one the bitmap was read with that it
+does not hold is turned away without asking the database. A row with such an id,
+committed late by a transaction that was already running or written with an explicit
+id by a restore, is picked up when the bitmap is next read. Until a worker has read a
+table's bitmap every id is let through. Rows deleted by this worker are cleared from
+the bitmap when their transaction commits.
+"""
+
+# Built-in imports
+import os
+import time
+from threading import Event, Lock, Thread
+
+# Installed import packages
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Local imports
+from init import db
+from models.student import Student
+from models.course import Course
+from utils.tenancy import current_tenant, current_engine, use_tenant
+
+# The tables whose ids are kept, with their id column
+FILTERED_TABLES = {
+    "students": Student.student_id,
+    "courses": Course.course_id
+}
+
+
+class IdBitmap:
+    """
+    The ids of a table up to the highest one when it was read, one bit per
+    id. Any id above it may exist.
+    """
+
+    def __init__(self, ids, settled):
+        self.settled = settled
+        self.bits = bytearray(settled // 8 + 1)
+        for recordId in ids:
+            if 0 <= recordId <= settled:
+                self.bits[recordId >> 3] |= 1 << (recordId & 7)
+        self.built = time.monotonic()
+
+    def might_exist(self, recordId):
+        if recordId > self.settled:
+            return True
+        if recordId < 0:
+            return False
+        return bool(self.bits[recordId >> 3] & (1 << (recordId & 7)))
+
+    def discard(self, recordId):
+        if 0 <= recordId <= self.settled:
+            self.bits[recordId >> 3] &= ~(1 << (recordId & 7)) & 0xFF
+
+
+# The bitmaps of each tenant's tables read by this worker, by (tenant, table),
+# the bitmaps the worker's requests have asked for, and the process the
+# refresh thread runs in
+_bitmaps = {}
+_bitmaps_lock = Lock()
+_wanted = set()
+_wanted_changed = Event()
+_refresher_pid = None
+
+
+def load_bitmap(table):
+    """
+    Read the ids of one of the current tenant's tables into a new bitmap, on
+    a connection of its own so the request's session is left untouched.
+    """
+    column = FILTERED_TABLES[table]
+    with current_engine().connect() as connection:
+        highest = connection.scalar(db.select(db.func.max(column))) or 0
+        ids = connection.scalars(db.select(column).where(column <= highest))
+        bitmap = IdBitmap(ids, highest)
+    with _bitmaps_lock:
+        _bitmaps[(current_tenant(), table)] = bitmap
+    return bitmap
+
+
+def refresh_bitmaps(app):
+    """
+    Read every bitmap this worker uses again once it is ID_FILTER_SECONDS
+    old, and read a bitmap a request has asked for for the first time.
+    Runs in the worker's refresh thread.
+    """
+    while True:
+        for tenant, table in list(_wanted):
+            bitmap = _bitmaps.get((tenant, table))
+            if bitmap is not None and time.monotonic() - bitmap.built <= app.config["ID_FILTER_SECONDS"]:
+                continue
+            try:
+                with app.app_context():
+                    if tenant:
+                        use_tenant(tenant)
+                    load_bitmap(table)
+            except Exception:
+                app.logger.exception("Reading the %s id bitmap failed.", table)
+        _wanted_changed.wait(1)
+        _wanted_changed.clear()
+
+
+def start_refresher(app):
+    """
+    Start the refresh thread in the worker that needs it, as a thread
+    started before a fork does not run in the child.
+    """
+    global _refresher_pid
+    with _bitmaps_lock:
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+    Thread(target = refresh_bitmaps, args = (app,), name = "id-filter-refresh", daemon = True).start()
+
+
+def cached_bitmap(table):
+    """
+    Return the current tenant's bitmap of the table, or None if this worker
+    has not read it yet, in which case the refresh thread reads it.
+    """
+    key = (current_tenant(), table)
+    if key not in _wanted:
+        start_refresher(current_app._get_current_object())
+        _wanted.add(key)
+        _wanted_changed.set()
+    return _bitmaps.get(key)
+
+
+def warm_up_id_filters(app):
+    """
+    Read the bitmaps of every tenant's tables in a new worker before its
+    first request, and start the thread that keeps them fresh.
+    """
+    if not app.config["ID_FILTER"]:
+        return
+    with app.app_context():
+        for tenant in app.config["TENANTS"] or [None]:
+            if tenant:
+                use_tenant(tenant)
+            for table in FILTERED_TABLES:
+                load_bitmap(table)
+                _wanted.add((tenant, table))
+    start_refresher(app)
+
+
+def might_exist(table, recordId):
+    """
+    Return False if there is definitely no row with this id in the table,
+    or True if there may be. Values that are not ids are left for the
+    database to reject.
+    """
+    if not current_app.config["ID_FILTER"]:
+        return True
+    if not isinstance(recordId, int) or isinstance(recordId, bool):
+        return True
+    bitmap = cached_bitmap(table)
+    return bitmap is None or bitmap.might_exist(recordId)
+
+
+def missing_reference(**references):
+    """
+    Return the first (table, column, id) whose id is definitely not in its
+    table, e.g. missing_reference(students = 3, courses = 9), or None.
+    """
+    for table, recordId in references.items():
+        if not might_exist(table, recordId):
+            return table, FILTERED_TABLES[table].name, recordId
+    return None
+
+
+def error_missing_reference(table, column, recordId):
+    return {"message": f"Key ({column})=({recordId}) is not present in table \"{table}\"."}, 409
+
+
+def collect_deleted_ids(session, flush_context):
+    """
+    Note the ids of the filtered rows the flush deleted, to be cleared from
+    the bitmaps once the transaction commits.
+    """
+    for record in session.deleted:
+        table = db.inspect(record).mapper.local_table.name
+        if table in FILTERED_TABLES:
+            recordId = db.inspect(record).identity[0]
+            session.info.setdefault("deleted_ids", []).append((table, recordId))
+
+
+def clear_deleted_ids(session):
+    deleted = session.info.pop("deleted_ids", [])
+    if not deleted or not has_app_context():
+        return
+    tenant = current_tenant()
+    for table, recordId in deleted:
+        bitmap = _bitmaps.get((tenant, table))
+        if bitmap is not None:
+            bitmap.discard(recordId)
+
+
+def drop_deleted_ids(session, previous_transaction = None):
+    session.info.pop("deleted_ids", None)
+
+
+def register_id_filters():
+    """
+    Keep the bitmaps in step with the rows deleted through every session.
+    Calling this again does not attach the listeners twice.
+    """
+    for name, listener in (
+        ("after_flush", collect_deleted_ids),
+        ("after_commit", clear_deleted_ids),
+        ("after_soft_rollback", drop_deleted_ids)
+    ):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
@@ -0,0 +1,57 @@
+"""
+This file contains the helpers that let a route honour the 'Idempotency-Key'
+request header. The first request with a key claims it inside the current
+transaction and stores its response, any retry with the same key is answered
+with that stored response without running the route again.
+"""
+
+# Installed import packages
+from flask import request
+from sqlalchemy.dialects.postgresql import insert
+
+# Local imports
+from init import db
+from models.idempotency_key import IdempotencyKey
+
+
+def get_idempotency_key():
+    """
+    Fetch the idempotency key from the request headers, if the client sent one.
+    """
+    key = request.headers.get("Idempotency-Key")
+    return key.strip() if key and key.strip() else None
+
+
+def claim_idempotency_key(key, endpoint):
+    """
+    Claim the key for this request inside the current transaction. If another
+    request already holds the key, Postgres waits for that request to finish
+    and the stored record is returned so the caller can replay it. None is
+    returned when this request now owns the key.
+    """
+    statement = (
+        insert(IdempotencyKey)
+        .values(key = key, endpoint = endpoint)
+        .on_conflict_do_nothing(index_elements = [IdempotencyKey.key])
+        .returning(IdempotencyKey.key)
+    )
+
+    # The key was claimed by this request
+    if db.session.execute(statement).scalar() is not None:
+        return None
+
+    # The key was claimed by an earlier request, return its stored response
+    return db.session.get(IdempotencyKey, key)
+
+
+def store_idempotent_response(key, response_body, status_code):
+    """
+    Save the response of the request that claimed the key. This is written in
+    the same transaction as the route's own changes, so both are committed or
+    rolled back together.
+    """
+    db.session.execute(
+        db.update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(response_body = response_body, status_code = status_code)
+    )
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""
+This file replays realistic traffic mixes against a running instance of the LMS API,
+such as a local gunicorn, to see how it holds up under load. Each scenario is a
+weighted mix of requests sent by many concurrent clients for a set time. The report
+gives the latency percentiles, throughput and responses by status code for the run,
+with the database pool usage sampled from /poolz while it runs, and two saved reports
+can be compared to see the effect of a change.
+"""
+
+# Built-in imports
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# The requests each scenario sends, with how often each one is picked
+SCENARIOS = {
+    # Enrolment opens: students enrol in courses while checking the course list
+    "registration-rush": (
+        (80, "enrol"),
+        (20, "list_courses")
+    ),
+    # Staff and students keep dashboards open that poll the courses
+    "dashboard-polling": (
+        (85, "list_courses"),
+        (10, "course_roster"),
+        (5, "get_course")
+    ),
+    # Administrators add and edit records while browsing them
+    "admin-edits": (
+        (30, "create_student"),
+        (25, "update_student"),
+        (15, "update_course"),
+        (30, "list_students")
+    )
+}
+
+
+class LoadClient:
+    """
+    Sends the API requests of a scenario, picking the students and courses it
+    works on from the ids that exist when the run starts.
+    """
+
+    def __init__(self, base_url, timeout = 10, tenant = None, tenant_header = "X-Tenant"):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json"}
+        if tenant:
+            self.headers[tenant_header] = tenant
+        self.student_ids = []
+        self.course_ids = []
+
+    def send(self, method, path, body = None):
+        """
+        Send one request. Returns the status code (0 when no response came
+        back) and the parsed JSON body, if any.
+        """
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        apiRequest = urllib.request.Request(
+            self.base_url + path,
+            data = data,
+            headers = self.headers,
+            method = method
+        )
+        try:
+            with urllib.request.urlopen(apiRequest, timeout = self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as err:
+            status, payload = err.code, err.read()
+        except (urllib.error.URLError, OSError):
+            return 0, None
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+    def load_ids(self):
+        """
+        Read the ids of the existing students and courses to send requests for.
+        """
+        for path, key, ids in (
+            ("/students/", "student_id", self.student_ids),
+            ("/courses/", "course_id", self.course_ids)
+        ):
+            status, payload = self.send("GET", path)
+            if status != 200 or not isinstance(payload, list):
+                raise RuntimeError(f"Could not read {path} (status {status}).")
+            ids.extend(record[key] for record in payload)
+        if not self.student_ids or not self.course_ids:
+            raise RuntimeError("The database needs students and courses to run a load test.")
+
+    def enrol(self):
+        return self.send(
+            "POST",
+            "/enrolments/",
+            {
+                "student_id": random.choice(self.student_ids),
+                "course_id": random.choice(self.course_ids)
+            }
+        )
+
+    def list_courses(self):
+        return self.send("GET", "/courses/")
+
+    def list_students(self):
+        return self.send("GET", "/students/")
+
+    def get_course(self):
+        return self.send("GET", f"/courses/{random.choice(self.course_ids)}")
+
+    def course_roster(self):
+        return self.send("GET", f"/courses/{random.choice(self.course_ids)}/students")
+
+    def create_student(self):
+        marker = uuid.uuid4().hex[:12]
+        return self.send(
+            "POST",
+            "/students/",
+            {
+                "first_name": "Load",
+                "last_name": f"Test {marker}",
+                "email": f"load.{marker}@example.com"
+            }
+        )
+
+    def update_student(self):
+        return self.send(
+            "PATCH",
+            f"/students/{random.choice(self.student_ids)}",
+            {"phone": f"04{random.randint(0, 99999999):08d}"}
+        )
+
+    def update_course(self):
+        return self.send(
+            "PATCH",
+            f"/courses/{random.choice(self.course_ids)}",
+            {"duration": random.choice([1.5, 2, 2.5, 3])}
+        )
+
+
+def percentile(sortedValues, percent):
+    """
+    Return the value below which the given percent of the sorted values fall,
+    using the nearest-rank method.
+    """
+    if not sortedValues:
+        return None
+    rank = max(1, -(-len(sortedValues) * percent // 100))
+    return sortedValues[int(rank) - 1]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None
+    }
+
+
+def sample_pools(client, stop, interval, samples):
+    """
+    Read the pool usage reported by /poolz until the run stops. Each sample
+    comes from whichever worker answered it.
+    """
+    while not stop.wait(interval):
+        status, payload = client.send("GET", "/poolz")
+        if status == 200 and payload:
+            samples.append(payload)
+
+
+def pool_summary(samples):
+    """
+    Summarise the pool samples: the most connections seen checked out of one
+    worker's pool, how often a pool had every connection in use, and the
+    highest average wait for a connection.
+    """
+    pools = [pool for sample in samples for pool in sample["pools"].values()]
+    if not pools:
+        return {"samples": 0}
+    return {
+        "samples": len(samples),
+        "max_checked_out": max(pool["checked_out"] for pool in pools),
+        "saturated_percent": round(
+            100 * sum(pool["checked_out"] >= pool["capacity"] for pool in pools) / len(pools), 1
+        ),
+        "max_average_wait_ms": max(pool["average_wait_ms"] for pool in pools)
+    }
+
+
+def run_scenario(base_url, scenario, concurrency = 20, duration = 30, tenant = None, timeout = 10,
+                 tenant_header = "X-Tenant"):
+    """
+    Send the scenario's traffic mix from 'concurrency' clients for 'duration'
+    seconds and return its report. The tenant is sent in the 'tenant_header'
+    header, which must match the server's TENANT_HEADER.
+    """
+    client = LoadClient(base_url, timeout, tenant, tenant_header)
+    client.load_ids()
+    weights, actions = zip(*((weight, action) for weight, action in SCENARIOS[scenario]))
+
+    results = []
+    resultsLock = threading.Lock()
+    stop = threading.Event()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            action = random.choices(actions, weights)[0]
+            started = time.perf_counter()
+            status, _ = getattr(client, action)()
+            elapsed = time.perf_counter() - started
+            with resultsLock:
+                results.append((action, status, elapsed))
+
+    poolSamples = []
+    sampler = threading.Thread(target = sample_pools, args = (client, stop, 1.0, poolSamples), daemon = True)
+    sampler.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    statuses = Counter(str(status) for _, status, _ in results)
+    errors = sum(count for status, count in statuses.items() if status == "0" or int(status) >= 400)
+    byAction = defaultdict(list)
+    for action, _, latency in results:
+        byAction[action].append(latency)
+
+    return {
+        "scenario": scenario,
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0,
+        "latency": latency_summary([latency for _, _, latency in results]),
+        "actions": {action: latency_summary(latencies) for action, latencies in sorted(byAction.items())},
+        "status_codes": dict(sorted(statuses.items())),
+        "error_rate_percent": round(100 * errors / len(results), 2) if results else 0,
+        "pool": pool_summary(poolSamples)
+    }
+
+
+def format_report(report):
+    """
+    Lay out a scenario report as text for the terminal.
+    """
+    latency = report["latency"]
+    lines = [
+        f"Scenario {report['scenario']}: {report['concurrency']} clients for {report['duration_s']}s",
+        f"  {latency['requests']} requests, {report['throughput_rps']} req/s, "
+        f"{report['error_rate_percent']}% errors",
+        f"  latency p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms",
+        "  status codes: " + ", ".join(f"{status}: {count}" for status, count in report["status_codes"].items())
+    ]
+    for action, summary in report["actions"].items():
+        lines.append(
+            f"  {action}: {summary['requests']} requests, p50 {summary['p50_ms']} ms, "
+            f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms"
+        )
+    pool = report["pool"]
+    if pool["samples"]:
+        lines.append(
+            f"  pool: up to {pool['max_checked_out']} connections in use, saturated in "
+            f"{pool['saturated_percent']}% of samples, wait up to {pool['max_average_wait_ms']} ms"
+        )
+    return "\n".join(lines)
+
+
+def compare_reports(baseline, candidate):
+    """
+    Lay out the change in throughput, latency and errors between two reports
+    of the same scenarios as text for the terminal.
+    """
+    def change(before, after):
+        if before is None or after is None:
+            return f"{before} -> {after}"
+        if not before:
+            return f"{before} -> {after}"
+        return f"{before} -> {after} ({(after - before) / before * 100:+.1f}%)"
+
+    lines = []
+    candidates = {report["scenario"]: report for report in candidate}
+    for before in baseline:
+        after = candidates.get(before["scenario"])
+        if after is None:
+            lines.append(f"Scenario {before['scenario']}: missing from the second run")
+            continue
+        lines.append(f"Scenario {before['scenario']}:")
+        lines.append(f"  throughput req/s: {change(before['throughput_rps'], after['throughput_rps'])}")
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            lines.append(f"  {key}: {change(before['latency'][key], after['latency'][key])}")
+        lines.append(f"  error rate %: {change(before['error_rate_percent'], after['error_rate_percent'])}")
+    return "\n".join(lines)
\ No newline at end of file
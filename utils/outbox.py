@@ -0,0 +1,185 @@
+"""
+This file writes the change rows of the transactional outbox (see models/change.py)
+and reads them back for the changes feed. Changes are captured with SQLAlchemy
+session events, so they are written in the same transaction as the change itself:
+objects added, modified or deleted through the session are captured when they are
+flushed, and insert, update and delete statements run through the session (such as
+the seat counter updates) are captured as they execute.
+"""
+
+# Built-in imports
+from datetime import date, datetime, timedelta
+
+# Installed import packages
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+# Local imports
+from init import db
+from models.change import Change
+
+# The tables whose changes are written to the outbox
+TRACKED_TABLES = {"students", "teachers", "courses", "enrolments"}
+
+
+def json_value(value):
+    """
+    Convert a column value into a value that can be stored as JSON.
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def change_row(table_name, row_id, operation, payload):
+    return {
+        "table_name": table_name,
+        "row_id": row_id,
+        "operation": operation,
+        "payload": payload
+    }
+
+
+def capture_flush_changes(session, flush_context):
+    """
+    Write a change row for every tracked object the flush inserted, updated or
+    deleted. Only the values already loaded on the object are included, so no
+    extra queries are run in the middle of the flush.
+    """
+    changes = []
+    for records, operation in (
+        (session.new, "insert"),
+        (session.dirty, "update"),
+        (session.deleted, "delete")
+    ):
+        for record in records:
+            state = db.inspect(record)
+            table = state.mapper.local_table
+            if table.name not in TRACKED_TABLES:
+                continue
+            if operation == "update" and not session.is_modified(record, include_collections = False):
+                continue
+
+            primaryKey = state.mapper.primary_key[0]
+            rowId = state.dict.get(state.mapper.get_property_by_column(primaryKey).key)
+            if operation == "delete":
+                payload = {primaryKey.name: rowId}
+            else:
+                payload = {
+                    attribute.columns[0].name: json_value(state.dict[attribute.key])
+                    for attribute in state.mapper.column_attrs
+                    if attribute.key in state.dict
+                }
+            changes.append(change_row(table.name, rowId, operation, payload))
+
+    if changes:
+        session.connection().execute(insert(Change.__table__), changes)
+
+
+def capture_statement_changes(orm_execute_state):
+    """
+    Write change rows for insert, update and delete statements on tracked tables.
+    The statement is made to return the primary keys of the rows it touched, the
+    rows' new values are read back in one query, and the statement's result is
+    handed back to the caller unchanged.
+    """
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+
+    statement = orm_execute_state.statement
+    table = statement.table
+    if getattr(table, "name", None) not in TRACKED_TABLES:
+        return None
+
+    # Make sure the primary key is among the returned columns
+    primaryKey = table.primary_key.columns[0]
+    returned = [column.name for column in statement.exported_columns]
+    if primaryKey.name not in returned:
+        statement = statement.returning(primaryKey)
+        returned.append(primaryKey.name)
+
+    frozen = orm_execute_state.invoke_statement(statement = statement).freeze()
+    position = returned.index(primaryKey.name)
+    rowIds = [row[position] for row in frozen().all()]
+
+    if rowIds:
+        if orm_execute_state.is_delete:
+            changes = [
+                change_row(table.name, rowId, "delete", {primaryKey.name: rowId})
+                for rowId in rowIds
+            ]
+        else:
+            operation = "insert" if orm_execute_state.is_insert else "update"
+            rows = orm_execute_state.session.connection().execute(
+                db.select(table).where(primaryKey.in_(rowIds))
+            ).mappings()
+            changes = [
+                change_row(
+                    table.name,
+                    row[primaryKey.name],
+                    operation,
+                    {column: json_value(value) for column, value in row.items()}
+                )
+                for row in rows
+            ]
+        orm_execute_state.session.connection().execute(insert(Change.__table__), changes)
+
+    return frozen()
+
+
+def register_change_capture():
+    """
+    Attach the outbox writers to every session. Calling this again, such as
+    when a second app is created, does not attach them twice.
+    """
+    if not event.contains(Session, "after_flush", capture_flush_changes):
+        event.listen(Session, "after_flush", capture_flush_changes)
+    if not event.contains(Session, "do_orm_execute", capture_statement_changes):
+        event.listen(Session, "do_orm_execute", capture_statement_changes)
+
+
+def encode_cursor(change):
+    return f"{change.txid}-{change.id}"
+
+
+def decode_cursor(cursor):
+    """
+    Split a cursor into the transaction id and change id it points at, or
+    return None if the cursor is malformed.
+    """
+    try:
+        txid, changeId = (int(part) for part in cursor.split("-"))
+    except (AttributeError, ValueError):
+        return None
+    return txid, changeId
+
+
+def read_changes(since, limit):
+    """
+    Read the next batch of changes after the cursor, oldest first. Only changes
+    from transactions that have finished are returned, and changes are ordered
+    by transaction id, so a transaction that commits after a reader has moved
+    past its neighbours still sorts after the reader's cursor.
+    """
+    completedBefore = db.text("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+    statement = (
+        db.select(Change)
+        .where(Change.txid < completedBefore)
+        .order_by(Change.txid, Change.id)
+        .limit(limit)
+    )
+    if since:
+        statement = statement.where(db.tuple_(Change.txid, Change.id) > db.tuple_(*since))
+    return db.session.scalars(statement).all()
+
+
+def prune_changes(retention_days):
+    """
+    Delete the changes older than the retention period, measured on the
+    database clock that set their created_at. Returns the number of changes
+    deleted.
+    """
+    cutoff = db.func.localtimestamp() - timedelta(days = retention_days)
+    result = db.session.execute(db.delete(Change).where(Change.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
\ No newline at end of file
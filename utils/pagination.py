@@ -0,0 +1,33 @@
+"""
+This file reads the paging arguments shared by the list routes. Pages are keyset
+based: instead of a page number the client sends the last id it has seen, so each
+page starts with an index lookup no matter how deep into the list it is.
+"""
+
+# Installed import packages
+from flask import request, current_app
+
+
+def get_page_args():
+    """
+    Fetch the page size ('limit') and the id to continue after ('after') from
+    the query string. The page size is kept between 1 and PAGE_SIZE_MAX.
+    """
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE_DEFAULT"], type = int)
+    limit = max(1, min(limit, current_app.config["PAGE_SIZE_MAX"]))
+    after = request.args.get("after", 0, type = int)
+    return limit, after
+
+
+def page_response(items, limit, key):
+    """
+    Wrap a page of rows with the value to pass as 'after' for the next page,
+    which is None on the last page. One extra row is fetched beyond the page
+    size to tell whether there is a next page.
+    """
+    hasMore = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "next_after": items[-1][key] if hasMore else None
+    }
\ No newline at end of file
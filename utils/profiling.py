@@ -0,0 +1,197 @@
+"""
+This file profiles individual requests on demand. A request from an allowed client is
+profiled when it sends the X-Profile header or the profile query parameter, and a
+small share of all requests can be profiled at random so slow routes are caught in
+production. One sampling thread per worker reads the stacks of the profiled request
+threads at a fixed interval, which costs little whatever the route does, and the
+stacks are written in the collapsed format read by flame graph tools. Requests
+profiled on demand are also run under cProfile, which records every call, and its
+stats are written next to the stacks. A lock keeps one cProfile per worker, which
+keeps its per-call overhead bounded, and a request that asks while another holds it
+gets the sampled stacks alone. cProfile only hooks the thread that enables it, but
+from Python 3.12 a second one cannot be enabled while one is running. Profiles are
+written to a folder per blueprint and endpoint.
+"""
+
+# Built-in imports
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Installed import packages
+from flask import g, request
+
+# Local imports
+from utils.tenancy import EXEMPT_ENDPOINTS
+
+# Held by the request running under cProfile in this worker process
+_cprofile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads being profiled from one background
+    thread, counting how often each stack is seen in each thread. The
+    thread sleeps while no thread is being profiled.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.profiling = threading.Condition(self.lock)
+        self.pid = None
+
+    def add(self, thread_id):
+        with self.lock:
+            self.stacks[thread_id] = Counter()
+            # Start the thread in the worker that needs it, as a thread
+            # started before a fork does not run in the child
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target = self.run, name = "profile-sampler", daemon = True).start()
+            self.profiling.notify()
+
+    def remove(self, thread_id):
+        """
+        Stop sampling the thread and return the stacks seen in it.
+        """
+        with self.lock:
+            return self.stacks.pop(thread_id, Counter())
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.stacks:
+                    self.profiling.wait()
+                frames = sys._current_frames()
+                for thread_id, stacks in self.stacks.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    if stack:
+                        stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+
+def collapsed(stacks):
+    """
+    Return the stacks in the collapsed format: one line per stack, the
+    frames from the outermost in, followed by the number of samples.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfile:
+    """
+    The profilers running for one request. 'deterministic' requests cProfile
+    as well, which is only used if no other request holds it.
+    """
+
+    def __init__(self, sampler, deterministic):
+        self.started = time.perf_counter()
+        self.sampler = sampler
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.profiler = None
+        if deterministic and _cprofile_lock.acquire(blocking = False):
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.sampler.add(self.thread_id)
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+            _cprofile_lock.release()
+        self.stacks = self.sampler.remove(self.thread_id)
+        return time.perf_counter() - self.started
+
+    def write(self, folder, name):
+        """
+        Write the collapsed stacks, and the cProfile stats if there are any,
+        into the folder. Returns the paths written.
+        """
+        os.makedirs(folder, exist_ok = True)
+        paths = [os.path.join(folder, f"{name}.collapsed")]
+        with open(paths[0], "w", encoding = "utf-8") as stacksFile:
+            stacksFile.write(collapsed(self.stacks))
+        if self.profiler:
+            paths.append(os.path.join(folder, f"{name}.prof"))
+            self.profiler.dump_stats(paths[1])
+        return paths
+
+
+def profile_requested(app):
+    """
+    Return whether the request asks to be profiled and comes from a client
+    that is allowed to ask.
+    """
+    asked = request.headers.get("X-Profile") or request.args.get("profile")
+    return bool(asked) and request.remote_addr in app.config["PROFILE_ALLOWED_CLIENTS"]
+
+
+def register_profiling(app):
+    """
+    This function attaches the request profiler to the Flask app, when
+    profiling is turned on in its configuration.
+    """
+    if not app.config["PROFILING"]:
+        return
+
+    sampler = StackSampler(app.config["PROFILE_INTERVAL"])
+
+    @app.before_request
+    def start_profile():
+        """
+        Start profiling the request if it asked to be, or if it was picked
+        for the random sample.
+        """
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        requested = profile_requested(app)
+        if not requested and random.random() >= app.config["PROFILE_SAMPLE_RATE"]:
+            return None
+
+        g.profile = RequestProfile(sampler, deterministic = requested)
+        g.profile.start()
+        return None
+
+    @app.after_request
+    def write_profile(response):
+        """
+        Stop the profilers and write the profile into the folder of the
+        request's blueprint and endpoint, naming the file in the response.
+        """
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+
+        elapsed = profile.stop()
+        blueprint, _, endpoint = (request.endpoint or "unknown").rpartition(".")
+        folder = os.path.join(app.config["PROFILE_DIR"], blueprint or "app", endpoint)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{int(elapsed * 1000)}ms-{uuid.uuid4().hex[:8]}"
+        profile.write(folder, name)
+        response.headers["X-Profile-Id"] = f"{blueprint or 'app'}/{endpoint}/{name}"
+        return response
+
+    @app.teardown_request
+    def stop_profile(err):
+        """
+        Stop the profilers of a request that failed before its profile was
+        written.
+        """
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.stop()
\ No newline at end of file
@@ -0,0 +1,355 @@
+"""
+This file checks the SQL statements each route runs against the budget declared
+on it with @query_budget. A route is requested and every statement it sends to the
+database is recorded, and the route fails its budget if it runs more statements than
+allowed, runs the same statement more than once (a statement inside a loop, such as
+one query per row), or lazy loads a relationship. A small change such as a nested
+field added to a schema shows up here rather than as slow responses in production.
+The write routes are requested on one connection whose transaction is rolled back,
+so checking them leaves the database as it was.
+"""
+
+# Built-in imports
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+# Installed import packages
+from flask import current_app, g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Local imports
+from init import db
+from models.student import Student
+from models.teacher import Teacher
+from models.course import Course
+from models.enrolment import Enrolment
+from models.export_job import ExportJob
+from models.department import Department
+from utils.departments import cached_departments
+from utils.tenancy import current_engine
+
+# The model each id in a route's URL belongs to, used to request the route for a
+# record that exists
+ROUTE_ARGUMENT_MODELS = {
+    "student_id": Student,
+    "teacher_id": Teacher,
+    "course_id": Course,
+    "enrolment_id": Enrolment,
+    "export_id": ExportJob
+}
+
+# The student created when checking the write routes that create one
+SAMPLE_STUDENT = {"first_name": "Query", "last_name": "Budget", "email": "query.budget@example.com"}
+
+# The methods that change data, requested inside a transaction that is rolled back
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# Transaction control and setup statements, such as the statement timeout set
+# at the start of each request's transaction, which are not counted against the
+# budget
+IGNORED_STATEMENTS = re.compile(r"^\s*(SAVEPOINT|RELEASE|ROLLBACK|SET)\b", re.IGNORECASE)
+
+
+def query_budget(max_statements, allow_repeats = False, allow_lazy_loads = False):
+    """
+    Declare the most SQL statements a route may run per request, and whether
+    it may run the same statement more than once or lazy load relationships.
+    Apply it directly below the route decorator.
+    """
+    def declare(view):
+        view.query_budget = {
+            "max_statements": max_statements,
+            "allow_repeats": allow_repeats,
+            "allow_lazy_loads": allow_lazy_loads
+        }
+        return view
+    return declare
+
+
+class StatementRecorder:
+    """
+    The statements sent to the database while recording, and the lazy loads
+    among them.
+    """
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.statements = []
+        self.lazy_loads = []
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread and not IGNORED_STATEMENTS.match(statement):
+            self.statements.append(" ".join(statement.split()))
+
+    def record_lazy_load(self, orm_execute_state):
+        if threading.get_ident() != self.thread:
+            return
+        if orm_execute_state.is_select and orm_execute_state.lazy_loaded_from is not None:
+            self.lazy_loads.append(
+                f"{orm_execute_state.lazy_loaded_from.class_.__name__}: "
+                + " ".join(str(orm_execute_state.statement).split())
+            )
+
+    def repeated(self):
+        """
+        Return the statements that ran more than once, with how many times.
+        """
+        return {statement: count for statement, count in Counter(self.statements).items() if count > 1}
+
+
+@contextmanager
+def record_statements():
+    """
+    Record every statement this thread sends to the database, on any engine,
+    until the block ends. Statements from background threads, such as an
+    export started by the route, are left out.
+    """
+    recorder = StatementRecorder()
+    event.listen(Engine, "before_cursor_execute", recorder.record_statement)
+    event.listen(Session, "do_orm_execute", recorder.record_lazy_load)
+    try:
+        yield recorder
+    finally:
+        event.remove(Engine, "before_cursor_execute", recorder.record_statement)
+        event.remove(Session, "do_orm_execute", recorder.record_lazy_load)
+
+
+@contextmanager
+def rolled_back_writes():
+    """
+    Run every query in the block on one connection of the current tenant's
+    engine, inside a transaction that is rolled back when the block ends. The
+    session joins the connection with savepoints, so a route's commit or
+    rollback only releases or rolls back its own savepoint.
+    """
+    db.session.remove()
+    connection = current_engine().connect()
+    transaction = connection.begin()
+    g.pinned_connection = connection
+    try:
+        yield connection
+    finally:
+        g.pop("pinned_connection", None)
+        db.session.remove()
+        transaction.rollback()
+        connection.close()
+
+
+def first_id(model):
+    """
+    Return the lowest id of the model's records, or None if it has none.
+    """
+    primaryKey = db.inspect(model).primary_key[0]
+    return db.session.scalar(db.select(primaryKey).order_by(primaryKey).limit(1))
+
+
+def sample_url(rule):
+    """
+    Build a URL for the route using the id of an existing record for each
+    argument, or return None if there is no record to request it with.
+    """
+    values = {}
+    for argument in rule.arguments:
+        model = ROUTE_ARGUMENT_MODELS.get(argument)
+        if model is None:
+            return None
+        pick = SAMPLE_IDS.get(rule.endpoint, first_id)
+        values[argument] = pick(model)
+        if values[argument] is None:
+            return None
+    return rule.build(values, append_unknown = False)[1]
+
+
+def course_without_enrolments(model):
+    """
+    Return the lowest id of a course nobody is enrolled in, as a course with
+    enrolments cannot be deleted.
+    """
+    return db.session.scalar(
+        db.select(Course.course_id)
+        .where(~Course.enrolments.any())
+        .order_by(Course.course_id)
+        .limit(1)
+    )
+
+
+def sample_enrolment():
+    """
+    A new enrolment of the first student in a course they are not enrolled in.
+    """
+    enrolled = db.exists().where(
+        Enrolment.student_id == Student.student_id,
+        Enrolment.course_id == Course.course_id
+    )
+    pair = db.session.execute(
+        db.select(Student.student_id, Course.course_id)
+        .join(Course, db.true())
+        .where(~enrolled)
+        .order_by(Student.student_id, Course.course_id)
+        .limit(1)
+    ).first()
+    if pair is None:
+        return None
+    return {"student_id": pair.student_id, "course_id": pair.course_id}
+
+
+def sample_teacher():
+    """
+    A new teacher in the first department.
+    """
+    department = db.session.scalar(db.select(Department.name).order_by(Department.department_code).limit(1))
+    if department is None:
+        return None
+    return {"first_name": "Query", "last_name": "Budget", "department": department, "email": "query.budget@example.com"}
+
+
+def sample_batch():
+    """
+    A batch that creates a student and enrols them in the first course.
+    """
+    course_id = first_id(Course)
+    if course_id is None:
+        return None
+    return {"operations": [
+        {"method": "POST", "path": "/students/", "body": SAMPLE_STUDENT, "ref": "student"},
+        {"method": "POST", "path": "/enrolments/", "body": {"student_id": "$student", "course_id": course_id}}
+    ]}
+
+
+def sample_rollover():
+    """
+    A rollover of the first course into a term starting tomorrow.
+    """
+    course_id = first_id(Course)
+    if course_id is None:
+        return None
+    return {
+        "term_start": (date.today() + timedelta(days = 1)).isoformat(),
+        "courses": [course_id],
+        "suffix": " Next"
+    }
+
+
+# Routes that need a particular record to succeed, with the function picking
+# its id instead of the lowest one
+SAMPLE_IDS = {
+    "courses.delete_course": course_without_enrolments
+}
+
+# The request body each write route is checked with, built from the records
+# in the database. A route whose body cannot be built (None) is skipped
+SAMPLE_BODIES = {
+    "students.create_student": lambda: SAMPLE_STUDENT,
+    "students.update_student": lambda: {"phone": "0400000000"},
+    "teachers.create_teacher": sample_teacher,
+    "teachers.update_teacher": lambda: {"phone": "0400000000"},
+    "courses.create_course": lambda: {"name": "Query Budget", "duration": 2},
+    "courses.update_a_course": lambda: {"duration": 3},
+    "enrolments.create_enrolment": sample_enrolment,
+    "exports.create_export": lambda: {"format": "csv"},
+    "batch.run_batch_operations": sample_batch,
+    "admin.rollover_courses": sample_rollover
+}
+
+
+def check_route(client, rule, budget, headers, method = "GET"):
+    """
+    Request the route with the method and compare the statements it ran with
+    its budget. Returns the URL requested (None if it could not be) and the
+    problems found, each with the statements at fault.
+    """
+    url = sample_url(rule)
+    if url is None:
+        return None, []
+    body = None
+    if rule.endpoint in SAMPLE_BODIES:
+        body = SAMPLE_BODIES[rule.endpoint]()
+        if body is None:
+            return None, []
+
+    # Start each request with an empty session, as a real request would
+    db.session.remove()
+    with record_statements() as recorder:
+        response = client.open(url, method = method, json = body, headers = headers)
+
+    problems = []
+    if response.status_code >= 400:
+        problems.append((
+            f"responded with status {response.status_code}",
+            [response.get_data(as_text = True).strip()[:500]]
+        ))
+    if len(recorder.statements) > budget["max_statements"]:
+        problems.append((
+            f"ran {len(recorder.statements)} statements, budget is {budget['max_statements']}",
+            recorder.statements
+        ))
+    if not budget["allow_repeats"] and recorder.repeated():
+        problems.append((
+            "ran the same statement more than once",
+            [f"{count}x {statement}" for statement, count in recorder.repeated().items()]
+        ))
+    if not budget["allow_lazy_loads"] and recorder.lazy_loads:
+        problems.append(("lazy loaded a relationship", recorder.lazy_loads))
+    return url, problems
+
+
+def check_query_budgets(headers = None):
+    """
+    Check every route against its query budget, the read routes first and
+    then each method of the write routes, each write in a savepoint that is
+    rolled back. Routes without a budget are reported as failures, so new
+    routes get one. Returns a list of (endpoint, url, problems), where a route
+    within its budget has no problems and a route that could not be requested
+    has no url. The url of a write route starts with its method.
+    """
+    app = current_app._get_current_object()
+    client = app.test_client()
+    rules = [
+        rule for rule in sorted(app.url_map.iter_rules(), key = lambda rule: rule.rule)
+        if rule.endpoint != "static"
+    ]
+    results = []
+
+    # Read the department names up front, as a worker keeps them cached
+    # across requests rather than reading them in each one
+    cached_departments()
+
+    # The requests share this command's app context, so the flag turns off
+    # admission control for them
+    g.checking_query_budgets = True
+    try:
+        for rule in rules:
+            if "GET" not in rule.methods:
+                continue
+            budget = getattr(app.view_functions[rule.endpoint], "query_budget", None)
+            if budget is None:
+                results.append((rule.endpoint, rule.rule, [("has no query budget", [])]))
+                continue
+            url, problems = check_route(client, rule, budget, headers or {})
+            results.append((rule.endpoint, url, problems))
+
+        with rolled_back_writes() as connection:
+            for rule in rules:
+                methods = [method for method in WRITE_METHODS if method in rule.methods]
+                if not methods:
+                    continue
+                budget = getattr(app.view_functions[rule.endpoint], "query_budget", None)
+                if budget is None:
+                    results.append((rule.endpoint, rule.rule, [("has no query budget", [])]))
+                    continue
+                for method in methods:
+                    savepoint = connection.begin_nested()
+                    try:
+                        url, problems = check_route(client, rule, budget, headers or {}, method)
+                    finally:
+                        db.session.remove()
+                        savepoint.rollback()
+                    results.append((rule.endpoint, url and f"{method} {url}", problems))
+    finally:
+        g.pop("checking_query_budgets", None)
+    return results
\ No newline at end of file
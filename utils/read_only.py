@@ -0,0 +1,101 @@
+"""
+This file runs read routes and long reads in read only transactions. A route marked
+with @read_only starts its transaction as READ ONLY, so Postgres can skip the work it
+does for transactions that may write, and with autoflush off, so the session does
+not check for pending changes before every query. When the tenant has a read replica
+the route is sent there instead of the primary. Long reads such as exports can also
+ask for a DEFERRABLE snapshot, which waits for a moment no serializable transaction
+can conflict with and then reads without taking any predicate locks.
+"""
+
+# Built-in imports
+from contextlib import contextmanager
+from functools import wraps
+
+# Installed import packages
+from flask import current_app, g
+from sqlalchemy.orm import Session
+
+# Local imports
+from init import db
+from utils.tenancy import current_tenant, current_engine, tenant_engine
+
+# The execution options that start a read only transaction, and a deferrable one
+READ_ONLY_OPTIONS = {"postgresql_readonly": True}
+DEFERRABLE_OPTIONS = {
+    "isolation_level": "SERIALIZABLE",
+    "postgresql_readonly": True,
+    "postgresql_deferrable": True
+}
+
+
+def replica_engine():
+    """
+    Return the engine of the current tenant's read replica, or of the default
+    database's replica when there is no tenant, or None if it has none.
+    """
+    tenant = current_tenant()
+    bind = f"{tenant}:replica" if tenant else "replica"
+    if bind not in db.engines:
+        return None
+    return tenant_engine(tenant, bind) if tenant else db.engines[bind]
+
+
+def begin_read_only():
+    """
+    Start the session's transaction as a read only one, on the read replica
+    when there is one. A session that has already started its transaction
+    only has autoflush turned off.
+    """
+    session = db.session()
+    session.autoflush = False
+    if session.in_transaction():
+        return
+
+    engine = replica_engine()
+    if engine is not None:
+        g.read_engine = engine
+    session.connection(execution_options = READ_ONLY_OPTIONS)
+
+
+def read_only(view):
+    """
+    Decorate a route that never writes so it runs in a read only transaction.
+    Apply it below @coalesce, so only the request that runs the route starts
+    a transaction.
+    """
+    @wraps(view)
+    def read_only_view(*args, **kwargs):
+        if current_app.config["READ_ONLY_ROUTES"]:
+            begin_read_only()
+        return view(*args, **kwargs)
+
+    return read_only_view
+
+
+@contextmanager
+def read_only_session(deferrable = False):
+    """
+    Open a session of its own for a read that is kept apart from the caller's
+    session, such as an export reading chunks between saving checkpoints.
+    Its transaction is read only, and runs on the read replica when there is
+    one, or deferrable on the primary if asked. A deferrable transaction
+    waits for its snapshot once, when it starts, so a long read should run
+    all its queries in one session rather than open one per query. The
+    session is closed on exit, leaving the objects it loaded usable but
+    detached.
+    """
+    options = DEFERRABLE_OPTIONS if deferrable else READ_ONLY_OPTIONS
+
+    # A hot standby cannot run serializable transactions, and reads there
+    # take no locks on the primary anyway
+    engine = replica_engine()
+    if engine is not None:
+        options = READ_ONLY_OPTIONS
+
+    session = Session(bind = engine or current_engine(), autoflush = False, expire_on_commit = False)
+    try:
+        session.connection(execution_options = options)
+        yield session
+    finally:
+        session.close()
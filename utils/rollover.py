@@ -0,0 +1,252 @@
+"""
+This file rolls courses over into a new term on the database server. The selected
+courses are cloned under new names, optionally with new teachers, and the students
+enrolled in them carry over into the clones, all with set-based INSERT ... SELECT
+statements in one transaction instead of an API call per course and enrolment. Only
+the list of courses is read into Python; the enrolments never leave the database. A
+dry run reports what would be cloned and carried, and any names that are taken or
+that the course schema would reject. Waitlists are not carried over: the clones start
+with empty waitlists, and the students left waiting on the old courses stay there.
+"""
+
+# Installed import packages
+from marshmallow import ValidationError
+
+# Local imports
+from init import db
+from models.course import Course
+from models.enrolment import Enrolment
+from models.teacher import Teacher
+from models.change import Change
+from schemas.schemas import course_schema
+
+# The columns of a course copied onto its clone as they are
+CLONED_COLUMNS = ("duration", "capacity")
+
+
+class RolloverError(Exception):
+    """
+    Raised when a rollover cannot be carried out, with the dry run report
+    when the plan has conflicts. Nothing is written.
+    """
+
+    def __init__(self, message, status_code = 400, report = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.report = report
+
+
+def new_course_name(course, names, replace, suffix):
+    """
+    Name a course's clone: by its id in 'names' if listed there, otherwise
+    with the text 'replace' swaps in its name, otherwise with 'suffix' added.
+    """
+    if course.course_id in names:
+        return names[course.course_id]
+    if replace and replace[0] in course.name:
+        return course.name.replace(replace[0], replace[1])
+    if suffix:
+        return f"{course.name}{suffix}"
+    return course.name
+
+
+def name_errors(name):
+    """
+    Return why the course schema would reject the name, as the course
+    routes would report it, or an empty list if it is valid.
+    """
+    errors = []
+    for validate in course_schema.fields["name"].validators:
+        try:
+            validate(name)
+        except ValidationError as err:
+            errors += err.messages
+    return errors
+
+
+def carried_enrolments(course_ids, since, excluded_students):
+    """
+    Build the query of the enrolments that carry over: those in the courses
+    dated on or after 'since', less the excluded students, and only as many
+    per course as it has seats, earliest enrolled first.
+    """
+    seat = db.func.row_number().over(
+        partition_by = Enrolment.course_id,
+        order_by = (Enrolment.enrolment_date, Enrolment.id)
+    )
+    statement = (
+        db.select(Enrolment.student_id, Enrolment.course_id, seat.label("seat"))
+        .where(Enrolment.course_id.in_(course_ids), Enrolment.enrolment_date >= since)
+    )
+    if excluded_students:
+        statement = statement.where(Enrolment.student_id.not_in(excluded_students))
+    ranked = statement.subquery("ranked")
+
+    return (
+        db.select(ranked.c.student_id, ranked.c.course_id)
+        .join(Course, Course.course_id == ranked.c.course_id)
+        .where(db.or_(Course.capacity.is_(None), ranked.c.seat <= Course.capacity))
+    )
+
+
+def plan_rollover(since, course_ids = None, names = None, replace = None, suffix = None, teachers = None,
+                  course_teachers = None, excluded_students = None, carry_enrolments = True):
+    """
+    Work out the rollover without writing anything. Enrolments dated on or
+    after 'since' carry over unless 'carry_enrolments' is off. 'teachers'
+    maps a teacher to the teacher who takes over their cloned courses, and
+    'course_teachers' maps a course to the teacher of its clone. Returns the
+    report of each course to clone and any conflicts that stop the rollover.
+    """
+    names, teachers, course_teachers = names or {}, teachers or {}, course_teachers or {}
+
+    statement = db.select(Course).order_by(Course.course_id)
+    if course_ids:
+        statement = statement.where(Course.course_id.in_(course_ids))
+    courses = db.session.scalars(statement).all()
+    missing = set(course_ids or ()) - {course.course_id for course in courses}
+    if missing:
+        raise RolloverError(f"Courses {', '.join(map(str, sorted(missing)))} do not exist.", 404)
+    if not courses:
+        raise RolloverError("There are no courses to roll over.", 404)
+
+    # Count the enrolments each course has and how many of them carry over
+    ids = [course.course_id for course in courses]
+    eligible = dict(db.session.execute(
+        db.select(Enrolment.course_id, db.func.count())
+        .where(Enrolment.course_id.in_(ids), Enrolment.enrolment_date >= since)
+        .group_by(Enrolment.course_id)
+    ).all())
+    carriedCounts = {}
+    if carry_enrolments:
+        carried = carried_enrolments(ids, since, excluded_students).subquery()
+        carriedCounts = dict(db.session.execute(
+            db.select(carried.c.course_id, db.func.count()).group_by(carried.c.course_id)
+        ).all())
+
+    planned = []
+    for course in courses:
+        planned.append({
+            "course_id": course.course_id,
+            "name": course.name,
+            "new_name": new_course_name(course, names, replace, suffix),
+            "teacher_id": course.teacher_id,
+            "new_teacher_id": course_teachers.get(
+                course.course_id, teachers.get(course.teacher_id, course.teacher_id)
+            ),
+            "enrolments": eligible.get(course.course_id, 0),
+            "carried": carriedCounts.get(course.course_id, 0)
+        })
+
+    # The clones' names must be new, distinct and pass the course schema's
+    # checks, and their teachers must exist
+    conflicts = []
+    newNames = [course["new_name"] for course in planned]
+    taken = db.session.scalars(db.select(Course.name).where(Course.name.in_(newNames))).all()
+    conflicts += [f"A course named {name} already exists." for name in sorted(taken)]
+    conflicts += [
+        f"More than one course would be named {name}."
+        for name in sorted({name for name in newNames if newNames.count(name) > 1})
+    ]
+    conflicts += [
+        f"The name {name} is not valid: {error}"
+        for name in newNames for error in name_errors(name)
+    ]
+    teacherIds = {course["new_teacher_id"] for course in planned} - {None}
+    found = set(db.session.scalars(db.select(Teacher.teacher_id).where(Teacher.teacher_id.in_(teacherIds))))
+    conflicts += [f"Teacher {teacherId} does not exist." for teacherId in sorted(teacherIds - found)]
+
+    return {
+        "since": since.isoformat(),
+        "courses": planned,
+        "conflicts": conflicts,
+        "courses_cloned": len(planned),
+        "enrolments_carried": sum(course["carried"] for course in planned)
+    }
+
+
+def change_rows(table, inserted, primary_key):
+    """
+    Write an outbox insert change for every row the CTE inserted, carrying
+    the whole row, in the same statement.
+    """
+    return db.insert(Change.__table__).from_select(
+        ["table_name", "row_id", "operation", "payload"],
+        db.select(
+            db.literal(table.name),
+            inserted.c[primary_key],
+            db.literal("insert"),
+            db.func.row_to_json(inserted.table_valued())
+        )
+    )
+
+
+def rollover_term(term_start, since, excluded_students = None, carry_enrolments = True, **options):
+    """
+    Clone the planned courses and carry their enrolments over, dated from
+    'term_start', with one statement for the courses and one for the
+    enrolments. Takes the options of plan_rollover. The caller commits.
+    Raises a RolloverError if the plan has conflicts. Returns the report of
+    the rollover.
+    """
+    if term_start <= since:
+        raise RolloverError("The new term must start after the enrolments it carries over.")
+    report = plan_rollover(
+        since, excluded_students = excluded_students, carry_enrolments = carry_enrolments, **options
+    )
+    if report["conflicts"]:
+        raise RolloverError("The rollover has conflicts.", 409, report)
+
+    # The plan as a table of the courses to clone, with the name, teacher and
+    # seats taken of each clone
+    plan = db.values(
+        db.column("course_id", db.Integer),
+        db.column("new_name", db.String),
+        db.column("new_teacher_id", db.Integer),
+        db.column("carried", db.Integer),
+        name = "plan"
+    ).data([
+        (course["course_id"], course["new_name"], course["new_teacher_id"], course["carried"])
+        for course in report["courses"]
+    ])
+
+    courses = Course.__table__
+    cloned = (
+        db.insert(courses)
+        .from_select(
+            ["name", "teacher_id", "enrolled_count", *CLONED_COLUMNS],
+            db.select(
+                plan.c.new_name,
+                # A column of nulls would otherwise be read as text
+                db.cast(plan.c.new_teacher_id, db.Integer),
+                plan.c.carried,
+                *(courses.c[name] for name in CLONED_COLUMNS)
+            ).join_from(courses, plan, courses.c.course_id == plan.c.course_id)
+        )
+        .returning(*courses.c)
+        .cte("cloned")
+    )
+    db.session.execute(change_rows(courses, cloned, "course_id"))
+
+    if carry_enrolments:
+        # Each carried enrolment finds its course's clone by the clone's name
+        enrolments = Enrolment.__table__
+        carried = carried_enrolments(
+            [course["course_id"] for course in report["courses"]], since, excluded_students
+        ).subquery("carried")
+        clones = courses.alias("clones")
+        inserted = (
+            db.insert(enrolments)
+            .from_select(
+                ["enrolment_date", "student_id", "course_id"],
+                db.select(db.literal(term_start, db.Date), carried.c.student_id, clones.c.course_id)
+                .join(plan, plan.c.course_id == carried.c.course_id)
+                .join(clones, clones.c.name == plan.c.new_name)
+            )
+            .returning(*enrolments.c)
+            .cte("inserted")
+        )
+        db.session.execute(change_rows(enrolments, inserted, "id"))
+
+    return {"term_start": term_start.isoformat(), **report}
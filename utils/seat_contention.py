@@ -0,0 +1,145 @@
+"""
+This file checks the seat allocation under contention. Many clients try to enrol in
+the last seats of one course at the same moment, each through the enrolment route in
+a thread and transaction of its own, and the course is then checked: it must not have
+taken more students than it has seats, its seat counter must match its enrolments,
+and every student turned away must be on its waitlist. Every attempt must reach the
+seat allocation, so the check fails if any is shed or rate limited, and it is run
+with admission control off. The course and students the check creates are removed
+afterwards.
+"""
+
+# Built-in imports
+import threading
+import uuid
+from collections import Counter
+
+# Installed import packages
+from flask import current_app
+
+# Local imports
+from init import db
+from models.course import Course
+from models.enrolment import Enrolment
+from models.student import Student
+from models.waitlist import WaitlistEntry
+from utils.tenancy import current_tenant
+
+
+def create_contested_course(attempts, capacity):
+    """
+    Create a course with 'capacity' seats and a student for every attempt
+    to enrol in it. Returns the course id and the student ids.
+    """
+    run = uuid.uuid4().hex[:8]
+    course = Course(name = f"Seat race {run}", duration = 2, capacity = capacity)
+    students = [
+        Student(first_name = "Seat", last_name = f"Race {number}", email = f"seat-race-{run}-{number}@example.com")
+        for number in range(attempts)
+    ]
+    db.session.add(course)
+    db.session.add_all(students)
+    db.session.commit()
+    return course.course_id, [student.student_id for student in students]
+
+
+def race_for_seats(course_id, student_ids):
+    """
+    Send every student's enrolment to the route at the same moment, from a
+    thread each. Each thread sends from an address of its own so the
+    admission control's per client limits do not turn it away. Returns the
+    responses by status code.
+    """
+    app = current_app._get_current_object()
+    headers = {app.config["TENANT_HEADER"]: current_tenant()} if current_tenant() else {}
+    start = threading.Barrier(len(student_ids))
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def enrol(number, student_id):
+        client = app.test_client()
+        address = f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}"
+        start.wait()
+        response = client.post(
+            "/enrolments/",
+            json = {"student_id": student_id, "course_id": course_id},
+            headers = headers,
+            environ_base = {"REMOTE_ADDR": address}
+        )
+        with lock:
+            statuses[response.status_code] += 1
+
+    threads = [
+        threading.Thread(target = enrol, args = (number, student_id))
+        for number, student_id in enumerate(student_ids)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def check_seats(course_id, capacity, statuses):
+    """
+    Compare the course's seats, enrolments and waitlist with each other and
+    with the responses. Returns the counts and the list of broken rules.
+    """
+    db.session.expire_all()
+    enrolledCount = db.session.scalar(db.select(Course.enrolled_count).where(Course.course_id == course_id))
+    enrolments = db.session.scalar(db.select(db.func.count()).where(Enrolment.course_id == course_id))
+    waitlisted = db.session.scalar(db.select(db.func.count()).where(WaitlistEntry.course_id == course_id))
+    answered = statuses[201] + statuses[202]
+
+    failures = []
+    other = {status: count for status, count in statuses.items() if status not in (201, 202)}
+    if other:
+        failures.append(
+            f"{sum(other.values())} of {sum(statuses.values())} attempts did not reach "
+            f"the seat allocation (statuses {', '.join(map(str, sorted(other)))})."
+        )
+    if enrolledCount > capacity:
+        failures.append(f"The course took {enrolledCount} students into {capacity} seats.")
+    if enrolledCount != enrolments:
+        failures.append(f"The seat counter says {enrolledCount} but the course has {enrolments} enrolments.")
+    if enrolments != statuses[201]:
+        failures.append(f"{statuses[201]} students were told they were enrolled but {enrolments} were.")
+    if waitlisted != statuses[202]:
+        failures.append(f"{statuses[202]} students were told they were waitlisted but {waitlisted} were.")
+    if enrolments != min(capacity, answered):
+        failures.append(f"{min(capacity, answered)} seats should have been taken but {enrolments} were.")
+
+    return {
+        "capacity": capacity,
+        "enrolled_count": enrolledCount,
+        "enrolments": enrolments,
+        "waitlisted": waitlisted,
+        "statuses": dict(sorted(statuses.items()))
+    }, failures
+
+
+def remove_contested_course(course_id, student_ids):
+    """
+    Delete the course and students the check created, with their enrolments
+    and waitlist entries.
+    """
+    db.session.execute(db.delete(WaitlistEntry).where(WaitlistEntry.course_id == course_id))
+    db.session.execute(db.delete(Enrolment).where(Enrolment.course_id == course_id))
+    db.session.execute(db.delete(Course).where(Course.course_id == course_id))
+    db.session.execute(db.delete(Student).where(Student.student_id.in_(student_ids)))
+    db.session.commit()
+
+
+def contend_for_seats(attempts, capacity, keep = False):
+    """
+    Run the check: create the course and its students, race them for its
+    seats and check the outcome, removing the rows unless 'keep' is set.
+    Returns the counts and the list of broken rules.
+    """
+    course_id, student_ids = create_contested_course(attempts, capacity)
+    try:
+        statuses = race_for_seats(course_id, student_ids)
+        return check_seats(course_id, capacity, statuses)
+    finally:
+        if not keep:
+            remove_contested_course(course_id, student_ids)
@@ -0,0 +1,150 @@
+"""
+This file contains the seat allocation logic for courses with a capacity. Seats
+are claimed with a single conditional update on the course's seat counter, so
+concurrent enrolments into the same course can never take more seats than the
+course has, and students who miss out are placed on the course's waitlist.
+"""
+
+# Installed import packages
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+# Local imports
+from init import db
+from models.course import Course
+from models.enrolment import Enrolment
+from models.waitlist import WaitlistEntry
+
+
+def reserve_seat(course_id):
+    """
+    Take one seat in the course if there is one left. The check and the increment
+    happen in the same statement, so the row lock is only held from this update
+    until the transaction commits. Returns True when a seat was taken.
+    """
+    statement = (
+        db.update(Course)
+        .where(
+            Course.course_id == course_id,
+            db.or_(
+                Course.capacity.is_(None),
+                Course.enrolled_count < Course.capacity
+            )
+        )
+        .values(enrolled_count = Course.enrolled_count + 1)
+        .returning(Course.course_id)
+    )
+    return db.session.execute(statement).scalar() is not None
+
+
+def add_to_waitlist(student_id, course_id):
+    """
+    Add the student to the end of the course's waitlist. Joining a waitlist the
+    student is already on is skipped by the database.
+    """
+    statement = (
+        insert(WaitlistEntry)
+        .values(student_id = student_id, course_id = course_id)
+        .on_conflict_do_nothing(
+            index_elements = [
+                WaitlistEntry.student_id,
+                WaitlistEntry.course_id
+            ]
+        )
+    )
+    db.session.execute(statement)
+
+
+def release_seats(course_ids):
+    """
+    Give back one seat for every course id in the list (a course appears once per
+    freed seat) and fill the freed seats from the waitlists.
+    """
+    freed = {}
+    for course_id in course_ids:
+        freed[course_id] = freed.get(course_id, 0) + 1
+
+    for course_id, seats in freed.items():
+        db.session.execute(
+            db.update(Course)
+            .where(Course.course_id == course_id)
+            .values(enrolled_count = func.greatest(Course.enrolled_count - seats, 0))
+        )
+
+    promote_waitlist(freed.keys())
+
+
+def promote_waitlist(course_ids):
+    """
+    Fill the free seats of each course with the students who have waited the
+    longest. Waitlist rows being promoted by another transaction are skipped
+    rather than waited on. Returns the number of students enrolled.
+    """
+    promoted = 0
+    for course_id in course_ids:
+        # Lock the course so its free seats cannot change while they are filled
+        course = db.session.scalar(
+            db.select(Course)
+            .where(Course.course_id == course_id)
+            .with_for_update()
+            .execution_options(populate_existing = True)
+        )
+        if course is None:
+            continue
+
+        # Pick the oldest entries that fit in the free seats. A course without
+        # a capacity takes everyone still waiting
+        statement = (
+            db.select(WaitlistEntry)
+            .where(WaitlistEntry.course_id == course_id)
+            .order_by(WaitlistEntry.created_at, WaitlistEntry.id)
+            .with_for_update(skip_locked = True)
+        )
+        if course.capacity is not None:
+            free_seats = course.capacity - course.enrolled_count
+            if free_seats <= 0:
+                continue
+            statement = statement.limit(free_seats)
+        entries = db.session.scalars(statement).all()
+        if not entries:
+            continue
+
+        # Enrol the picked students in one statement and remove them from the
+        # waitlist
+        enrolled = db.session.execute(
+            insert(Enrolment)
+            .values([
+                {"student_id": entry.student_id, "course_id": course_id}
+                for entry in entries
+            ])
+            .on_conflict_do_nothing(
+                index_elements = [
+                    Enrolment.student_id,
+                    Enrolment.course_id
+                ]
+            )
+            .returning(Enrolment.id)
+        ).scalars().all()
+        db.session.execute(
+            db.delete(WaitlistEntry)
+            .where(WaitlistEntry.id.in_([entry.id for entry in entries]))
+        )
+
+        course.enrolled_count += len(enrolled)
+        promoted += len(enrolled)
+
+    return promoted
+
+
+def recount_seats():
+    """
+    Recalculate every course's seat counter from its enrolments. Used after
+    enrolments are written without going through the seat allocation, such as
+    when seeding the database.
+    """
+    enrolments = (
+        db.select(func.count(Enrolment.id))
+        .where(Enrolment.course_id == Course.course_id)
+        .scalar_subquery()
+    )
+    db.session.execute(db.update(Course).values(enrolled_count = enrolments))
\ No newline at end of file
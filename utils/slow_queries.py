@@ -0,0 +1,262 @@
+"""
+This file keeps a log of the SQL statements that take longer than SLOW_QUERY_MS, with
+the route that ran them, the types of their bound parameters (never the values) and
+the number of rows they returned or changed. For a sampled share of the slow SELECT
+statements the plan is captured with EXPLAIN (ANALYZE, BUFFERS), so a plan regression
+shows up next to the statement. EXPLAIN ANALYZE runs the statement again, so the plans
+are captured by a background thread on a read only connection of their own, after the
+request has moved on. The log is a ring buffer holding the latest entries, kept in the
+worker's memory or in a SQLite file shared by the workers and the CLI.
+"""
+
+# Built-in imports
+import json
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock, local
+
+# Installed import packages
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The statements whose plans can be captured. EXPLAIN ANALYZE runs the statement,
+# so it is only used for reads, and is rolled back either way
+EXPLAINABLE = ("SELECT", "WITH")
+
+# Words that mark a statement as one that writes or locks rows, such as a WITH
+# query whose CTEs insert, update or delete, or a SELECT ... FOR UPDATE
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+# The most slow statements waiting for their plans in each worker. Statements
+# sampled while the queue is full are logged without a plan
+EXPLAIN_QUEUE_SIZE = 100
+
+# The log currently listening to the engines
+_listening = None
+
+
+class MemorySlowQueryStore:
+    """
+    The latest slow queries of this worker process.
+    """
+
+    def __init__(self, size):
+        self.entries = deque(maxlen = size)
+        self.lock = Lock()
+
+    def add(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def recent(self, limit):
+        with self.lock:
+            return list(reversed(self.entries))[:limit]
+
+
+class SqliteSlowQueryStore:
+    """
+    The latest slow queries of every worker on the host, kept in a SQLite file
+    such as one on /dev/shm. Older entries are removed as new ones are added.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.local = local()
+
+        # Create the table on a throwaway connection, as this may run in the
+        # gunicorn master and a SQLite connection must not cross a fork
+        connection = sqlite3.connect(self.path, timeout = 1, isolation_level = None)
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS slow_queries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+    def _connection(self):
+        if not hasattr(self.local, "connection"):
+            self.local.connection = sqlite3.connect(
+                self.path,
+                timeout = 1,
+                isolation_level = None
+            )
+        return self.local.connection
+
+    def add(self, entry):
+        connection = self._connection()
+        entryId = connection.execute(
+            "INSERT INTO slow_queries (entry) VALUES (?)", (json.dumps(entry),)
+        ).lastrowid
+        connection.execute("DELETE FROM slow_queries WHERE id <= ?", (entryId - self.size,))
+
+    def recent(self, limit):
+        rows = self._connection().execute(
+            "SELECT entry FROM slow_queries ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [json.loads(entry) for (entry,) in rows]
+
+
+def create_slow_query_store(setting, size):
+    """
+    Create the slow query store named in the configuration: "memory" for a
+    store per worker, or the path of a SQLite file shared by the workers.
+    """
+    if not setting or setting == "memory":
+        return MemorySlowQueryStore(size)
+    return SqliteSlowQueryStore(os.path.abspath(setting), size)
+
+
+def parameter_shape(parameters, executemany = False):
+    """
+    Describe the bound parameters by their names and types, leaving out the
+    values, which may hold personal details.
+    """
+    if executemany:
+        return {
+            "rows": len(parameters),
+            "each": parameter_shape(parameters[0]) if parameters else None
+        }
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+def query_origin():
+    """
+    Name what ran the statement: the endpoint of the request, or the thread
+    for background work such as exports.
+    """
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+
+def explainable(statement):
+    """
+    Return whether the plan of the statement can be captured: it must be a
+    read, with nothing in it that writes or locks rows.
+    """
+    return statement.lstrip().upper().startswith(EXPLAINABLE) and not WRITES.search(statement)
+
+
+def explain_plan(engine, statement, parameters):
+    """
+    Run EXPLAIN (ANALYZE, BUFFERS) for the statement on a connection of its
+    own, in a read only transaction that is always rolled back, so a
+    statement that writes fails rather than writing twice. Returns the plan
+    as text, or None if it could not be captured.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.info["explaining"] = True
+            try:
+                with connection.execution_options(postgresql_readonly = True).begin() as transaction:
+                    rows = connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                    plan = "\n".join(row[0] for row in rows)
+                    transaction.rollback()
+                    return plan
+            finally:
+                connection.info.pop("explaining", None)
+    except Exception:
+        return None
+
+
+class SlowQueryLog:
+    """
+    Times every statement on every engine and records the slow ones.
+    """
+
+    def __init__(self, store, threshold_ms, explain_rate):
+        self.store = store
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.waiting = queue.Queue(maxsize = EXPLAIN_QUEUE_SIZE)
+        self.lock = Lock()
+        self.pid = None
+
+    def explain_later(self, engine, entry, statement, parameters):
+        """
+        Queue the entry for the background thread to capture its plan and
+        then log it. The entry is logged without a plan if the queue is full.
+        """
+        with self.lock:
+            # Start the thread in the worker that needs it, as a thread
+            # started before a fork does not run in the child
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target = self.run, name = "slow-query-explain", daemon = True).start()
+        try:
+            self.waiting.put_nowait((engine, entry, statement, parameters))
+        except queue.Full:
+            self.store.add(entry)
+
+    def run(self):
+        while True:
+            engine, entry, statement, parameters = self.waiting.get()
+            entry["plan"] = explain_plan(engine, statement, parameters)
+            self.store.add(entry)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+        if elapsed < self.threshold or conn.info.get("explaining"):
+            return
+
+        entry = {
+            "recorded_at": datetime.utcnow().isoformat(timespec = "seconds"),
+            "duration_ms": round(elapsed * 1000, 2),
+            "origin": query_origin(),
+            "statement": " ".join(statement.split()),
+            "parameters": parameter_shape(parameters, executemany),
+            "rows": cursor.rowcount,
+            "plan": None
+        }
+        if (
+            conn.dialect.name == "postgresql"
+            and not executemany
+            and explainable(statement)
+            and random.random() < self.explain_rate
+        ):
+            self.explain_later(conn.engine, entry, statement, parameters)
+            return
+        self.store.add(entry)
+
+
+def register_slow_query_log(app):
+    """
+    This function starts timing the statements of every engine, using the
+    threshold and store set in the Flask app's configuration. The log is
+    kept on the app for the admin route and the CLI to read.
+    """
+    if not app.config["SLOW_QUERY_MS"]:
+        return
+
+    log = SlowQueryLog(
+        create_slow_query_store(app.config["SLOW_QUERY_STORE"], app.config["SLOW_QUERY_LOG_SIZE"]),
+        app.config["SLOW_QUERY_MS"],
+        app.config["SLOW_QUERY_EXPLAIN_RATE"]
+    )
+    app.extensions["slow_query_log"] = log
+
+    # Only the latest app's log listens, so a second app does not log twice
+    global _listening
+    if _listening is not None:
+        event.remove(Engine, "before_cursor_execute", _listening.before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", _listening.after_cursor_execute)
+    event.listen(Engine, "before_cursor_execute", log.before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", log.after_cursor_execute)
+    _listening = log
\ No newline at end of file
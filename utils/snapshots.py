@@ -0,0 +1,235 @@
+"""
+This file writes columnar snapshots of the LMS tables for analytics. Each table is
+streamed from the database with a server-side cursor in chunks and written as an
+Arrow or Parquet file, with dates, timestamps and numbers kept in their native
+column types rather than converted to JSON strings. An incremental snapshot holds
+the rows changed since the previous one, and the rows deleted since then, read from
+the outbox (see models/change.py).
+"""
+
+# Built-in imports
+import json
+import os
+from datetime import datetime
+
+# Local imports
+from init import db
+from models.student import Student
+from models.teacher import Teacher
+from models.department import Department
+from models.course import Course
+from models.enrolment import Enrolment
+from models.change import Change
+
+# The tables written to a snapshot, in the order they are exported
+SNAPSHOT_MODELS = (Student, Department, Teacher, Course, Enrolment)
+
+# The file that remembers when the last snapshot was taken
+MANIFEST_NAME = "manifest.json"
+
+# The outbox operations that remove a row from its table, and the file of an
+# incremental snapshot that lists those rows
+DELETE_OPERATIONS = ("delete", "archive")
+DELETES_NAME = "deleted_rows"
+
+
+def arrow_schema(table):
+    """
+    Build the Arrow schema of a table from the column types of its model.
+    """
+    import pyarrow as pa
+
+    # Each column takes the first type it is an instance of, so subclasses
+    # such as SmallInteger are listed before the types they extend
+    arrowTypes = (
+        (db.SmallInteger, pa.int16()),
+        (db.BigInteger, pa.int64()),
+        (db.Integer, pa.int64()),
+        (db.Float, pa.float64()),
+        (db.DateTime, pa.timestamp("us")),
+        (db.Date, pa.date32()),
+        (db.Boolean, pa.bool_())
+    )
+
+    schemaFields = []
+    for column in table.columns:
+        arrowType = next(
+            (
+                arrowType for sqlType, arrowType in arrowTypes
+                if isinstance(column.type, sqlType)
+            ),
+            pa.string()
+        )
+        schemaFields.append(pa.field(column.name, arrowType, nullable = column.nullable))
+    return pa.schema(schemaFields)
+
+
+def read_manifest(snapshot_dir):
+    """
+    Read the manifest of the previous snapshots, or an empty one if no snapshot
+    has been taken yet.
+    """
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding = "utf-8") as manifestFile:
+        return json.load(manifestFile)
+
+
+def write_manifest(snapshot_dir, manifest):
+    """
+    Save the manifest once every table of the snapshot has been written.
+    """
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding = "utf-8") as manifestFile:
+        json.dump(manifest, manifestFile, indent = 2)
+    os.replace(path + ".tmp", path)
+
+
+def write_table(model, path, file_format, chunk_size, changed_since = None):
+    """
+    Stream one table into an Arrow or Parquet file. Rows are fetched from a
+    server-side cursor one chunk at a time and each chunk is appended to the
+    file as a record batch, so memory use stays flat for large tables. When a
+    timestamp is given only the rows changed since then are written. Returns
+    the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = model.__table__
+    schema = arrow_schema(table)
+    statement = db.select(table).order_by(*table.primary_key.columns)
+    # Lookup tables without change tracking, such as departments, are small
+    # and always written in full
+    if changed_since is not None and "updated_at" in table.c:
+        statement = statement.where(table.c.updated_at >= changed_since)
+
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(path, schema, compression = "zstd")
+    else:
+        writer = pa.ipc.new_file(path, schema)
+
+    rows = 0
+    try:
+        result = db.session.execute(
+            statement,
+            execution_options = {"yield_per": chunk_size}
+        )
+        for chunk in result.partitions():
+            columns = list(zip(*chunk))
+            batch = pa.record_batch(
+                [pa.array(values, type = field.type) for values, field in zip(columns, schema)],
+                schema = schema
+            )
+            writer.write_batch(batch)
+            rows += len(chunk)
+    finally:
+        writer.close()
+
+    return rows
+
+
+def write_deletes(path, file_format, deleted_since):
+    """
+    Write the table and id of every row deleted or archived since the
+    timestamp, as recorded in the outbox. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        pa.field("table_name", pa.string(), nullable = False),
+        pa.field("row_id", pa.int64(), nullable = False),
+        pa.field("deleted_at", pa.timestamp("us"), nullable = False)
+    ])
+    rows = db.session.execute(
+        db.select(Change.table_name, Change.row_id, Change.created_at)
+        .where(Change.operation.in_(DELETE_OPERATIONS), Change.created_at >= deleted_since)
+        .order_by(Change.txid, Change.id)
+    ).all()
+    batch = pa.record_batch(
+        [pa.array(values, type = field.type) for values, field in zip(zip(*rows), schema)]
+        if rows else [pa.array([], type = field.type) for field in schema],
+        schema = schema
+    )
+    if file_format == "parquet":
+        pq.write_table(pa.Table.from_batches([batch]), path, compression = "zstd")
+    else:
+        with pa.ipc.new_file(path, schema) as writer:
+            writer.write_batch(batch)
+    return len(rows)
+
+
+def snapshot_watermark():
+    """
+    Return the time the next incremental snapshot should read changes from.
+    A row's updated_at is the start of the transaction that wrote it, so a
+    transaction that started before this snapshot but commits after it
+    writes rows dated before it that it cannot see. The watermark is
+    therefore the start of the oldest transaction still open on the
+    database, or now if there is none. This needs the role to see the other
+    sessions in pg_stat_activity, as its own or with pg_read_all_stats.
+    """
+    oldestOpen = (
+        db.select(db.func.min(db.column("xact_start")))
+        .select_from(db.table("pg_stat_activity", db.column("xact_start"), db.column("datname"), db.column("pid")))
+        .where(
+            db.column("datname") == db.func.current_database(),
+            db.column("pid") != db.func.pg_backend_pid()
+        )
+        .scalar_subquery()
+    )
+    return db.session.scalar(db.select(
+        db.func.least(db.func.localtimestamp(), db.cast(oldestOpen, db.DateTime))
+    ))
+
+
+def take_snapshot(snapshot_dir, file_format = "parquet", incremental = False, chunk_size = 10000):
+    """
+    Write every LMS table to a new timestamped folder inside the snapshot
+    directory. An incremental snapshot only holds the rows changed since the
+    previous snapshot, and lists the rows deleted since then in its own file,
+    as long as the outbox still holds those deletes (CHANGES_RETENTION_DAYS).
+    The watermark reaches back to the oldest transaction open when a snapshot
+    starts, so rows may appear in two snapshots but are never skipped, and
+    consumers should upsert on the primary key. Returns the folder written
+    and the number of rows per table.
+    """
+    manifest = read_manifest(snapshot_dir)
+    changedSince = None
+    if incremental and manifest.get("last_snapshot_at"):
+        changedSince = datetime.fromisoformat(manifest["last_snapshot_at"])
+
+    # Use the database clock for the watermark, as it is the one setting the
+    # updated_at columns. The folder is named after the time now
+    startedAt = db.session.scalar(db.select(db.func.localtimestamp()))
+    watermark = snapshot_watermark()
+
+    folder = os.path.join(snapshot_dir, startedAt.strftime("%Y%m%dT%H%M%S"))
+    os.makedirs(folder, exist_ok = True)
+
+    extension = "parquet" if file_format == "parquet" else "arrow"
+    counts = {}
+    for model in SNAPSHOT_MODELS:
+        path = os.path.join(folder, f"{model.__tablename__}.{extension}")
+        counts[model.__tablename__] = write_table(
+            model,
+            path,
+            file_format,
+            chunk_size,
+            changedSince
+        )
+    if changedSince is not None:
+        counts[DELETES_NAME] = write_deletes(
+            os.path.join(folder, f"{DELETES_NAME}.{extension}"),
+            file_format,
+            changedSince
+        )
+
+    manifest["last_snapshot_at"] = watermark.isoformat()
+    manifest["last_snapshot_dir"] = folder
+    manifest["incremental"] = changedSince is not None
+    manifest["row_counts"] = counts
+    write_manifest(snapshot_dir, manifest)
+    return folder, counts
\ No newline at end of file
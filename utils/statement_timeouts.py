@@ -0,0 +1,249 @@
+"""
+This file limits how long the statements of a request may run, so one pathological
+query cannot hold a pooled connection for minutes while every other request waits.
+Each request's transaction starts with SET LOCAL statement_timeout, using the timeout
+declared on the route with @statement_timeout, or set for the route or its blueprint
+in STATEMENT_TIMEOUTS, or STATEMENT_TIMEOUT_MS. The setting ends with the transaction,
+so the connection goes back to the pool as it was. While a statement runs, a watcher
+thread checks whether the client has hung up and cancels the statement if it has,
+rather than finishing work nobody will read. Timeouts and cancellations are counted
+per route for the /metrics route.
+"""
+
+# Built-in imports
+import os
+import select
+import socket
+import time
+from collections import Counter
+from threading import Lock, Thread
+
+# Installed import packages
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+# The Postgres error code (SQLSTATE) of a statement that was cancelled, by its
+# timeout or by a cancel request
+QUERY_CANCELED = "57014"
+
+# Where the WSGI servers put the client's socket in the request environment
+SOCKET_KEYS = ("gunicorn.socket", "werkzeug.socket")
+
+
+def statement_timeout(milliseconds):
+    """
+    Declare how long each statement of a route may run, in milliseconds, or
+    0 for no limit. STATEMENT_TIMEOUTS overrides it. Apply it directly below
+    the route decorator.
+    """
+    def declare(view):
+        view.statement_timeout = milliseconds
+        return view
+    return declare
+
+
+def parse_timeouts(setting):
+    """
+    Read STATEMENT_TIMEOUTS, e.g. "enrolments=5000,courses.get_courses=2000",
+    into {blueprint or endpoint: milliseconds}.
+    """
+    timeouts = {}
+    for entry in filter(None, (part.strip() for part in (setting or "").split(","))):
+        name, _, milliseconds = entry.partition("=")
+        timeouts[name.strip()] = int(milliseconds)
+    return timeouts
+
+
+def route_timeout(app):
+    """
+    Return the statement timeout of the current request's route: the one
+    configured for its endpoint, then for its blueprint, then the one
+    declared on the view, then the default.
+    """
+    configured = app.config["STATEMENT_TIMEOUTS"]
+    if request.endpoint in configured:
+        return configured[request.endpoint]
+    if request.blueprint in configured:
+        return configured[request.blueprint]
+    view = app.view_functions.get(request.endpoint)
+    declared = getattr(view, "statement_timeout", None)
+    if declared is not None:
+        return declared
+    return app.config["STATEMENT_TIMEOUT_MS"]
+
+
+class TimeoutCounts:
+    """
+    How many statements of each route this worker has seen time out or be
+    cancelled after the client hung up.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def record(self, kind, endpoint):
+        with self.lock:
+            self.counts[(kind, endpoint or "unknown")] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+# The timeout and cancellation counts of this worker process
+timeout_counts = TimeoutCounts()
+
+
+def client_gone(client_socket):
+    """
+    Return True if the client has closed its end of the connection. A socket
+    that is readable but has no data waiting has been closed.
+    """
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        if not readable:
+            return False
+        return client_socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class Watch:
+    """
+    A request whose statements run on a database connection, to be cancelled
+    if its client hangs up.
+    """
+
+    def __init__(self, client_socket, driver_connection, endpoint):
+        self.client_socket = client_socket
+        self.driver_connection = driver_connection
+        self.endpoint = endpoint
+        self.cancelled = False
+
+
+class DisconnectWatcher:
+    """
+    Checks the clients of this worker's requests every 'interval' seconds
+    while they hold a database connection. A watch is dropped as soon as its
+    connection is handed back to the pool, under the same lock the watcher
+    cancels with, so a connection is never cancelled once another request
+    may be using it.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.watches = {}
+        self.lock = Lock()
+        self.pid = None
+
+    def watch(self, client_socket, driver_connection, endpoint):
+        watch = Watch(client_socket, driver_connection, endpoint)
+        with self.lock:
+            self.watches[id(driver_connection)] = watch
+            # Start the thread in the worker that needs it, as a thread
+            # started before a fork does not run in the child
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                Thread(target = self.run, name = "disconnect-watcher", daemon = True).start()
+        return watch
+
+    def forget(self, driver_connection):
+        with self.lock:
+            self.watches.pop(id(driver_connection), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                for key, watch in list(self.watches.items()):
+                    if client_gone(watch.client_socket):
+                        watch.cancelled = True
+                        del self.watches[key]
+                        try:
+                            watch.driver_connection.cancel()
+                        except Exception:
+                            pass
+
+
+def set_statement_timeout(session, transaction, connection):
+    """
+    Start the request's transaction with its route's statement timeout, and
+    watch its client while the transaction holds the connection.
+    """
+    if not has_request_context() or connection.dialect.name != "postgresql":
+        return
+    timeout = g.get("statement_timeout")
+    if timeout is None:
+        return
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+    watcher = current_app.extensions.get("disconnect_watcher")
+    clientSocket = next(filter(None, map(request.environ.get, SOCKET_KEYS)), None)
+    if watcher is not None and clientSocket is not None:
+        g.statement_watch = watcher.watch(
+            clientSocket, connection.connection.driver_connection, request.endpoint
+        )
+
+
+def forget_connection(dbapi_connection, connection_record):
+    """
+    Stop watching a connection as soon as it is handed back to the pool, so
+    it is never cancelled once another request may be using it. Listens to
+    every pool once, whichever app's watcher is in use.
+    """
+    if dbapi_connection is None or not has_app_context():
+        return
+    watcher = current_app.extensions.get("disconnect_watcher")
+    if watcher is not None:
+        watcher.forget(dbapi_connection)
+
+
+def register_statement_timeouts(app):
+    """
+    This function attaches the statement timeouts to the Flask app, and the
+    disconnect watcher unless STATEMENT_CANCEL_INTERVAL is 0.
+    """
+    if app.config["STATEMENT_CANCEL_INTERVAL"] > 0:
+        app.extensions["disconnect_watcher"] = DisconnectWatcher(app.config["STATEMENT_CANCEL_INTERVAL"])
+        if not event.contains(Pool, "checkin", forget_connection):
+            event.listen(Pool, "checkin", forget_connection)
+
+    @app.before_request
+    def choose_statement_timeout():
+        g.statement_timeout = route_timeout(app)
+
+    if not event.contains(Session, "after_begin", set_statement_timeout):
+        event.listen(Session, "after_begin", set_statement_timeout)
+
+
+def record_cancelled_statement():
+    """
+    Count a cancelled statement against the current route. Returns True if
+    it was cancelled because the client hung up, or False if it ran past its
+    timeout.
+    """
+    watch = g.pop("statement_watch", None)
+    hungUp = watch is not None and watch.cancelled
+    timeout_counts.record("cancelled" if hungUp else "timeout", request.endpoint)
+    return hungUp
+
+
+def format_metrics():
+    """
+    Lay out this worker's counts in the Prometheus text format.
+    """
+    lines = []
+    for kind, name, description in (
+        ("timeout", "lms_statement_timeouts_total", "Statements cancelled for running past their route's statement timeout."),
+        ("cancelled", "lms_statement_cancellations_total", "Statements cancelled because the client hung up.")
+    ):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        for (countKind, endpoint), count in sorted(timeout_counts.snapshot().items()):
+            if countKind == kind:
+                lines.append(f'{name}{{pid="{os.getpid()}",route="{endpoint}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,221 @@
+"""
+This file routes each request to the database of the college (tenant) it belongs to.
+Every tenant has its own engine, and so its own connection pool, and its own Postgres
+schema, so one college's tables, indexes and load are kept apart from the others. A
+tenant can live in the default database or in a database of its own, and is moved to
+another database node by pointing its URI there. When no tenants are configured the
+app runs as a single tenant on the default database.
+"""
+
+# Built-in imports
+import functools
+import json
+
+# Installed import packages
+import click
+from flask import current_app, g, request
+from sqlalchemy.schema import CreateSchema
+
+# Local imports
+from init import db
+
+# Routes that serve the operators rather than a tenant, such as the readiness
+# check, the metrics and the slow query log. They are not routed to a tenant,
+# rate limited, shed or profiled
+EXEMPT_ENDPOINTS = {
+    "health.readiness", 
+    "health.pool_usage", 
+    "health.metrics", 
+    "admin.get_slow_queries", 
+    "static"
+}
+
+
+def load_tenants(setting):
+    """
+    Read the tenants from their JSON setting, such as
+    {"north": {}, "south": {"uri": "postgresql://...", "schema": null}}.
+    A tenant uses the default database unless it has a URI, and a schema
+    named after it unless it sets one (null keeps the database's default
+    schema, for a tenant with a database of its own). A tenant with a
+    "replica_uri" sends its read only routes to that read replica.
+    """
+    tenants = {}
+    for name, settings in json.loads(setting or "{}").items():
+        settings = settings or {}
+        tenants[name] = {
+            "uri": settings.get("uri"),
+            "schema": settings.get("schema", name),
+            "replica_uri": settings.get("replica_uri")
+        }
+    return tenants
+
+
+def tenant_binds(tenants, default_uri, engine_options, replica_uri = None):
+    """
+    Build the Flask-SQLAlchemy binds that give every tenant its own engine.
+    The pool is named after the tenant, so the time spent waiting on it is
+    tracked separately from the other tenants' pools. Read replicas get a
+    bind of their own: "replica" for the default database's replica and
+    "<tenant>:replica" for a tenant's.
+    """
+    binds = {
+        name: {
+            **engine_options,
+            "url": settings["uri"] or default_uri,
+            "pool_logging_name": name
+        }
+        for name, settings in tenants.items()
+    }
+    replicas = {None: replica_uri}
+    replicas.update({name: settings["replica_uri"] for name, settings in tenants.items()})
+    for name, uri in replicas.items():
+        if uri:
+            bind = f"{name}:replica" if name else "replica"
+            binds[bind] = {**engine_options, "url": uri, "pool_logging_name": bind}
+    return binds
+
+
+def tenant_engine(name, bind = None):
+    """
+    Return the engine of a tenant, or of another of its binds such as its
+    read replica, which puts the tenant's schema in place of the default
+    schema in every statement. The engine shares its connection pool with
+    the bind.
+    """
+    bind = bind or name
+    engines = current_app.extensions.setdefault("tenant_engines", {})
+    if bind not in engines:
+        engine = db.engines[bind]
+        schema = current_app.config["TENANTS"][name]["schema"]
+        if schema:
+            engine = engine.execution_options(schema_translate_map = {None: schema})
+        engines[bind] = engine
+    return engines[bind]
+
+
+def use_tenant(name):
+    """
+    Send the session's queries for the rest of the request or command to
+    the tenant's database.
+    """
+    g.tenant = name
+    g.tenant_engine = tenant_engine(name)
+
+
+def current_tenant():
+    return g.get("tenant")
+
+
+def current_engine():
+    """
+    Return the engine of the current tenant, or the default engine when
+    there is none, for code that works on raw connections.
+    """
+    return g.get("tenant_engine") or db.engine
+
+
+def current_schema():
+    """
+    Return the schema of the current tenant, or None for the default schema.
+    """
+    tenant = current_tenant()
+    return current_app.config["TENANTS"][tenant]["schema"] if tenant else None
+
+
+def table_name(table):
+    """
+    Return the quoted name of a table, in the current tenant's schema if
+    there is one, for the statements run on raw connections.
+    """
+    preparer = db.engine.dialect.identifier_preparer
+    schema = current_schema()
+    if schema:
+        return f"{preparer.quote_schema(schema)}.{preparer.quote(table.name)}"
+    return preparer.format_table(table)
+
+
+def create_tenant_tables():
+    """
+    Create the tables in the current tenant's schema, creating the schema
+    first if needed, or in the default database when there is no tenant.
+    """
+    schema = current_schema()
+    with current_engine().begin() as connection:
+        if schema:
+            connection.execute(CreateSchema(schema, if_not_exists = True))
+        db.metadata.create_all(connection)
+
+
+def drop_tenant_tables():
+    """
+    Drop the tables of the current tenant, or of the default database when
+    there is no tenant. The tenant's schema itself is left in place.
+    """
+    with current_engine().begin() as connection:
+        db.metadata.drop_all(connection)
+
+
+def tenant_option(command):
+    """
+    Add a --tenant option to a CLI command, running the command against
+    that tenant's database.
+    """
+    @click.option("--tenant", help = "Run the command against this tenant's database.")
+    @functools.wraps(command)
+    def tenant_command(*args, tenant = None, **kwargs):
+        if tenant is not None:
+            if tenant not in current_app.config["TENANTS"]:
+                raise click.ClickException(f"Unknown tenant {tenant}.")
+            use_tenant(tenant)
+        return command(*args, **kwargs)
+    return tenant_command
+
+
+def resolve_tenant():
+    """
+    Find the tenant named by the request: the tenant header if sent,
+    otherwise the subdomain in front of TENANT_DOMAIN, e.g. north in
+    north.lms.example.edu.
+    """
+    tenant = request.headers.get(current_app.config["TENANT_HEADER"])
+    domain = current_app.config["TENANT_DOMAIN"]
+    if not tenant and domain:
+        host = request.host.split(":")[0]
+        if host.endswith("." + domain):
+            tenant = host[:-len(domain) - 1]
+    return tenant
+
+
+def error_tenant_required():
+    header = current_app.config["TENANT_HEADER"]
+    return {"message": f"Please name the college with the {header} header or its subdomain."}, 400
+
+def error_unknown_tenant(tenant):
+    return {"message": f"College {tenant} does not exist."}, 404
+
+
+def register_tenancy(app):
+    """
+    This function resolves the tenant of every request before it is handled,
+    when tenants are configured for the Flask app.
+    """
+    if not app.config["TENANTS"]:
+        return
+
+    @app.before_request
+    def select_tenant():
+        """
+        Route the request to its tenant's database, or reject it if the
+        tenant is missing or unknown.
+        """
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        tenant = resolve_tenant()
+        if not tenant:
+            return error_tenant_required()
+        if tenant not in app.config["TENANTS"]:
+            return error_unknown_tenant(tenant)
+        use_tenant(tenant)
+        return None
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+This file works out term boundaries, which the enrolment routes use to limit their
+queries to the current term and 'flask db archive' uses to move past terms out of
+the enrolments table.
+"""
+
+# Built-in imports
+from datetime import date
+
+# Installed import packages
+from flask import current_app, request
+
+
+def term_start(on_day):
+    """
+    Return the first day of the term that the given day falls in. Terms start
+    on the first day of each month listed in TERM_START_MONTHS.
+    """
+    months = sorted(current_app.config["TERM_START_MONTHS"])
+    started = [month for month in months if month <= on_day.month]
+    if started:
+        return date(on_day.year, started[-1], 1)
+    return date(on_day.year - 1, months[-1], 1)
+
+
+def current_term_start():
+    """
+    Return the first day of the current term. CURRENT_TERM_START overrides
+    the calculated date, such as for a term that started early.
+    """
+    override = current_app.config["CURRENT_TERM_START"]
+    if override:
+        return date.fromisoformat(override)
+    return term_start(date.today())
+
+
+def term_cutoff():
+    """
+    Return the first day of the earliest term a list query should include.
+    List queries only show the current term unless the request asks for
+    every term still in the enrolments table with ?term=all, in which case
+    None is returned.
+    """
+    if request.args.get("term") == "all":
+        return None
+    return current_term_start()
\ No newline at end of file
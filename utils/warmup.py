@@ -0,0 +1,88 @@
+"""
+This file prepares the application before it starts serving requests. The ORM
+mappers and the marshmallow schemas (including the nested schemas referenced by
+name, such as "EnrolmentSchema") are normally set up on the first request each
+worker handles. Doing it once up front, in the gunicorn master when the app is
+preloaded, means every worker starts with them ready and shares the memory. The
+readiness check only passes in the process that marked itself warmed up, so a
+worker forked from the master waits until its own pool is warm.
+"""
+
+# Built-in imports
+import os
+
+# Installed import packages
+from marshmallow import fields
+from sqlalchemy.orm import configure_mappers
+
+# Local imports
+from init import db
+from schemas import schemas
+
+
+def resolve_nested_fields(schema, seen):
+    """
+    Resolve every nested schema of a schema instance, following the nested
+    schemas in turn. Schemas already resolved are skipped.
+    """
+    if id(schema) in seen:
+        return
+    seen.add(id(schema))
+
+    for field in schema.fields.values():
+        # Lists of nested schemas keep the nested field as their inner field
+        if isinstance(field, fields.List):
+            field = field.inner
+        if isinstance(field, fields.Nested):
+            resolve_nested_fields(field.schema, seen)
+
+
+def mark_warmed_up(app):
+    """
+    Mark this process as warmed up for the readiness check.
+    """
+    app.config["WARMED_UP"] = os.getpid()
+
+
+def warm_up_app(app):
+    """
+    Configure the ORM mappers and resolve the schemas used by the controllers,
+    then mark the process as warmed up for the readiness check. A gunicorn
+    worker forked from this process is marked by warm_up_pool instead.
+    """
+    configure_mappers()
+
+    seen = set()
+    for schema in vars(schemas).values():
+        if isinstance(schema, schemas.SQLAlchemyAutoSchema):
+            resolve_nested_fields(schema, seen)
+
+    mark_warmed_up(app)
+
+
+def warm_up_pool(app, connections):
+    """
+    Open the worker's database connections before its first request. Any
+    connections inherited from the gunicorn master are dropped first, as a
+    connection must never be shared between processes. Marks the worker as
+    warmed up once its connections are open.
+    """
+    with app.app_context():
+        # The default engine and every tenant's engine have their own pool
+        engines = list(db.engines.values())
+        for engine in engines:
+            engine.dispose(close = False)
+
+        opened = []
+        try:
+            for engine in engines:
+                for _ in range(connections):
+                    connection = engine.connect()
+                    connection.execute(db.text("SELECT 1"))
+                    opened.append(connection)
+        finally:
+            # Hand the connections back to the pool, ready for the requests
+            for connection in opened:
+                connection.close()
+
+    mark_warmed_up(app)
\ No newline at end of file